@@ -0,0 +1,171 @@
+# Local stand-ins for the Backboard and ElevenLabs clients used by the benchmark suite
+import asyncio
+import itertools
+import json
+import time
+import uuid
+from types import SimpleNamespace
+
+
+class FakeConfig:
+    """Latencies (seconds) and shapes of the fake upstream responses."""
+
+    def __init__(
+        self,
+        create_latency: float = 0.05,
+        upload_latency: float = 0.1,
+        index_delay: float = 1.0,
+        status_latency: float = 0.02,
+        llm_latency: float = 0.5,
+        llm_chunks: int = 40,
+        llm_chunk_interval: float = 0.02,
+        tts_latency: float = 0.3,
+        tts_chunks: int = 8,
+        tts_chunk_interval: float = 0.01,
+        tts_chunk_bytes: int = 4096,
+        stt_latency: float = 0.2,
+    ):
+        self.create_latency = create_latency
+        self.upload_latency = upload_latency
+        self.index_delay = index_delay
+        self.status_latency = status_latency
+        self.llm_latency = llm_latency
+        self.llm_chunks = llm_chunks
+        self.llm_chunk_interval = llm_chunk_interval
+        self.tts_latency = tts_latency
+        self.tts_chunks = tts_chunks
+        self.tts_chunk_interval = tts_chunk_interval
+        self.tts_chunk_bytes = tts_chunk_bytes
+        self.stt_latency = stt_latency
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class FakeBackboardClient:
+    """Async stand-in for backboard.BackboardClient with the methods the services call."""
+
+    def __init__(self, config: FakeConfig):
+        self.config = config
+        self.calls = {}
+        self._documents = {}  # {document_id: upload time}
+        self._counter = itertools.count()
+
+    def _count(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    async def create_assistant(self, name, description=None, **kwargs):
+        self._count("create_assistant")
+        await asyncio.sleep(self.config.create_latency)
+        return SimpleNamespace(assistant_id=str(uuid.uuid4()), name=name, description=description)
+
+    async def get_assistant(self, assistant_id):
+        self._count("get_assistant")
+        await asyncio.sleep(self.config.status_latency)
+        return SimpleNamespace(assistant_id=assistant_id)
+
+    async def delete_assistant(self, assistant_id):
+        self._count("delete_assistant")
+        await asyncio.sleep(self.config.create_latency)
+        return {"deleted": True}
+
+    async def create_thread(self, assistant_id):
+        self._count("create_thread")
+        await asyncio.sleep(self.config.create_latency)
+        return SimpleNamespace(thread_id=str(uuid.uuid4()), assistant_id=assistant_id)
+
+    async def delete_thread(self, thread_id):
+        self._count("delete_thread")
+        await asyncio.sleep(self.config.create_latency)
+        return {"deleted": True}
+
+    async def upload_document_to_assistant(self, assistant_id, file_path):
+        self._count("upload_document_to_assistant")
+        await asyncio.sleep(self.config.upload_latency)
+        document_id = str(uuid.uuid4())
+        self._documents[document_id] = time.monotonic()
+        return SimpleNamespace(document_id=document_id)
+
+    async def get_document_status(self, document_id):
+        self._count("get_document_status")
+        await asyncio.sleep(self.config.status_latency)
+        uploaded_at = self._documents.get(document_id, 0)
+        value = "indexed" if time.monotonic() - uploaded_at >= self.config.index_delay else "processing"
+        return SimpleNamespace(status=SimpleNamespace(value=value), status_message="")
+
+    def _reply(self, content: str) -> str:
+        # A counter keeps every reply unique so downstream caches do not hide upstream cost
+        n = next(self._counter)
+        if content.lstrip().startswith("Generate a lecture"):
+            return json.dumps({
+                "slide_content": [f"Point {i} of reply {n}" for i in range(1, 6)],
+                "lecture_script": " ".join(
+                    f"This is sentence {i} of benchmark lecture {n}, long enough to be spoken on its own."
+                    for i in range(12)
+                )
+            })
+        return " ".join(
+            f"Answer {n} sentence {i} explains the question in a reasonable amount of detail."
+            for i in range(4)
+        )
+
+    def _chunks(self, text: str):
+        size = max(1, -(-len(text) // self.config.llm_chunks))
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    async def add_message(self, thread_id, content, stream=False, **kwargs):
+        self._count("add_message_stream" if stream else "add_message")
+        reply = self._reply(content)
+
+        if stream:
+            async def chunks():
+                await asyncio.sleep(self.config.llm_latency / 4)  # time to first token
+                for piece in self._chunks(reply):
+                    await asyncio.sleep(self.config.llm_chunk_interval)
+                    yield {"type": "content_streaming", "content": piece}
+                yield {"type": "message_complete"}
+            return chunks()
+
+        await asyncio.sleep(self.config.llm_latency)
+        return SimpleNamespace(content=reply, status="COMPLETED", tool_calls=None, run_id=None)
+
+
+class _FakeTextToSpeech:
+    def __init__(self, config: FakeConfig, calls: dict):
+        self.config = config
+        self.calls = calls
+
+    def convert(self, voice_id, output_format, text, model_id, **kwargs):
+        # Blocking on purpose, like the real SDK
+        self.calls["text_to_speech"] = self.calls.get("text_to_speech", 0) + 1
+        time.sleep(self.config.tts_latency)
+
+        def chunks():
+            for _ in range(self.config.tts_chunks):
+                time.sleep(self.config.tts_chunk_interval)
+                yield b"\xff" * self.config.tts_chunk_bytes
+        return chunks()
+
+
+class _FakeSpeechToText:
+    def __init__(self, config: FakeConfig, calls: dict):
+        self.config = config
+        self.calls = calls
+
+    def convert(self, file, model_id, **kwargs):
+        self.calls["speech_to_text"] = self.calls.get("speech_to_text", 0) + 1
+        if isinstance(file, tuple):
+            file = file[1]
+        while file.read(64 * 1024):
+            pass
+        time.sleep(self.config.stt_latency)
+        return SimpleNamespace(text=f"What does benchmark question {uuid.uuid4().hex[:8]} mean?")
+
+
+class FakeElevenLabsClient:
+    """Synchronous stand-in for elevenlabs.client.ElevenLabs."""
+
+    def __init__(self, config: FakeConfig):
+        self.calls = {}
+        self.text_to_speech = _FakeTextToSpeech(config, self.calls)
+        self.speech_to_text = _FakeSpeechToText(config, self.calls)
@@ -0,0 +1,302 @@
+"""
+Offline benchmark / load test for the FastAPI backend.
+
+The Backboard and ElevenLabs clients are replaced with local fakes
+(benchmarks/fakes.py) with configurable latencies, so no API keys or network
+access are needed. Every endpoint is driven in-process at increasing
+concurrency and the results are written as JSON that can be diffed between
+releases.
+
+Usage (from the backend directory):
+    python benchmarks/run_benchmarks.py --concurrency 1,8,32 --requests 64 --output bench_results.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BACKEND_DIR)
+
+ENDPOINTS = ["ingestDocuments", "generateLecture", "generateLectureAudio", "askQuestion", "askQuestionAudio"]
+
+
+def configure_environment(work_dir: str):
+    # Must run before any services module is imported
+    os.environ.setdefault("BACKBOARD_API_KEY", "benchmark")
+    os.environ.setdefault("ELEVENLABS_API_KEY", "benchmark")
+    os.environ["SESSION_STORE"] = "memory"
+    os.environ["AUDIO_CACHE_DIR"] = os.path.join(work_dir, "session_cache")
+    os.environ["DOCUMENT_INDEX_DIR"] = os.path.join(work_dir, "document_index")
+    os.environ["PARSE_CACHE_DIR"] = os.path.join(work_dir, "parse_cache")
+    os.environ.setdefault("INDEX_POLL_INITIAL_DELAY", "0.1")
+    os.environ.setdefault("INDEX_POLL_MAX_DELAY", "1")
+
+
+def install_fakes(config):
+    """Swap the upstream clients in every loaded services module for the fakes."""
+    from benchmarks.fakes import FakeBackboardClient, FakeElevenLabsClient
+    import services.backboard_service as backboard_service
+    import services.eleven_labs as eleven_labs
+
+    real_backboard, real_eleven_labs = backboard_service.client, eleven_labs.client
+    fake_backboard, fake_eleven_labs = FakeBackboardClient(config), FakeElevenLabsClient(config)
+
+    import main  # noqa: F401  (loads every services module the app uses)
+    for name, module in list(sys.modules.items()):
+        if not name.startswith("services.") or not hasattr(module, "client"):
+            continue
+        if module.client is real_backboard:
+            module.client = fake_backboard
+        elif module.client is real_eleven_labs:
+            module.client = fake_eleven_labs
+    return fake_backboard, fake_eleven_labs
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    ordered = sorted(values)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        "p50": round(pick(0.50) * 1000, 2),
+        "p95": round(pick(0.95) * 1000, 2),
+        "p99": round(pick(0.99) * 1000, 2),
+        "mean": round(statistics.fmean(ordered) * 1000, 2),
+        "max": round(ordered[-1] * 1000, 2),
+    }
+
+
+class LoopLagMonitor:
+    """Measures how late a periodic sleep wakes up, i.e. how long the event loop was blocked."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - started - self.interval))
+
+    def start(self):
+        self.samples = []
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return percentiles(self.samples)
+
+
+class Scenario:
+    """Builds and checks the requests for one endpoint."""
+
+    def __init__(self, http, sessions):
+        self.http = http
+        self.sessions = sessions
+
+    def session(self, i):
+        return self.sessions[i % len(self.sessions)]
+
+    async def drain_audio(self, audio_url: str):
+        # Streamed audio URLs are read to the end so the pipeline work is part of the measurement
+        if "/audioStream/" in audio_url:
+            response = await self.http.get(audio_url)
+            response.raise_for_status()
+
+    async def ingestDocuments(self, i):
+        files = {"file": (f"bench_{i}.txt", io.BytesIO(f"benchmark document {i} {time.time_ns()}".encode() * 64), "text/plain")}
+        response = await self.http.post("/ingestDocuments", data={"session_id": self.session(i)}, files=files)
+        body = response.json()
+        return response.status_code == 200 and body.get("status") == "success", None
+
+    async def generateLecture(self, i):
+        response = await self.http.post("/generateLecture", json={"session_id": self.session(i), "topic": f"Benchmark topic {i} {time.time_ns()}"})
+        body = response.json()
+        return response.status_code == 200 and not body["lecture_script"].startswith(("Error", "System Error")), None
+
+    async def generateLectureAudio(self, i):
+        script = " ".join(f"Benchmark narration {i}.{n} {time.time_ns()} for the lecture audio test." for n in range(6))
+        response = await self.http.post("/generateLectureAudio", json={
+            "session_id": self.session(i), "topic": f"Topic {i}", "slide_content": [], "lecture_script": script
+        })
+        body = response.json()
+        return response.status_code == 200 and not body["audio_url"].startswith("Error"), None
+
+    async def askQuestion(self, i):
+        response = await self.http.post("/askQuestion", json={"session_id": self.session(i), "question": f"Question {i} {time.time_ns()}?"})
+        body = response.json()
+        ok = response.status_code == 200 and not body["answer"].startswith("Error")
+        if not ok:
+            return False, None
+        started = time.perf_counter()
+        await self.drain_audio(body["audio_url"])
+        return True, time.perf_counter() - started
+
+    async def askQuestionAudio(self, i):
+        files = {"audio_file": ("user_question.webm", io.BytesIO(b"\x1a\x45\xdf\xa3" * 4096), "audio/webm")}
+        response = await self.http.post("/askQuestionAudio", data={"session_id": self.session(i)}, files=files)
+        body = response.json()
+        ok = response.status_code == 200 and not body["answer"].startswith("Error")
+        if not ok:
+            return False, None
+        started = time.perf_counter()
+        await self.drain_audio(body["audio_url"])
+        return True, time.perf_counter() - started
+
+
+async def run_level(scenario: Scenario, endpoint: str, concurrency: int, total: int):
+    call = getattr(scenario, endpoint)
+    latencies, audio_latencies = [], []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                ok, audio_latency = await call(i)
+            except Exception:
+                ok, audio_latency = False, None
+            latencies.append(time.perf_counter() - started - (audio_latency or 0))
+            if audio_latency is not None:
+                audio_latencies.append(audio_latency)
+            if not ok:
+                errors += 1
+
+    monitor = LoopLagMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    loop_lag = await monitor.stop()
+
+    result = {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+        "latency_ms": percentiles(latencies),
+        "loop_lag_ms": loop_lag,
+    }
+    if audio_latencies:
+        result["audio_drain_ms"] = percentiles(audio_latencies)
+    return result
+
+
+async def run(args, config):
+    import httpx
+    from main import app
+
+    fake_backboard, fake_eleven_labs = install_fakes(config)
+    results = []
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+            # Every request needs a session with an assistant/thread, create a pool of them up front
+            sessions = [f"bench-session-{n}" for n in range(args.sessions)]
+            setup = Scenario(http, sessions)
+            await asyncio.gather(*(setup.ingestDocuments(n) for n in range(len(sessions))))
+
+            for endpoint in args.endpoints:
+                for concurrency in args.concurrency:
+                    total = max(args.requests, concurrency)
+                    result = await run_level(Scenario(http, sessions), endpoint, concurrency, total)
+                    print(
+                        f"{endpoint:<22} c={concurrency:<4} rps={result['throughput_rps']:<8} "
+                        f"p50={result['latency_ms']['p50']}ms p99={result['latency_ms']['p99']}ms "
+                        f"lag_max={result['loop_lag_ms']['max']}ms errors={result['errors']}"
+                    )
+                    results.append(result)
+
+    return results, {"backboard": fake_backboard.calls, "elevenlabs": fake_eleven_labs.calls}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except Exception:
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", type=lambda s: s.split(","), default=ENDPOINTS)
+    parser.add_argument("--concurrency", type=lambda s: [int(c) for c in s.split(",")], default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=64, help="requests per endpoint and concurrency level")
+    parser.add_argument("--sessions", type=int, default=8, help="number of sessions the requests are spread over")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--upload-latency", type=float, default=0.1)
+    parser.add_argument("--index-delay", type=float, default=1.0)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--llm-chunks", type=int, default=40)
+    parser.add_argument("--llm-chunk-interval", type=float, default=0.02)
+    parser.add_argument("--tts-latency", type=float, default=0.3)
+    parser.add_argument("--tts-chunk-interval", type=float, default=0.01)
+    parser.add_argument("--stt-latency", type=float, default=0.2)
+    args = parser.parse_args()
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main():
+    args = parse_args()
+    work_dir = tempfile.mkdtemp(prefix="kt_bench_")
+    configure_environment(work_dir)
+
+    from benchmarks.fakes import FakeConfig
+    config = FakeConfig(
+        upload_latency=args.upload_latency,
+        index_delay=args.index_delay,
+        llm_latency=args.llm_latency,
+        llm_chunks=args.llm_chunks,
+        llm_chunk_interval=args.llm_chunk_interval,
+        tts_latency=args.tts_latency,
+        tts_chunk_interval=args.tts_chunk_interval,
+        stt_latency=args.stt_latency,
+    )
+
+    results, upstream_calls = asyncio.run(run(args, config))
+
+    report = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fake_config": config.to_dict(),
+        "concurrency_levels": args.concurrency,
+        "requests_per_level": args.requests,
+        "results": results,
+        "upstream_calls": upstream_calls,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
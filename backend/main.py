@@ -1,27 +1,110 @@
-import re
+import asyncio
+import logging
 import os
-import shutil
-import tempfile
 import json
+from collections import defaultdict
+from contextlib import asynccontextmanager
 from datetime import datetime
+from typing import List, Optional
 
-from fastapi import FastAPI, UploadFile, File, Form, Request
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, UploadFile, File, Form, Query, Request, HTTPException
+from fastapi.responses import StreamingResponse, PlainTextResponse, FileResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles # This is for serving static files
 
-from models import LectureTopicRequest, GeneratedLectureResponse, LectureAudioResponse, QARequest, QAResponse, IngestSuccessResponse
+from models import LectureTopicRequest, CurriculumRequest, GeneratedLectureResponse, LectureAudioResponse, QARequest, QAResponse, IngestSuccessResponse, IngestBatchResponse, IngestJobStatus, IngestJobsResponse
 
-from services.backboard_service import create_assistant, create_thread, delete_thread
+from services.backboard_service import create_assistant, create_thread, delete_thread, backboard_upstream
 from services.backboard_rag import upload_document_to_assistant
-from services.backboard_llm import send_message, send_message_with_memory, send_message_streaming
-from services.eleven_labs import text_to_speech, speech_to_text
-
-session_assistants = {}  # {session_id: assistant_id}
-session_threads = {}     # {session_id: thread_id}
-session_documents = {}   # {session_id: [list of document info]}
-
-app = FastAPI()
+from services.backboard_llm import send_message, send_message_with_memory, send_message_streaming, llm_flights, message_scheduler, model_router
+from services.resilience import UpstreamUnavailable
+from services.lecture_parser import LectureStreamParser, extract_lecture_json, LECTURE_PARSE_FAILED
+from services.lecture_cache import LectureCache
+from services.answer_cache import AnswerCache
+from services.ingest_jobs import IngestJob, IngestJobQueue
+from services.speech_pipeline import SpeechStream, SpeechStreamRegistry
+from services.lecture_audio import LectureAudioRenderer, LectureAudioPrefetcher
+from services.session_store import create_session_repository
+from services.session_reaper import SessionReaper, delete_remote_session
+from services.document_index import DocumentIndex
+from services.metrics import MetricsMiddleware, registry as metrics_registry, profiler, PROFILER_MIN_INTERVAL, PROFILER_MAX_INTERVAL
+from services.uploads import UploadTooLarge, check_upload_size, spool_upload, upload_stream, MAX_UPLOAD_BYTES, MAX_AUDIO_UPLOAD_BYTES
+from services.eleven_labs import text_to_speech_async, speech_to_text_async, tts_cache, audio_pool, tts_flights, elevenlabs_upstream, audio_janitor, audio_cache as audio_cache_dir
+from services.eleven_labs import resolve_output_format, is_concatenable, UnsupportedAudioFormat, OUTPUT_FORMAT, STREAM_FALLBACK_FORMAT
+from services.audio_cache import media_type_for, extension_for_format
+from services.audio_janitor import is_legacy_filename
+
+logger = logging.getLogger(__name__)
+
+# Session -> assistant/thread/documents, persisted in sessions.db and shared between workers
+session_store = create_session_repository()
+session_locks = defaultdict(asyncio.Lock)  # {session_id: lock guarding assistant creation}
+
+lecture_cache = LectureCache()
+answer_cache = AnswerCache()
+
+# Local chunk index, used to put only the relevant passages into prompts
+document_index = DocumentIndex()
+
+ingest_jobs = IngestJobQueue()
+ingest_inflight = {}  # {(session_id, content_hash): IngestJob currently uploading those bytes}
+speech_streams = SpeechStreamRegistry()
+# Long lecture scripts are synthesized in paragraph chunks and stitched into one file
+lecture_audio = LectureAudioRenderer()
+# Optionally renders a lecture's audio in the background as soon as its script exists (LECTURE_AUDIO_PREFETCH=1)
+audio_prefetcher = LectureAudioPrefetcher(lecture_audio)
+
+async def forget_session(session_id: str):
+    """Drop everything this process keeps for a session that was deleted from the store."""
+    session_locks.pop(session_id, None)
+    lecture_cache.invalidate_session(session_id)
+    answer_cache.invalidate_session(session_id)
+    ingest_jobs.forget_session(session_id)
+    await asyncio.to_thread(document_index.delete_session, session_id)
+    audio_prefetcher.cancel_session(session_id)
+    audio_janitor.schedule_purge(session_id)
+
+# Deletes sessions nobody used for SESSION_IDLE_TTL_SECONDS, with their Backboard thread and assistant
+session_reaper = SessionReaper(session_store, forget_session)
+
+# Runtime stats of each component, served by /getStats and exported as gauges on /metrics
+STATS_SOURCES = {
+    "audio_cache": tts_cache.stats,
+    "audio_pool": audio_pool.stats,
+    "tts_single_flight": tts_flights.stats,
+    "llm_single_flight": llm_flights.stats,
+    "backboard_scheduler": message_scheduler.stats,
+    "llm_router": model_router.stats,
+    "backboard_upstream": backboard_upstream.stats,
+    "elevenlabs_upstream": elevenlabs_upstream.stats,
+    "ingest_jobs": ingest_jobs.stats,
+    "speech_streams": speech_streams.stats,
+    "lecture_audio": lecture_audio.stats,
+    "lecture_audio_prefetch": audio_prefetcher.stats,
+    "audio_janitor": audio_janitor.stats,
+    "session_store": session_store.stats,
+    "session_reaper": session_reaper.stats,
+    "lecture_cache": lecture_cache.stats,
+    "answer_cache": answer_cache.stats,
+    "document_index": document_index.stats,
+    "parse_cache": document_index.parse_cache.stats,
+    "parse_pool": document_index.parse_pool.stats,
+}
+for name, collect in STATS_SOURCES.items():
+    metrics_registry.register_collector(name, collect)
+
+# The sampling profiler endpoints are only exposed when explicitly enabled
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    audio_janitor.start()
+    session_reaper.start()
+    yield
+    await session_reaper.stop()
+    await session_store.flush_access()
+    await audio_janitor.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -32,85 +115,241 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files for audio
-app.mount("/audio", StaticFiles(directory="session_cache"), name="audio")
+# Per-route request latency for /metrics
+app.add_middleware(MetricsMiddleware)
+
+async def ensure_session_assistant(session_id: str) -> str:
+    """Create the assistant and thread for a session on first use, return the assistant id."""
+    async with session_locks[session_id]:
+        session = await session_store.get_session(session_id)
+        if session:
+            return session["assistant_id"]
+
+        assistant = await create_assistant(
+            name=f"Assistant for {session_id}",
+            description="AI onboarding assistant"
+        )
+        thread = await create_thread(assistant.assistant_id)
+
+        # Another worker process may have created the session in the meantime, its row wins
+        session = await session_store.create_session(session_id, assistant.assistant_id, thread.thread_id)
+        if session["thread_id"] != thread.thread_id:
+            await delete_remote_session({"thread_id": thread.thread_id, "assistant_id": assistant.assistant_id})
+
+    return session["assistant_id"]
+
+async def get_session_thread(session_id: str):
+    """Return the Backboard thread id of a session, or None if the session does not exist."""
+    session = await session_store.get_session(session_id)
+    return session["thread_id"] if session else None
+
+async def track_document(session_id: str, filename: str, document_id: str, size: int, content_type: str, job_id: str = None, content_hash: str = None):
+    # The document set changed, lectures generated for the old set are stale
+    lecture_cache.invalidate_session(session_id)
+    answer_cache.invalidate_session(session_id)
+    await session_store.add_document(session_id, {
+        "filename": filename,
+        "document_id": str(document_id),
+        "uploaded_at": datetime.now().isoformat(),
+        "size": size,
+        "content_type": content_type or "unknown",
+        "job_id": job_id,
+        "content_hash": content_hash
+    })
+
+async def run_ingest_job(job: IngestJob):
+    """Upload one queued file to the session assistant and wait for it to be indexed."""
+    key = (job.session_id, job.content_hash)
+
+    while True:
+        # Same bytes already indexed for this session -> reuse that document
+        existing = await session_store.find_document(job.session_id, job.content_hash)
+        if existing:
+            job.deduplicated = True
+            return existing["document_id"]
+
+        # Same bytes currently being indexed by another job -> wait for it instead of uploading twice
+        inflight = ingest_inflight.get(key)
+        if not inflight:
+            break
+        await inflight.done.wait()
+
+    ingest_inflight[key] = job
+    try:
+        assistant_id = await ensure_session_assistant(job.session_id)
+
+        # The local chunk index is built while Backboard uploads and indexes the same file
+        local_index = asyncio.create_task(
+            document_index.index_file_async(job.session_id, job.content_hash, job.filename, job.temp_path)
+        )
+        try:
+            document = await upload_document_to_assistant(assistant_id, job.temp_path)
+        except BaseException:
+            await asyncio.gather(local_index, return_exceptions=True)
+            await asyncio.to_thread(document_index.remove_document, job.session_id, job.content_hash)
+            raise
+        try:
+            await local_index
+        except Exception as e:
+            # Questions still work without local context, Backboard has the document
+            logger.warning("Local indexing of %s failed: %s", job.filename, e)
+
+        # Track the document
+        await track_document(
+            job.session_id, job.filename, document.document_id, job.size, job.content_type,
+            job_id=job.job_id, content_hash=job.content_hash
+        )
+        return document.document_id
+    finally:
+        ingest_inflight.pop(key, None)
+
+async def submit_ingest_jobs_for(session_id: str, files: List[UploadFile]) -> List[IngestJob]:
+    # Reject oversized files before anything is spooled or queued
+    for file in files:
+        check_upload_size(file, MAX_UPLOAD_BYTES)
+
+    jobs = []
+    for file in files:
+        upload = await spool_upload(file)
+        jobs.append(ingest_jobs.submit(
+            session_id=session_id,
+            filename=file.filename,
+            content_type=file.content_type,
+            temp_path=upload.path,
+            size=upload.size,
+            runner=run_ingest_job,
+            temp_dir=upload.temp_dir,
+            content_hash=upload.content_hash
+        ))
+    return jobs
+
+def ingest_result(job: IngestJob) -> dict:
+    """IngestSuccessResponse payload for a finished job."""
+    if job.status != "indexed":
+        return {
+            "status": "error",
+            "message": job.error or "Document ingest failed",
+            "document_id": "",
+            "filename": job.filename
+        }
+
+    if job.deduplicated:
+        message = f"Document already indexed for session {job.session_id}"
+    else:
+        message = f"Successfully uploaded document for session {job.session_id}"
+    return {
+        "status": "success",
+        "message": message,
+        "document_id": job.document_id,
+        "filename": job.filename
+    }
 
 @app.post("/ingestDocuments", response_model=IngestSuccessResponse)
 async def ingest_documents(session_id: str = Form(...), file: UploadFile = File(...)):
-    # temp_path = f"/tmp/{file.filename}" # For AWS Lambda
-    temp_dir = tempfile.gettempdir()
-    temp_path = os.path.join(temp_dir, file.filename)
-    
-    with open(temp_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
     try:
+        # Goes through the same bounded queue as /ingestJobs, but waits for the result
+        [job] = await submit_ingest_jobs_for(session_id, [file])
+        return ingest_result(await ingest_jobs.wait(job))
 
-        if session_id not in session_assistants:
-            assistant = await create_assistant(
-                name=f"Assistant for {session_id}",
-                description="AI onboarding assistant"
-            )
-
-            session_assistants[session_id] = assistant.assistant_id
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
 
-            thread = await create_thread(assistant.assistant_id)
-            session_threads[session_id] = thread.thread_id
+# Multi-file variant of /ingestDocuments, files are uploaded and indexed concurrently
+@app.post("/ingestDocumentsBatch", response_model=IngestBatchResponse)
+async def ingest_documents_batch(session_id: str = Form(...), files: List[UploadFile] = File(...)):
+    try:
+        jobs = await submit_ingest_jobs_for(session_id, files)
+        jobs = await asyncio.gather(*(ingest_jobs.wait(job) for job in jobs))
 
-        assistant_id = session_assistants[session_id]
+        results = [ingest_result(job) for job in jobs]
+        failed = sum(1 for result in results if result["status"] == "error")
+        return {
+            "status": "success" if not failed else "partial" if failed < len(results) else "error",
+            "message": f"Indexed {len(results) - failed} of {len(results)} documents for session {session_id}",
+            "results": results
+        }
 
-        document = await upload_document_to_assistant(assistant_id, temp_path)
-        
-        # Track the document
-        if session_id not in session_documents:
-            session_documents[session_id] = []
-        
-        # Get file size
-        file_size = os.path.getsize(temp_path) if os.path.exists(temp_path) else 0
-        
-        session_documents[session_id].append({
-            "filename": file.filename,
-            "document_id": str(document.document_id),
-            "uploaded_at": datetime.now().isoformat(),
-            "size": file_size,
-            "content_type": file.content_type or "unknown"
-        })
-        
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
         return {
-            "status": "success",
-            "message": f"Successfully uploaded document for session {session_id}",
-            "document_id": str(document.document_id),
-            "filename": file.filename
+            "status": "error",
+            "message": str(e),
+            "results": []
         }
 
+# Queue documents for ingest and return job ids right away, poll /ingestJobs/{job_id} for progress
+@app.post("/ingestJobs", response_model=IngestJobsResponse)
+async def submit_ingest_jobs(session_id: str = Form(...), files: List[UploadFile] = File(...)):
+    try:
+        jobs = await submit_ingest_jobs_for(session_id, files)
+        return {
+            "status": "queued",
+            "message": f"Queued {len(jobs)} documents for session {session_id}",
+            "jobs": [job.to_dict() for job in jobs]
+        }
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         return {
             "status": "error",
-            "message": str(e)
+            "message": str(e),
+            "jobs": []
         }
-    
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        
+
+@app.get("/ingestJobs/{job_id}", response_model=IngestJobStatus)
+async def get_ingest_job(job_id: str):
+    """Get the status and timings of a single ingest job"""
+    job = ingest_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Ingest job {job_id} not found")
+    return job.to_dict()
+
+# Endpoint to list the ingest jobs of a session (queued, running and finished)
+@app.get("/getIngestJobs/{session_id}")
+async def get_ingest_jobs(session_id: str):
+    """Get list of ingest jobs for a session"""
+    jobs = [job.to_dict() for job in ingest_jobs.for_session(session_id)]
+    return {
+        "session_id": session_id,
+        "jobs": jobs,
+        "count": len(jobs)
+    }
 
 # Endpoint where user requests lecture generation on a topic they input
 # ... (imports and other endpoints above)
 
-@app.post("/generateLecture", response_model=GeneratedLectureResponse)
-async def generate_lecture(request: LectureTopicRequest):
-    try:
-        thread_id = session_threads.get(request.session_id)
-        if not thread_id:
-            return {
-                "session_id": request.session_id,
-                "topic": request.topic,
-                "slide_content": [],
-                "lecture_script": "Error: Session not found."
-            }
-            
-        prompt = f"""Generate a lecture on {request.topic}. 
-            Use the uploaded documents as context.
+def format_passages(passages: List[dict]) -> str:
+    """Number the retrieved chunks and label them with their source file."""
+    return "\n\n".join(
+        f"[{index}] ({passage['filename']}) {passage['text']}"
+        for index, passage in enumerate(passages, start=1)
+    )
+
+def source_documents(passages: List[dict]) -> List[str]:
+    """Filenames of the retrieved chunks, best match first, without duplicates."""
+    return list(dict.fromkeys(passage["filename"] for passage in passages))
+
+def build_question_prompt(question: str, passages: List[dict]) -> str:
+    if not passages:
+        return question
+    return f"""Answer the question using these excerpts from the uploaded documents.
+            {format_passages(passages)}
+
+            Question: {question}"""
+
+def build_lecture_prompt(topic: str, passages: List[dict] = None) -> str:
+    if passages:
+        context = f"Use these excerpts from the uploaded documents as context:\n{format_passages(passages)}"
+    else:
+        context = "Use the uploaded documents as context."
+    return f"""Generate a lecture on {topic}. 
+            {context}
             Return ONLY a valid JSON object. Do not include introductory text.
             Format:
             {{
@@ -118,44 +357,132 @@ async def generate_lecture(request: LectureTopicRequest):
                 "lecture_script": "Your script here..."
             }}"""
 
-        response = await send_message(
-            thread_id=thread_id,
-            content=prompt,
-            memory="Auto"
-        )
+def lecture_from_raw(session_id: str, topic: str, raw_content: str) -> dict:
+    """Turn the raw LLM output into a GeneratedLectureResponse payload."""
+    raw_content = raw_content.strip()
 
-        if not response.content:
-             return {"session_id": request.session_id, "topic": request.topic, "slide_content": [], "lecture_script": "Empty response"}
+    # --- ROBUST JSON EXTRACTION ---
+    try:
+        response_json = extract_lecture_json(raw_content)
+    except json.JSONDecodeError as e:
+        # If parsing still fails, we return the raw text so the UI doesn't crash
+        return {
+            "session_id": session_id,
+            "topic": topic,
+            "slide_content": [LECTURE_PARSE_FAILED],
+            "lecture_script": raw_content # Fallback to showing the text as is
+        }
 
-        raw_content = response.content.strip()
+    return {
+        "session_id": session_id,
+        "topic": topic,
+        "slide_content": response_json.get("slide_content", []),
+        "lecture_script": response_json.get("lecture_script", "")
+    }
 
-        # --- ROBUST JSON EXTRACTION ---
-        # 1. Try to find JSON block using Regex (extracts anything between the first { and last })
-        json_match = re.search(r"(\{.*\})", raw_content, re.DOTALL)
-        
-        if json_match:
-            clean_content = json_match.group(1)
-        else:
-            # 2. Fallback: Manual markdown cleanup if regex fails
-            clean_content = raw_content.replace("```json", "").replace("```", "").strip()
+async def lecture_cache_key(session_id: str, topic: str) -> str:
+    documents = await session_store.list_documents(session_id)
+    return lecture_cache.key_for(session_id, topic, documents)
+
+def cache_lecture(cache_key: str, lecture: dict):
+    # Errors and unparseable output are not worth keeping
+    if lecture["lecture_script"] and lecture["slide_content"] != [LECTURE_PARSE_FAILED]:
+        lecture_cache.put(cache_key, lecture["session_id"], lecture)
+
+async def produce_lecture(session_id: str, topic: str, thread_id: str, memory: str, cache_key: str = None) -> dict:
+    """Return the lecture for topic, from the lecture cache or generated on thread_id."""
+    # Same topic on an unchanged document set -> reuse the earlier lecture
+    cache_key = cache_key or await lecture_cache_key(session_id, topic)
+    cached = lecture_cache.get(cache_key)
+    if cached:
+        return {**cached, "session_id": session_id, "topic": topic}
+
+    passages = await document_index.search_async(session_id, topic)
+    # Concurrent requests for the same cache key share one generation
+    response = await send_message(
+        thread_id=thread_id,
+        content=build_lecture_prompt(topic, passages),
+        memory=memory,
+        coalesce_key=cache_key,
+        request_class="lecture"
+    )
+
+    if not response.content:
+        return {"session_id": session_id, "topic": topic, "slide_content": [], "lecture_script": "Empty response"}
+
+    lecture = lecture_from_raw(session_id, topic, response.content)
+    cache_lecture(cache_key, lecture)
+    return lecture
+
+async def answer_cache_scope(session_id: str) -> str:
+    documents = await session_store.list_documents(session_id)
+    return answer_cache.scope_for(session_id, documents)
+
+def cache_answer(scope: str, session_id: str, question: str, answer: str, passages: List[dict], speech: SpeechStream, output_format: str):
+    if answer:
+        answer_cache.put(scope, session_id, question, {
+            "answer": answer,
+            "source_documents": source_documents(passages),
+            "audio_streams": {output_format: speech.stream_id}
+        })
 
+def cached_answer_audio_url(audioRequest: Request, session_id: str, cached: dict, output_format: str) -> str:
+    """Audio of a cached answer: the speech stream of the original answer while it is retained, else a new one."""
+    # audio_streams is shared with the cache entry, so a replacement stream is reused by later hits
+    streams = cached["audio_streams"]
+    stream = speech_streams.get(streams.get(output_format, ""))
+    if stream is None or stream.session_id != session_id or stream.failed_segments:
+        stream = start_speech_stream(session_id, cached["answer"], output_format)
+        streams[output_format] = stream.stream_id
+    return speech_stream_url(audioRequest, stream)
+
+def prefetch_lecture_audio(lecture: dict, output_format: str):
+    """Start rendering the lecture's audio in the background, /generateLectureAudio usually follows."""
+    # Errors come back with no slides, unparseable output with the parse-failed marker
+    if lecture["lecture_script"] and lecture["slide_content"] and lecture["slide_content"] != [LECTURE_PARSE_FAILED]:
+        audio_prefetcher.enqueue(lecture["session_id"], lecture["lecture_script"], output_format)
+
+def format_sse(event: str, data) -> str:
+    """Format one Server-Sent Events message with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def unavailable_error(e: UpstreamUnavailable) -> HTTPException:
+    """429 (overloaded) or 503 (upstream down) with a Retry-After hint, instead of a hung request."""
+    return HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": e.retry_after_header})
+
+def unavailable_event(e: UpstreamUnavailable) -> str:
+    return format_sse("error", {"message": str(e), "retry_after": e.retry_after_header})
+
+async def check_stream_admission(session_id: str):
+    """Reject a streaming request with a 429 up front, before the 200 response has started."""
+    thread_id = await get_session_thread(session_id)
+    if thread_id:
         try:
-            response_json = json.loads(clean_content)
-        except json.JSONDecodeError as e:
-            # If parsing still fails, we return the raw text so the UI doesn't crash
+            message_scheduler.check_admission(thread_id)
+        except UpstreamUnavailable as e:
+            raise unavailable_error(e)
+
+@app.post("/generateLecture", response_model=GeneratedLectureResponse)
+async def generate_lecture(audioRequest: Request, request: LectureTopicRequest, audio_format: Optional[str] = None):
+    # Only used to prefetch the lecture audio in the format the client will ask for
+    output_format = negotiate_audio_format(audioRequest, audio_format)
+    try:
+        thread_id = await get_session_thread(request.session_id)
+        if not thread_id:
             return {
                 "session_id": request.session_id,
                 "topic": request.topic,
-                "slide_content": ["Failed to parse AI structure"],
-                "lecture_script": raw_content # Fallback to showing the text as is
+                "slide_content": [],
+                "lecture_script": "Error: Session not found."
             }
 
-        return {
-            "session_id": request.session_id,
-            "topic": request.topic,
-            "slide_content": response_json.get("slide_content", []),
-            "lecture_script": response_json.get("lecture_script", "")
-        }
+        lecture = await produce_lecture(request.session_id, request.topic, thread_id, memory="Auto")
+        prefetch_lecture_audio(lecture, output_format)
+        return lecture
+    except UpstreamUnavailable as e:
+        raise unavailable_error(e)
     except Exception as e:
         return {
             "session_id": request.session_id,
@@ -164,12 +491,189 @@ async def generate_lecture(request: LectureTopicRequest):
             "lecture_script": f"System Error: {str(e)}"
         }   
 
+# Streaming variant of /generateLecture (Server-Sent Events)
+# Events: "slide" for each finished bullet, "script" for script text deltas,
+# "done" with the full GeneratedLectureResponse, "error" on failure
+@app.post("/generateLectureStream")
+async def generate_lecture_stream(audioRequest: Request, request: LectureTopicRequest, audio_format: Optional[str] = None):
+    output_format = negotiate_audio_format(audioRequest, audio_format)
+
+    async def event_stream():
+        try:
+            thread_id = await get_session_thread(request.session_id)
+            if not thread_id:
+                yield format_sse("error", {"message": "Error: Session not found."})
+                return
+
+            cache_key = await lecture_cache_key(request.session_id, request.topic)
+            cached = lecture_cache.get(cache_key)
+            if cached:
+                lecture = {**cached, "session_id": request.session_id, "topic": request.topic}
+                prefetch_lecture_audio(lecture, output_format)
+                for index, slide in enumerate(lecture["slide_content"]):
+                    yield format_sse("slide", {"index": index, "text": slide})
+                yield format_sse("script", {"delta": lecture["lecture_script"]})
+                yield format_sse("done", lecture)
+                return
+
+            passages = await document_index.search_async(request.session_id, request.topic)
+            parser = LectureStreamParser()
+            async for chunk in send_message_streaming(
+                thread_id=thread_id,
+                content=build_lecture_prompt(request.topic, passages),
+                memory="Auto",
+                request_class="lecture"
+            ):
+                for event, value in parser.feed(chunk):
+                    if event == "slide":
+                        yield format_sse("slide", {"index": len(parser.slides) - 1, "text": value})
+                    else:
+                        yield format_sse("script", {"delta": value})
+
+            if not parser.raw.strip():
+                yield format_sse("error", {"message": "Empty response"})
+                return
+
+            lecture = lecture_from_raw(request.session_id, request.topic, parser.raw)
+            cache_lecture(cache_key, lecture)
+            prefetch_lecture_audio(lecture, output_format)
+            yield format_sse("done", lecture)
+        except UpstreamUnavailable as e:
+            yield unavailable_event(e)
+        except Exception as e:
+            yield format_sse("error", {"message": f"System Error: {str(e)}"})
+
+    await check_stream_admission(request.session_id)
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+def negotiate_audio_format(audioRequest: Request, audio_format: Optional[str]) -> str:
+    """Output format for a request: ?audio_format= if given, low bitrate for "Save-Data: on" clients, else the default."""
+    save_data = audioRequest.headers.get("save-data", "").strip().lower() == "on"
+    try:
+        return resolve_output_format(audio_format, save_data)
+    except UnsupportedAudioFormat as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def start_speech_stream(session_id: str, text: str = None, output_format: str = OUTPUT_FORMAT) -> SpeechStream:
+    """Start a sentence-level TTS pipeline, optionally with the complete text already known."""
+    # Segments are appended to each other, so the stream has to use a format that concatenates
+    if not is_concatenable(output_format):
+        output_format = STREAM_FALLBACK_FORMAT
+    stream = speech_streams.create(
+        session_id,
+        lambda sid, sentence: text_to_speech_async(sid, sentence, output_format),
+        media_type_for(extension_for_format(output_format))
+    )
+    if text is not None:
+        stream.add_text(text)
+        stream.close()
+    return stream
+
+def speech_stream_url(audioRequest: Request, stream: SpeechStream) -> str:
+    base_url = str(audioRequest.base_url).rstrip("/")
+    return f"{base_url}/audioStream/{stream.stream_id}"
+
+# Lectures of a curriculum run concurrently, each on its own short-lived thread of the session's assistant
+CURRICULUM_MAX_PARALLEL = int(os.getenv("CURRICULUM_MAX_PARALLEL", "4"))
+CURRICULUM_MAX_TOPICS = int(os.getenv("CURRICULUM_MAX_TOPICS", "50"))
+# The curriculum threads read the assistant's memory but do not add ten lectures' worth to it
+CURRICULUM_MEMORY = os.getenv("CURRICULUM_MEMORY", "Readonly")
+
+curriculum_cleanups = set()  # thread deletions still running, referenced so they are not garbage collected
+
+async def discard_thread(thread_id: str):
+    try:
+        await delete_thread(thread_id)
+    except Exception as e:
+        logger.warning("Could not delete curriculum thread %s: %s", thread_id, e)
+
+# Generate lectures for many topics at once (Server-Sent Events)
+# Events, in completion order: "lecture" with the index and GeneratedLectureResponse of a topic,
+# "audio" with its audio_url when include_audio is set, "error" for a failed topic,
+# "done" with the number of lectures generated and failed
+@app.post("/generateCurriculum")
+async def generate_curriculum(audioRequest: Request, request: CurriculumRequest, audio_format: Optional[str] = None):
+    output_format = negotiate_audio_format(audioRequest, audio_format)
+    if not request.topics:
+        raise HTTPException(status_code=400, detail="No topics given")
+    if len(request.topics) > CURRICULUM_MAX_TOPICS:
+        raise HTTPException(status_code=400, detail=f"At most {CURRICULUM_MAX_TOPICS} topics per curriculum")
+    parallel = max(1, min(request.max_parallel or CURRICULUM_MAX_PARALLEL, CURRICULUM_MAX_PARALLEL))
+    base_url = str(audioRequest.base_url).rstrip("/")
+
+    async def generate_item(index: int, topic: str, assistant_id: str, semaphore: asyncio.Semaphore, events: asyncio.Queue):
+        try:
+            async with semaphore:
+                cache_key = await lecture_cache_key(request.session_id, topic)
+                cached = lecture_cache.get(cache_key)
+                if cached:
+                    lecture = {**cached, "session_id": request.session_id, "topic": topic}
+                else:
+                    # A thread of its own, so the topics do not queue behind each other on the session thread
+                    thread = await create_thread(assistant_id)
+                    try:
+                        lecture = await produce_lecture(request.session_id, topic, str(thread.thread_id), CURRICULUM_MEMORY, cache_key)
+                    finally:
+                        cleanup = asyncio.create_task(discard_thread(thread.thread_id))
+                        curriculum_cleanups.add(cleanup)
+                        cleanup.add_done_callback(curriculum_cleanups.discard)
+            await events.put(format_sse("lecture", {"index": index, **lecture}))
+            if not lecture["slide_content"] or lecture["slide_content"] == [LECTURE_PARSE_FAILED]:
+                await events.put(format_sse("error", {"index": index, "topic": topic, "message": lecture["lecture_script"]}))
+                return False
+            if request.include_audio:
+                path = await lecture_audio.render(request.session_id, lecture["lecture_script"], output_format)
+                await events.put(format_sse("audio", {"index": index, "audio_url": f"{base_url}/audio/{os.path.basename(path)}"}))
+            return True
+        except UpstreamUnavailable as e:
+            await events.put(format_sse("error", {"index": index, "topic": topic, "message": str(e), "retry_after": e.retry_after_header}))
+        except Exception as e:
+            await events.put(format_sse("error", {"index": index, "topic": topic, "message": f"System Error: {str(e)}"}))
+        finally:
+            # Tells the event stream this topic is finished
+            events.put_nowait(None)
+        return False
+
+    async def event_stream():
+        session = await session_store.get_session(request.session_id)
+        if not session:
+            yield format_sse("error", {"message": "Error: Session not found."})
+            return
+
+        semaphore = asyncio.Semaphore(parallel)
+        events = asyncio.Queue()
+        tasks = [
+            asyncio.create_task(generate_item(index, topic, session["assistant_id"], semaphore, events))
+            for index, topic in enumerate(request.topics)
+        ]
+        try:
+            finished = 0
+            while finished < len(tasks):
+                event = await events.get()
+                if event is None:
+                    finished += 1
+                else:
+                    yield event
+            completed = sum(1 for task in tasks if task.result())
+            yield format_sse("done", {
+                "session_id": request.session_id,
+                "completed": completed,
+                "failed": len(tasks) - completed
+            })
+        finally:
+            # Client went away: stop the topics that have not finished
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 # Endpoint to generate audio lecture from generated lecture script
 @app.post("/generateLectureAudio", response_model=LectureAudioResponse)
-async def generate_lecture_audio(audioRequest: Request, request: GeneratedLectureResponse):
+async def generate_lecture_audio(audioRequest: Request, request: GeneratedLectureResponse, audio_format: Optional[str] = None):
+    output_format = negotiate_audio_format(audioRequest, audio_format)
     try:
-        audio_file_path = text_to_speech(session_id=request.session_id, text=request.lecture_script)
-        
+        audio_file_path = await audio_prefetcher.render(request.session_id, request.lecture_script, output_format)
+
         filename = os.path.basename(audio_file_path)
         base_url = str(audioRequest.base_url).rstrip("/")
         audio_url = f"{base_url}/audio/{filename}"
@@ -189,10 +693,11 @@ async def generate_lecture_audio(audioRequest: Request, request: GeneratedLectur
         }
 
 @app.post("/askQuestionAudio", response_model=QAResponse)
-async def ask_question_audio(audioRequest: Request, session_id: str = Form(...), audio_file: UploadFile = File(...)):
+async def ask_question_audio(audioRequest: Request, session_id: str = Form(...), audio_file: UploadFile = File(...), audio_format: Optional[str] = None):
+    output_format = negotiate_audio_format(audioRequest, audio_format)
     try:
-        audio_bytes = await audio_file.read()
-        user_question_text = speech_to_text(audio_bytes)
+        # The spooled upload goes straight to the SDK, no in-memory copy of the recording
+        user_question_text = await speech_to_text_async(upload_stream(audio_file, MAX_AUDIO_UPLOAD_BYTES))
         
         if not user_question_text:
             return {
@@ -203,7 +708,7 @@ async def ask_question_audio(audioRequest: Request, session_id: str = Form(...),
                 "source_documents": []
             }
 
-        thread_id = session_threads.get(session_id)
+        thread_id = await get_session_thread(session_id)
         if not thread_id:
             return {
                 "session_id": session_id,
@@ -213,21 +718,43 @@ async def ask_question_audio(audioRequest: Request, session_id: str = Form(...),
                 "source_documents": []
             }
 
-        llm_response = await send_message_with_memory(thread_id=thread_id, content=user_question_text, memory="Auto")
+        # A reworded question on the same document set gets the earlier answer (its audio is cached too)
+        scope = await answer_cache_scope(session_id)
+        cached = answer_cache.get(scope, user_question_text)
+        if cached:
+            return {
+                "session_id": session_id,
+                "question": user_question_text,
+                "answer": cached["answer"],
+                "audio_url": cached_answer_audio_url(audioRequest, session_id, cached, output_format),
+                "source_documents": cached["source_documents"]
+            }
+
+        passages = await document_index.search_async(session_id, user_question_text)
+        llm_response = await send_message_with_memory(
+            thread_id=thread_id,
+            content=build_question_prompt(user_question_text, passages),
+            memory="Auto",
+            request_class="qa"
+        )
         answer_text = llm_response.content
 
-        audio_path = text_to_speech(session_id, answer_text)
-        filename = os.path.basename(audio_path)
-        base_url = str(audioRequest.base_url).rstrip("/")
-        audio_url = f"{base_url}/audio/{filename}"
+        # Sentences are synthesized concurrently, the URL streams audio as soon as the first is ready
+        speech = start_speech_stream(session_id, answer_text, output_format)
+        audio_url = speech_stream_url(audioRequest, speech)
+        cache_answer(scope, session_id, user_question_text, answer_text, passages, speech, output_format)
 
         return {
             "session_id": session_id,
             "question": user_question_text,
             "answer": answer_text,
             "audio_url": audio_url,
-            "source_documents": []
+            "source_documents": source_documents(passages)
         }
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UpstreamUnavailable as e:
+        raise unavailable_error(e)
     except Exception as e:
         return {
             "session_id": session_id,
@@ -238,9 +765,10 @@ async def ask_question_audio(audioRequest: Request, session_id: str = Form(...),
         }
 
 @app.post("/askQuestion", response_model=QAResponse)
-async def ask_question(audioRequest: Request, request: QARequest):
+async def ask_question(audioRequest: Request, request: QARequest, audio_format: Optional[str] = None):
+    output_format = negotiate_audio_format(audioRequest, audio_format)
     try:
-        thread_id = session_threads.get(request.session_id)
+        thread_id = await get_session_thread(request.session_id)
         if not thread_id:
             return {
                 "session_id": request.session_id,
@@ -249,21 +777,39 @@ async def ask_question(audioRequest: Request, request: QARequest):
                 "audio_url": "",
                 "source_documents": [] 
             }
+
+        scope = await answer_cache_scope(request.session_id)
+        cached = answer_cache.get(scope, request.question)
+        if cached:
+            return {
+                "session_id": request.session_id,
+                "question": request.question,
+                "answer": cached["answer"],
+                "audio_url": cached_answer_audio_url(audioRequest, request.session_id, cached, output_format),
+                "source_documents": cached["source_documents"]
+            }
         
-        response = await send_message_with_memory(thread_id=thread_id, content=request.question, memory="Auto")
-        
-        audio_path = text_to_speech(session_id=request.session_id, text=response.content)
-        filename = os.path.basename(audio_path)
-        base_url = str(audioRequest.base_url).rstrip("/")
-        audio_url = f"{base_url}/audio/{filename}"
+        passages = await document_index.search_async(request.session_id, request.question)
+        response = await send_message_with_memory(
+            thread_id=thread_id,
+            content=build_question_prompt(request.question, passages),
+            memory="Auto",
+            request_class="qa"
+        )
+        # Sentences are synthesized concurrently, the URL streams audio as soon as the first is ready
+        speech = start_speech_stream(request.session_id, response.content, output_format)
+        audio_url = speech_stream_url(audioRequest, speech)
+        cache_answer(scope, request.session_id, request.question, response.content, passages, speech, output_format)
         
         return {
             "session_id": request.session_id,
             "question": request.question,
             "answer": response.content,
             "audio_url": audio_url,
-            "source_documents": []
+            "source_documents": source_documents(passages)
         }
+    except UpstreamUnavailable as e:
+        raise unavailable_error(e)
     except Exception as e:
         return {
             "session_id": request.session_id,
@@ -273,44 +819,195 @@ async def ask_question(audioRequest: Request, request: QARequest):
             "source_documents": [] 
         }
 
+# Streaming variant of /askQuestion (Server-Sent Events)
+# Events: "audio" with a progressively playable audio URL (sent first),
+# "token" for answer text deltas, "done" with the full QAResponse, "error" on failure
+@app.post("/askQuestionStream")
+async def ask_question_stream(audioRequest: Request, request: QARequest, audio_format: Optional[str] = None):
+    output_format = negotiate_audio_format(audioRequest, audio_format)
 
+    async def event_stream():
+        speech = None
+        disconnected = False
+        try:
+            thread_id = await get_session_thread(request.session_id)
+            if not thread_id:
+                yield format_sse("error", {"message": "Error: Session not found"})
+                return
+
+            scope = await answer_cache_scope(request.session_id)
+            cached = answer_cache.get(scope, request.question)
+            if cached:
+                audio_url = cached_answer_audio_url(audioRequest, request.session_id, cached, output_format)
+                yield format_sse("audio", {"audio_url": audio_url})
+                yield format_sse("token", {"delta": cached["answer"]})
+                yield format_sse("done", {
+                    "session_id": request.session_id,
+                    "question": request.question,
+                    "answer": cached["answer"],
+                    "audio_url": audio_url,
+                    "source_documents": cached["source_documents"]
+                })
+                return
+
+            # Each sentence is sent to TTS as soon as the LLM finishes it
+            speech = start_speech_stream(request.session_id, output_format=output_format)
+            audio_url = speech_stream_url(audioRequest, speech)
+            yield format_sse("audio", {"audio_url": audio_url})
+
+            passages = await document_index.search_async(request.session_id, request.question)
+            answer_parts = []
+            async for chunk in send_message_streaming(
+                thread_id=thread_id,
+                content=build_question_prompt(request.question, passages),
+                memory="Auto",
+                request_class="qa"
+            ):
+                answer_parts.append(chunk)
+                speech.add_text(chunk)
+                yield format_sse("token", {"delta": chunk})
+
+            speech.close()
+            cache_answer(scope, request.session_id, request.question, "".join(answer_parts), passages, speech, output_format)
+
+            yield format_sse("done", {
+                "session_id": request.session_id,
+                "question": request.question,
+                "answer": "".join(answer_parts),
+                "audio_url": audio_url,
+                "source_documents": source_documents(passages)
+            })
+        except UpstreamUnavailable as e:
+            yield unavailable_event(e)
+        except Exception as e:
+            yield format_sse("error", {"message": f"Error: {str(e)}"})
+        except (GeneratorExit, asyncio.CancelledError):
+            disconnected = True
+            raise
+        finally:
+            if speech:
+                # Nobody will play the rest of an answer the client walked away from mid-way
+                if disconnected and not speech.closed:
+                    speech.cancel()
+                else:
+                    speech.close()
+
+    await check_stream_admission(request.session_id)
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+# Progressive audio for a speech stream: segments are sent in order as soon as each is synthesized
+@app.get("/audioStream/{stream_id}")
+async def get_audio_stream(stream_id: str):
+    stream = speech_streams.get(stream_id)
+    if not stream:
+        raise HTTPException(status_code=404, detail=f"Audio stream {stream_id} not found")
+    return StreamingResponse(stream.iter_audio(), media_type=stream.media_type, headers={"Cache-Control": "no-cache"})
+
+# Audio file names are content hashes (or unique ids for old files), so a URL never changes content
+AUDIO_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Generated audio files; Range requests (seeking) and zero-copy sends are handled by FileResponse
+def locate_audio(filename: str) -> Optional[str]:
+    """Path of a served audio file, None if there is none. Touches the disk, run it on a worker thread."""
+    path = tts_cache.lookup(filename)
+    if path is None and is_legacy_filename(filename):
+        path = os.path.join(audio_cache_dir, filename)
+        if not os.path.isfile(path):
+            path = None
+    return path
+
+@app.api_route("/audio/{filename}", methods=["GET", "HEAD"])
+async def get_audio(request: Request, filename: str):
+    path = await asyncio.to_thread(locate_audio, filename)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Audio file {filename} not found")
+
+    stem, extension = filename.split(".", 1)
+    headers = {"ETag": f'"{stem}"', "Cache-Control": AUDIO_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type_for(extension), headers=headers)
 
 # Endpoint to get list of uploaded documents for a session
 @app.get("/getDocuments/{session_id}")
 async def get_documents(session_id: str):
     """Get list of uploaded documents for a session"""
-    documents = session_documents.get(session_id, [])
+    documents = await session_store.list_documents(session_id)
+    pending = [job.to_dict() for job in ingest_jobs.for_session(session_id) if not job.finished]
     return {
         "session_id": session_id,
         "documents": documents,
-        "count": len(documents)
+        "count": len(documents),
+        "pending_jobs": pending
     }
 
+# Endpoint exposing runtime counters (cache hit rates etc.)
+@app.get("/getStats")
+async def get_stats():
+    """Get runtime statistics for the backend caches"""
+    return {name: collect() for name, collect in STATS_SOURCES.items()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Per-stage and per-route latency histograms in Prometheus text format"""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+def require_profiler():
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler is disabled, set PROFILER_ENABLED=1")
+
+@app.post("/startProfiler")
+async def start_profiler(interval: float = Query(0.005, gt=PROFILER_MIN_INTERVAL, le=PROFILER_MAX_INTERVAL)):
+    """Start sampling the stacks of all threads every interval seconds"""
+    require_profiler()
+    profiler.start(interval)
+    return profiler.stats()
+
+@app.post("/stopProfiler")
+async def stop_profiler():
+    require_profiler()
+    await asyncio.to_thread(profiler.stop)
+    return profiler.stats()
+
+@app.get("/getProfile", response_class=PlainTextResponse)
+async def get_profile():
+    """Sampled stacks in collapsed format, ready for flamegraph.pl or speedscope"""
+    require_profiler()
+    return PlainTextResponse(profiler.collapsed())
+
 # Delete Thread endpoint/session
 @app.delete("/deleteSession/{session_id}")
 async def delete_session(session_id: str):
     """
-    Clears the session locally and deletes the associated thread on Backboard.
+    Clears the session locally and deletes the associated thread and assistant on Backboard.
     """
     try:
-        # 1. Check if the thread exists in our memory
-        thread_id = session_threads.get(session_id)
+        # 1. Check if the session exists in the session store
+        session = await session_store.get_session(session_id)
         
-        if thread_id:
-            # 2. Call the Backboard service to delete the thread
-            # This uses the 'delete_thread' function you imported from services.backboard_service
-            await delete_thread(thread_id)
+        # 2. Delete the stored session and local state; the store keeps the remote
+        #    deletion pending so the reaper retries it if the next step fails
+        deleted = await session_store.delete_session(session_id)
+        await forget_session(session_id)
         
-        # 3. Clean up local memory dictionaries
-        # We use .pop(..., None) to avoid errors if the key was already gone
-        session_threads.pop(session_id, None)
-        session_assistants.pop(session_id, None)
-        session_documents.pop(session_id, None)
+        if session and deleted:
+            # 3. Delete the thread and the assistant (with its documents) on Backboard
+            try:
+                await delete_remote_session(session)
+                await session_store.remote_deleted(session)
+            except Exception as e:
+                logger.warning("Could not delete Backboard resources of session %s: %s", session_id, e)
+                return {
+                    "status": "success",
+                    "session_id": session_id,
+                    "message": f"Session {session_id} has been deleted; its thread and assistant will be deleted later."
+                }
         
         return {
             "status": "success",
             "session_id": session_id,
-            "message": f"Session {session_id} and its associated thread have been deleted."
+            "message": f"Session {session_id} and its associated thread and assistant have been deleted."
         }
 
     except Exception as e:
@@ -1,4 +1,5 @@
 # Pydantic models for core models used in the backend application.
+from typing import Optional
 from pydantic import BaseModel
 
 class IngestSuccessResponse(BaseModel) :
@@ -7,11 +8,45 @@ class IngestSuccessResponse(BaseModel) :
     document_id: str
     filename: str
 
+# Result of a multi-file ingest, one entry per uploaded file
+class IngestBatchResponse(BaseModel):
+    status: str
+    message: str
+    results: list[IngestSuccessResponse]
+
+# Status of a background ingest job, timings are in seconds
+class IngestJobStatus(BaseModel):
+    job_id: str
+    session_id: str
+    filename: str
+    status: str
+    document_id: Optional[str] = None
+    error: Optional[str] = None
+    size: int
+    content_hash: Optional[str] = None
+    deduplicated: bool = False
+    created_at: str
+    queued_seconds: float
+    run_seconds: Optional[float] = None
+
+# Response for queued ingest, returned before any indexing happens
+class IngestJobsResponse(BaseModel):
+    status: str
+    message: str
+    jobs: list[IngestJobStatus]
+
 # After doc ingest and in vector DB, topic prompt for what user wants lecture on
 class LectureTopicRequest(BaseModel):
     session_id: str
     topic: str
     
+# Batch of lecture topics for one session (e.g. an onboarding curriculum)
+class CurriculumRequest(BaseModel):
+    session_id: str
+    topics: list[str]
+    include_audio: bool = False
+    max_parallel: Optional[int] = None
+
 # Model representing the response for a generated lecture
 # Example Includes Topic, Slides
 class GeneratedLectureResponse(BaseModel):
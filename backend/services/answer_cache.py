@@ -0,0 +1,255 @@
+# Cache of Q&A answers that also matches reworded questions (MinHash over character shingles)
+import hashlib
+import os
+import struct
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from services.lecture_cache import document_fingerprint, normalize_topic
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "5000"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(6 * 3600)))
+# Estimated Jaccard similarity of two questions' shingles above which they share an answer
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.7"))
+# Share answers between sessions whose uploaded documents have identical content
+ANSWER_CACHE_SHARED = os.getenv("ANSWER_CACHE_SHARED", "false").lower() in ("1", "true", "yes")
+# Questions with fewer content words than this ("tell me more") depend on the conversation and are not cached
+ANSWER_CACHE_MIN_TERMS = int(os.getenv("ANSWER_CACHE_MIN_TERMS", "3"))
+
+SHINGLE_SIZE = 4
+NUM_PERM = 64
+LSH_BANDS = 16  # of NUM_PERM // LSH_BANDS rows each; candidates need one identical band
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_PERMUTATIONS = [
+    (int.from_bytes(hashlib.sha256(f"a{i}".encode()).digest()[:8], "big") % _MERSENNE_PRIME | 1,
+     int.from_bytes(hashlib.sha256(f"b{i}".encode()).digest()[:8], "big") % _MERSENNE_PRIME)
+    for i in range(NUM_PERM)
+]
+
+# Words that carry little meaning in a question; dropped before shingling
+_STOP_WORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "do", "does", "did", "can", "could", "would", "should",
+    "please", "tell", "me", "us", "i", "we", "you", "explain", "describe", "what", "whats", "of", "to", "in",
+    "on", "for", "about", "and", "or", "it", "this", "that", "s",
+}
+# Words that flip or narrow the meaning; questions only match if they agree on these
+_NEGATIONS = {"not", "no", "never", "without", "except", "dont", "doesnt", "isnt", "arent", "cant", "wont"}
+# Words that refer back to the conversation (Q&A threads have memory), such questions are never cached
+_REFERENCES = {
+    "it", "its", "that", "those", "they", "them", "more", "again", "else", "also", "previous", "above", "earlier",
+    "elaborate", "continue",
+}
+# Words after which the order of the other terms matters ("compare A to B" is not "compare B to A")
+_ORDERED = {"compare", "compared", "comparison", "vs", "versus", "than", "from", "to", "into", "before", "after", "over"}
+
+
+def _stem(word: str) -> str:
+    # Just enough to fold plurals together ("policies" / "policy", "laptops" / "laptop")
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _words(question: str) -> List[str]:
+    return normalize_topic(question.replace("'", "")).split()
+
+
+def _content_words(words: List[str]) -> List[str]:
+    return [_stem(word) for word in words if word not in _STOP_WORDS]
+
+
+def question_terms(question: str) -> List[str]:
+    """Normalized, stemmed content words in sorted order, so reordered questions get the same terms."""
+    words = _words(question)
+    return sorted(_content_words(words)) or words
+
+
+def is_cacheable(question: str) -> bool:
+    """Whether the question stands on its own, rather than following up on the conversation."""
+    words = _words(question)
+    return not _REFERENCES.intersection(words) and len(_content_words(words)) >= ANSWER_CACHE_MIN_TERMS
+
+
+def shingles(terms: List[str]) -> Set[str]:
+    text = " ".join(terms)
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash(items: Set[str]) -> Tuple[int, ...]:
+    hashes = [struct.unpack("<Q", hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest())[0] for item in items]
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def question_guard(question: str) -> Tuple[frozenset, Tuple[str, ...]]:
+    """
+    What two questions must agree on exactly, whatever the similarity says: numbers and negations,
+    and the order of the content words when the question has a direction ("compare A to B").
+    """
+    words = _words(question)
+    terms = _content_words(words)
+    exact = frozenset(term for term in terms if term.isdigit() or term in _NEGATIONS)
+    order = tuple(terms) if _ORDERED.intersection(words) else ()
+    return exact, order
+
+
+class _Answer:
+    def __init__(self, question: str, terms: List[str], signature: Tuple[int, ...], answer: dict, expires_at: float):
+        self.question = question
+        self.normalized = " ".join(terms)
+        self.guard = question_guard(question)
+        self.signature = signature
+        self.answer = answer
+        self.expires_at = expires_at
+
+
+class AnswerCache:
+    """
+    TTL + LRU cache of answers, looked up by question similarity.
+
+    Entries live in a scope made of the document set fingerprint, as in the
+    lecture cache, so an ingest never serves answers from the old document
+    set; invalidate_session() additionally frees them. Within a scope an
+    exact match on the normalized question is tried first, then MinHash LSH
+    buckets give the candidates whose estimated similarity is checked against
+    the threshold. Questions that follow up on the conversation ("explain
+    that again") or have too few content words are neither cached nor looked up.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = ANSWER_CACHE_SIZE,
+        ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        shared: bool = ANSWER_CACHE_SHARED
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.shared = shared
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[int, Tuple[str, _Answer]]" = OrderedDict()  # {entry id: (scope, answer)}, LRU order
+        self._exact: Dict[Tuple[str, str], int] = {}  # {(scope, normalized question): entry id}
+        self._buckets: Dict[Tuple[str, int, Tuple[int, ...]], Set[int]] = {}  # {(scope, band, band values): entry ids}
+        self._session_scopes: Dict[str, Set[str]] = {}  # {session_id: session-scoped scopes}
+        self._next_id = 0
+
+    def scope_for(self, session_id: str, documents: List[dict]) -> str:
+        if self.shared and documents and all(document.get("content_hash") for document in documents):
+            return "shared:" + document_fingerprint(documents, by_content=True)
+        return f"session:{session_id}:" + document_fingerprint(documents)
+
+    def _bands(self, signature: Tuple[int, ...]):
+        rows = NUM_PERM // LSH_BANDS
+        for band in range(LSH_BANDS):
+            yield band, signature[band * rows:(band + 1) * rows]
+
+    def get(self, scope: str, question: str) -> Optional[dict]:
+        """Return the cached answer for question or a near-duplicate of it, None on a miss."""
+        if not is_cacheable(question):
+            self.skipped += 1
+            return None
+        terms = question_terms(question)
+        guard = question_guard(question)
+        entry_id = self._exact.get((scope, " ".join(terms)))
+        if entry_id is not None and self._live(entry_id) and self._entries[entry_id][1].guard == guard:
+            self.exact_hits += 1
+            return self._hit(entry_id)
+
+        signature = minhash(shingles(terms))
+        best_id, best_score = None, self.threshold
+        candidates = set()
+        for band, values in self._bands(signature):
+            candidates |= self._buckets.get((scope, band, values), set())
+        for candidate in candidates:
+            if not self._live(candidate):
+                continue
+            entry = self._entries[candidate][1]
+            if entry.guard != guard:
+                continue
+            score = sum(1 for x, y in zip(signature, entry.signature) if x == y) / NUM_PERM
+            if score >= best_score:
+                best_id, best_score = candidate, score
+        if best_id is None:
+            self.misses += 1
+            return None
+        self.near_hits += 1
+        return self._hit(best_id)
+
+    def _live(self, entry_id: int) -> bool:
+        item = self._entries.get(entry_id)
+        if item is None:
+            return False
+        if item[1].expires_at <= time.monotonic():
+            self._remove(entry_id)
+            return False
+        return True
+
+    def _hit(self, entry_id: int) -> dict:
+        self._entries.move_to_end(entry_id)
+        return dict(self._entries[entry_id][1].answer)
+
+    def put(self, scope: str, session_id: str, question: str, answer: dict):
+        if not is_cacheable(question):
+            return
+        terms = question_terms(question)
+        existing = self._exact.get((scope, " ".join(terms)))
+        if existing is not None:
+            self._remove(existing)
+        entry_id = self._next_id
+        self._next_id += 1
+        entry = _Answer(question, terms, minhash(shingles(terms)), dict(answer), time.monotonic() + self.ttl_seconds)
+        self._entries[entry_id] = (scope, entry)
+        self._exact[(scope, entry.normalized)] = entry_id
+        for band, values in self._bands(entry.signature):
+            self._buckets.setdefault((scope, band, values), set()).add(entry_id)
+        if scope.startswith("session:"):
+            self._session_scopes.setdefault(session_id, set()).add(scope)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int):
+        scope, entry = self._entries.pop(entry_id)
+        if self._exact.get((scope, entry.normalized)) == entry_id:
+            del self._exact[(scope, entry.normalized)]
+        for band, values in self._bands(entry.signature):
+            bucket = self._buckets.get((scope, band, values))
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[(scope, band, values)]
+
+    def invalidate_session(self, session_id: str):
+        """Drop the session-scoped answers of a session (shared entries stay valid for other sessions)."""
+        scopes = self._session_scopes.pop(session_id, set())
+        if not scopes:
+            return
+        for entry_id in [entry_id for entry_id, (scope, _) in self._entries.items() if scope in scopes]:
+            self._remove(entry_id)
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        hits = self.exact_hits + self.near_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "shared": self.shared,
+            "hits": hits,
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "invalidations": self.invalidations,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
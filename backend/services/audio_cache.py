@@ -0,0 +1,34 @@
+# Cache keys, file extensions and media types of synthesized audio (stored in a DiskLRUCache)
+import hashlib
+
+MEDIA_TYPES = {
+    "mp3": "audio/mpeg",
+    "opus": "audio/ogg",
+    "wav": "audio/wav",
+    "pcm": "application/octet-stream",
+    "ulaw": "audio/basic",
+    "alaw": "application/octet-stream",
+}
+
+
+def audio_cache_key(text: str, voice_id: str, model_id: str, output_format: str) -> str:
+    """
+    Build the cache key for a synthesis request.
+
+    Every parameter that changes the produced audio is part of the hash, so two
+    requests only share a file when ElevenLabs would return the same bytes.
+    """
+    digest = hashlib.sha256()
+    for part in (voice_id, model_id, output_format, text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def extension_for_format(output_format: str) -> str:
+    """Map an ElevenLabs output format (e.g. "mp3_44100_128") to a file extension."""
+    return output_format.split("_", 1)[0]
+
+
+def media_type_for(extension: str) -> str:
+    return MEDIA_TYPES.get(extension, "application/octet-stream")
@@ -0,0 +1,202 @@
+# Background cleanup of synthesized audio: files of deleted sessions and files nobody played for a while
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from services.disk_cache import DiskLRUCache
+
+logger = logging.getLogger(__name__)
+
+# Files not requested for this long are removed, on top of the cache's byte budget
+AUDIO_MAX_AGE_SECONDS = float(os.getenv("AUDIO_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+AUDIO_JANITOR_INTERVAL_SECONDS = float(os.getenv("AUDIO_JANITOR_INTERVAL_SECONDS", "600"))
+
+# Files written before the cache was content-addressed: "<session_id>_<uuid>.mp3"
+_LEGACY_FILE_RE = re.compile(r"^([0-9a-f-]{36})_[0-9a-f-]{36}\.mp3$")
+
+
+def is_legacy_filename(name: str) -> bool:
+    return bool(_LEGACY_FILE_RE.match(name))
+
+
+class AudioJanitor:
+    """
+    Tracks which sessions use which cached audio files and removes files in the background.
+
+    Cached files are content-addressed and can be shared by several sessions,
+    so deleting a session only removes the files no other session claimed.
+    Claims are buffered in memory and written to a small SQLite table next
+    to the files by the janitor itself, request handlers never wait on it.
+    Age expiry walks the cache's in-memory LRU index, the directory is only
+    listed once at startup to pick up files from the old naming scheme.
+    """
+
+    def __init__(
+        self,
+        cache: DiskLRUCache,
+        db_path: Optional[str] = None,
+        max_age_seconds: float = AUDIO_MAX_AGE_SECONDS,
+        interval_seconds: float = AUDIO_JANITOR_INTERVAL_SECONDS
+    ):
+        self.cache = cache
+        self.db_path = db_path or os.path.join(cache.directory, ".owners.sqlite3")
+        self.max_age_seconds = max_age_seconds
+        self.interval_seconds = interval_seconds
+        self.sessions_purged = 0
+        self.files_purged = 0
+        self.files_expired = 0
+        self.sweeps = 0
+        self._claims = set()  # {(session_id, filename)} not written yet
+        self._purges: List[str] = []
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._conn = None
+        self._legacy: Optional[Dict[str, float]] = None  # {filename: mtime}, loaded on the first sweep
+        self._last_expiry = 0.0
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sweeps = set()  # one-off sweeps started without the loop, referenced so they are not garbage collected
+
+    def claim(self, session_id: Optional[str], path: str):
+        """Record that session_id uses the audio file at path."""
+        if session_id:
+            with self._lock:
+                self._claims.add((session_id, os.path.basename(path)))
+
+    def schedule_purge(self, session_id: str):
+        """Remove the session's audio files in the background."""
+        with self._lock:
+            self._purges.append(session_id)
+        if self._wake is not None:
+            self._wake.set()
+        else:
+            # Janitor loop not running (e.g. no lifespan), purge right away on a worker thread
+            task = asyncio.get_running_loop().create_task(asyncio.to_thread(self.sweep))
+            self._sweeps.add(task)
+            task.add_done_callback(self._sweep_done)
+
+    def _sweep_done(self, task: asyncio.Task):
+        self._sweeps.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Audio janitor sweep failed", exc_info=task.exception())
+
+    def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wake = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception:
+                logger.exception("Audio janitor sweep failed")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS audio_owners ("
+                "session_id TEXT NOT NULL, filename TEXT NOT NULL, PRIMARY KEY (session_id, filename))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS audio_owners_filename ON audio_owners (filename)")
+            self._conn = conn
+        return self._conn
+
+    def _load_legacy(self):
+        self._legacy = {}
+        for entry in os.scandir(self.cache.directory):
+            match = _LEGACY_FILE_RE.match(entry.name)
+            if match and entry.is_file():
+                self._legacy[entry.name] = entry.stat().st_mtime
+                self._claims.add((match.group(1), entry.name))
+
+    def _remove_files(self, conn: sqlite3.Connection, names: Iterable[str]) -> int:
+        names = list(names)
+        removed = self.cache.discard(names)
+        for name in names:
+            if self._legacy is not None and self._legacy.pop(name, None) is not None:
+                try:
+                    os.remove(os.path.join(self.cache.directory, name))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        conn.executemany("DELETE FROM audio_owners WHERE filename = ?", [(name,) for name in names])
+        return removed
+
+    def sweep(self):
+        """Write pending claims, purge deleted sessions and expire old files. Runs on a worker thread."""
+        with self._sweep_lock:
+            self._sweep()
+
+    def _sweep(self):
+        conn = self._connection()
+        with self._lock:
+            if self._legacy is None:
+                self._load_legacy()
+            claims, self._claims = self._claims, set()
+            purges, self._purges = self._purges, []
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO audio_owners (session_id, filename) VALUES (?, ?)", claims)
+
+            for session_id in purges:
+                names = [row[0] for row in conn.execute("SELECT filename FROM audio_owners WHERE session_id = ?", (session_id,))]
+                conn.execute("DELETE FROM audio_owners WHERE session_id = ?", (session_id,))
+                # Files another session also claimed stay
+                orphans = [
+                    name for name in names
+                    if conn.execute("SELECT 1 FROM audio_owners WHERE filename = ? LIMIT 1", (name,)).fetchone() is None
+                ]
+                self.files_purged += self._remove_files(conn, orphans)
+                self.sessions_purged += 1
+
+            now = time.time()
+            if now - self._last_expiry >= self.interval_seconds:
+                self._last_expiry = now
+                expired = self.cache.expire(self.max_age_seconds)
+                cutoff = now - self.max_age_seconds
+                expired_legacy = [name for name, mtime in self._legacy.items() if mtime < cutoff]
+                self.files_expired += len(expired) + self._remove_files(conn, expired_legacy)
+                # Also forgets files the cache evicted for its byte budget since the last pass
+                stale = [
+                    (name,) for (name,) in conn.execute("SELECT DISTINCT filename FROM audio_owners")
+                    if name not in self.cache and name not in self._legacy
+                ]
+                conn.executemany("DELETE FROM audio_owners WHERE filename = ?", stale)
+        self.sweeps += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending_claims = len(self._claims)
+            pending_purges = len(self._purges)
+        return {
+            "running": int(self._task is not None),
+            "sweeps": self.sweeps,
+            "pending_claims": pending_claims,
+            "pending_purges": pending_purges,
+            "sessions_purged": self.sessions_purged,
+            "files_purged": self.files_purged,
+            "files_expired": self.files_expired,
+            "legacy_files": len(self._legacy or ()),
+        }
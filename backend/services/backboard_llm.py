@@ -1,13 +1,36 @@
 # LLM operations, message handling, tool calls, and memory
 import json
+import time
+from contextlib import aclosing
 from typing import AsyncIterator, List, Dict, Optional
-from services.backboard_service import client
+from services.backboard_service import client, backboard_upstream, BACKBOARD_LLM_TIMEOUT_SECONDS, BACKBOARD_STREAM_IDLE_SECONDS
+from services.metrics import timed
+from services.single_flight import SingleFlight, flight_key
+from services.backboard_scheduler import BackboardScheduler
+from services.model_router import ModelRouter, default_routes
+from services.resilience import UpstreamUnavailable, is_retryable
 
+# Identical messages sent while one is already in flight share its response
+llm_flights = SingleFlight("llm")
+
+# Orders messages per thread and limits concurrency and rate toward Backboard
+message_scheduler = BackboardScheduler()
+
+# Picks the model per request class ("qa", "lecture") from recent latency and error rates
+model_router = ModelRouter(default_routes())
+
+def message_key(thread_id: str, content: str, *options) -> str:
+    """Coalescing key of a message: same thread, same (whitespace-normalized) content and options."""
+    return flight_key(thread_id, " ".join(content.split()), *options)
+
+@timed("llm_stream")
 async def send_message_streaming(
     thread_id: str,
     content: str,
-    llm_provider: str = "openai",
-    model_name: str = "gpt-4o"
+    llm_provider: Optional[str] = None,
+    model_name: Optional[str] = None,
+    memory: Optional[str] = None,
+    request_class: str = "lecture"
 ) -> AsyncIterator[str]:
     """
     Send a message with streaming response.
@@ -16,30 +39,60 @@ async def send_message_streaming(
     Args:
         thread_id: The thread ID to send the message to
         content: The message content
-        llm_provider: LLM provider (e.g., "openai")
-        model_name: Model name (e.g., "gpt-4o")
+        llm_provider: LLM provider (e.g., "openai"), None to let the router pick
+        model_name: Model name (e.g., "gpt-4o"), None to let the router pick
+        memory: Memory mode ("Auto" for persistent memory, None for no memory)
+        request_class: Route used to pick the model ("qa" or "lecture")
     
     Yields:
         Chunks of content as they arrive
     """
-    async for chunk in await client.add_message(
-        thread_id=thread_id,
-        content=content,
-        llm_provider=llm_provider,
-        model_name=model_name,
-        stream=True
-    ):
-        if chunk['type'] == 'content_streaming':
-            yield chunk['content']
-        elif chunk['type'] == 'message_complete':
-            break
+    if llm_provider and model_name:
+        models = [(llm_provider, model_name)]
+    else:
+        models = model_router.candidates(request_class)
+    # The thread stays reserved until the reply has been fully streamed
+    async with message_scheduler.slot(thread_id):
+        for attempt, (provider, model) in enumerate(models):
+            model_router.routed(request_class, provider, model, attempt)
+            started = time.perf_counter()
+            streamed = False
+            try:
+                # Closed right away on break, so the upstream records the stream's outcome and releases it
+                async with aclosing(backboard_upstream.stream("add_message_stream", lambda: client.add_message(
+                    thread_id=thread_id,
+                    content=content,
+                    llm_provider=provider,
+                    model_name=model,
+                    memory=memory,
+                    stream=True
+                ), first_timeout=BACKBOARD_LLM_TIMEOUT_SECONDS, idle_timeout=BACKBOARD_STREAM_IDLE_SECONDS)) as chunks:
+                    async for chunk in chunks:
+                        if chunk['type'] == 'content_streaming':
+                            streamed = True
+                            yield chunk['content']
+                        elif chunk['type'] == 'message_complete':
+                            break
+            except UpstreamUnavailable:
+                raise
+            except Exception as e:
+                model_router.record(request_class, provider, model, time.perf_counter() - started, ok=False)
+                # Once text went out the reply cannot be restarted on another model
+                if streamed or not is_retryable(e, idempotent=False) or attempt == len(models) - 1:
+                    raise
+                continue
+            model_router.record(request_class, provider, model, time.perf_counter() - started, ok=True)
+            return
 
+@timed("llm_call")
 async def send_message(
     thread_id: str,
     content: str,
-    llm_provider: str = "openai",
-    model_name: str = "gpt-4o",
-    memory: Optional[str] = None
+    llm_provider: Optional[str] = None,
+    model_name: Optional[str] = None,
+    memory: Optional[str] = None,
+    coalesce_key: Optional[str] = None,
+    request_class: str = "lecture"
 ):
     """
     Send a message without streaming (returns full response).
@@ -48,23 +101,44 @@ async def send_message(
     Args:
         thread_id: The thread ID
         content: The message content
-        llm_provider: LLM provider
-        model_name: Model name
+        llm_provider: LLM provider, None to let the router pick
+        model_name: Model name, None to let the router pick
         memory: Memory mode ("Auto" for persistent memory, None for no memory)
+        coalesce_key: Share the response with in-flight calls using this key
+            (defaults to same thread, content and options)
+        request_class: Route used to pick the model ("qa" or "lecture")
     
     Returns:
         Response object with .content attribute
     """
-    response = await client.add_message(
-        thread_id=thread_id,
-        content=content,
-        llm_provider=llm_provider,
-        model_name=model_name,
-        memory=memory,
-        stream=False
-    )
-    return response
+    key = coalesce_key or message_key(thread_id, content, llm_provider, model_name, memory, request_class)
+    return await llm_flights.do(key, lambda: message_scheduler.run(thread_id, lambda: routed_message(
+        thread_id, content, memory, request_class, llm_provider, model_name
+    )))
 
+async def routed_message(
+    thread_id: str,
+    content: str,
+    memory: Optional[str],
+    request_class: str,
+    llm_provider: Optional[str] = None,
+    model_name: Optional[str] = None
+):
+    """Send a non-streaming message on the model the router picks (or the pinned one)."""
+    return await model_router.call(request_class, lambda provider, model: backboard_upstream.call(
+        "add_message",
+        lambda: client.add_message(
+            thread_id=thread_id,
+            content=content,
+            llm_provider=provider,
+            model_name=model,
+            memory=memory,
+            stream=False
+        ),
+        timeout=BACKBOARD_LLM_TIMEOUT_SECONDS
+    ), llm_provider, model_name)
+
+@timed("llm_call")
 async def send_message_with_tools(
     thread_id: str,
     content: str,
@@ -86,52 +160,57 @@ async def send_message_with_tools(
     Returns:
         Final response after tool execution
     """
-    response = await client.add_message(
-        thread_id=thread_id,
-        content=content,
-        stream=False
-    )
+    # Tool rounds must not interleave with other messages on the thread
+    async with message_scheduler.slot(thread_id):
+        response = await backboard_upstream.call("add_message", lambda: client.add_message(
+            thread_id=thread_id,
+            content=content,
+            stream=False
+        ), timeout=BACKBOARD_LLM_TIMEOUT_SECONDS)
     
-    # Check if the assistant requires action (tool call)
-    if response.status == "REQUIRES_ACTION" and response.tool_calls:
-        tool_outputs = []
+        # Check if the assistant requires action (tool call)
+        if response.status == "REQUIRES_ACTION" and response.tool_calls:
+            tool_outputs = []
         
-        # Process each tool call
-        for tc in response.tool_calls:
-            if tc.function.name == "get_current_weather":
-                # Get parsed arguments (required parameters are guaranteed by API)
-                args = tc.function.parsed_arguments
-                location = args["location"]
+            # Process each tool call
+            for tc in response.tool_calls:
+                if tc.function.name == "get_current_weather":
+                    # Get parsed arguments (required parameters are guaranteed by API)
+                    args = tc.function.parsed_arguments
+                    location = args["location"]
                 
-                # Execute your function and format the output
-                weather_data = {
-                    "temperature": "68°F",
-                    "condition": "Sunny",
-                    "location": location
-                }
+                    # Execute your function and format the output
+                    weather_data = {
+                        "temperature": "68°F",
+                        "condition": "Sunny",
+                        "location": location
+                    }
                 
-                tool_outputs.append({
-                    "tool_call_id": tc.id,
-                    "output": json.dumps(weather_data)
-                })
+                    tool_outputs.append({
+                        "tool_call_id": tc.id,
+                        "output": json.dumps(weather_data)
+                    })
         
-        # Submit the tool outputs back to continue the conversation
-        final_response = await client.submit_tool_outputs(
-            thread_id=thread_id,
-            run_id=response.run_id,
-            tool_outputs=tool_outputs
-        )
+            # Submit the tool outputs back to continue the conversation
+            final_response = await backboard_upstream.call("submit_tool_outputs", lambda: client.submit_tool_outputs(
+                thread_id=thread_id,
+                run_id=response.run_id,
+                tool_outputs=tool_outputs
+            ), timeout=BACKBOARD_LLM_TIMEOUT_SECONDS)
         
-        return final_response
+            return final_response
     
-    return response
+        return response
 
+@timed("llm_call")
 async def send_message_with_memory(
     thread_id: str,
     content: str,
     memory: str = "Auto",
-    llm_provider: str = "openai",
-    model_name: str = "gpt-4o"
+    llm_provider: Optional[str] = None,
+    model_name: Optional[str] = None,
+    coalesce_key: Optional[str] = None,
+    request_class: str = "qa"
 ):
     """
     Send message with persistent memory enabled.
@@ -141,16 +220,16 @@ async def send_message_with_memory(
         thread_id: The thread ID
         content: The message content
         memory: Memory mode ("Auto" to automatically save and retrieve context)
-        llm_provider: LLM provider
-        model_name: Model name
+        llm_provider: LLM provider, None to let the router pick
+        model_name: Model name, None to let the router pick
+        coalesce_key: Share the response with in-flight calls using this key
+            (defaults to same thread, content and memory mode)
+        request_class: Route used to pick the model ("qa" or "lecture")
     
     Returns:
         Response object with .content attribute
     """
-    response = await client.add_message(
-        thread_id=thread_id,
-        content=content,
-        memory=memory,
-        stream=False
-    )
-    return response
+    key = coalesce_key or message_key(thread_id, content, "memory", memory, llm_provider, model_name, request_class)
+    return await llm_flights.do(key, lambda: message_scheduler.run(thread_id, lambda: routed_message(
+        thread_id, content, memory, request_class, llm_provider, model_name
+    )))
@@ -1,62 +1,95 @@
 # Document upload and RAG operations using Backboard
-import time
+import asyncio
+import logging
+import os
+import random
 from typing import List
-from services.backboard_service import client
+from services.backboard_service import client, backboard_upstream, BACKBOARD_STATUS_TIMEOUT_SECONDS, BACKBOARD_UPLOAD_TIMEOUT_SECONDS
+from services.metrics import stage_timer, timed
 from pydantic import ValidationError
 
-async def upload_document_to_assistant(assistant_id: str, file_path: str):
+logger = logging.getLogger(__name__)
+
+# Indexing poll schedule: exponential backoff with jitter, bounded by an overall deadline
+INDEX_POLL_INITIAL_DELAY = float(os.getenv("INDEX_POLL_INITIAL_DELAY", "0.5"))
+INDEX_POLL_MAX_DELAY = float(os.getenv("INDEX_POLL_MAX_DELAY", "8"))
+INDEX_TIMEOUT_SECONDS = float(os.getenv("INDEX_TIMEOUT_SECONDS", "600"))
+# A status poll slower than this gets a second, hedged request (0 disables hedging)
+INDEX_STATUS_HEDGE_SECONDS = float(os.getenv("INDEX_STATUS_HEDGE_SECONDS", "2"))
+
+
+class DocumentIndexingTimeout(TimeoutError):
+    """Raised when a document is not indexed before the deadline."""
+
+
+@timed("indexing_wait")
+async def wait_for_indexing(document_id, timeout: float = INDEX_TIMEOUT_SECONDS):
     """
-    Upload a document to an assistant and wait for indexing.
-    From quickstart documents.py
-    
+    Poll the document status until it is indexed, without blocking the event loop.
+
     Args:
-        assistant_id: The assistant ID to upload the document to
-        file_path: Path to the document file
-    
+        document_id: The document to wait for
+        timeout: Overall deadline in seconds
+
     Returns:
-        Document object with document_id
+        The final status object
+
+    Raises:
+        Exception if indexing failed, DocumentIndexingTimeout if the deadline passed
     """
-    # Upload a document to the assistant
-    document = await client.upload_document_to_assistant(
-        assistant_id,
-        file_path
-    )
-    
-    # Wait for the document to be indexed
-    print("Waiting for document to be indexed...")
-    while True:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    delay = INDEX_POLL_INITIAL_DELAY
 
-        status = await client.get_document_status(document.document_id)
+    while True:
+        status = await backboard_upstream.call(
+            "get_document_status",
+            lambda: client.get_document_status(document_id),
+            timeout=BACKBOARD_STATUS_TIMEOUT_SECONDS,
+            idempotent=True,
+            hedge_after=INDEX_STATUS_HEDGE_SECONDS or None
+        )
         status_value = status.status.value
 
-        print(f"Raw status response: {status}")
-        print(f"Status type: {status_value}") 
-
         if status_value == "indexed":
-            print("Document indexed successfully!")
-            return document
+            logger.info("Document %s indexed", document_id)
+            return status
         elif status_value == "failed":
             raise Exception(f"Document indexing failed: {status.status_message}")
 
-        print(f"Status is {status_value}, waiting 2 seconds...")
-
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise DocumentIndexingTimeout(
+                f"Document {document_id} not indexed after {timeout:g}s (last status: {status_value})"
+            )
 
+        # Equal jitter keeps concurrent uploads from polling in lockstep
+        sleep_for = min(delay / 2 + random.uniform(0, delay / 2), remaining)
+        await asyncio.sleep(sleep_for)
+        delay = min(delay * 2, INDEX_POLL_MAX_DELAY)
 
-        time.sleep(2)
 
-async def upload_documents_batch(assistant_id: str, file_paths: List[str]):
+async def upload_document_to_assistant(assistant_id: str, file_path: str, timeout: float = INDEX_TIMEOUT_SECONDS):
     """
-    Upload multiple documents to an assistant.
-    
+    Upload a document to an assistant and wait for indexing.
+    From quickstart documents.py
+
     Args:
-        assistant_id: The assistant ID
-        file_paths: List of file paths to upload
-    
+        assistant_id: The assistant ID to upload the document to
+        file_path: Path to the document file
+        timeout: Maximum seconds to wait for indexing
+
     Returns:
-        List of document objects
+        Document object with document_id
     """
-    documents = []
-    for file_path in file_paths:
-        doc = await upload_document_to_assistant(assistant_id, file_path)
-        documents.append(doc)
-    return documents
+    # Upload a document to the assistant
+    with stage_timer("backboard_upload"):
+        document = await backboard_upstream.call("upload_document", lambda: client.upload_document_to_assistant(
+            assistant_id,
+            file_path
+        ), timeout=BACKBOARD_UPLOAD_TIMEOUT_SECONDS)
+
+    # Wait for the document to be indexed
+    logger.info("Waiting for document %s to be indexed", document.document_id)
+    await wait_for_indexing(document.document_id, timeout=timeout)
+    return document
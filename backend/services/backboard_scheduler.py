@@ -0,0 +1,161 @@
+# Admission control for Backboard thread messages: per-thread ordering, global concurrency and a rate limit
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, TypeVar
+
+from services.resilience import UpstreamUnavailable
+
+T = TypeVar("T")
+
+BACKBOARD_MAX_CONCURRENCY = int(os.getenv("BACKBOARD_MAX_CONCURRENCY", "16"))
+BACKBOARD_RATE_PER_SECOND = float(os.getenv("BACKBOARD_RATE_PER_SECOND", "10"))
+BACKBOARD_BURST = int(os.getenv("BACKBOARD_BURST", "20"))
+# Messages queued behind each other on one thread (running one included)
+BACKBOARD_MAX_QUEUE_PER_THREAD = int(os.getenv("BACKBOARD_MAX_QUEUE_PER_THREAD", "4"))
+# Messages waiting for a free global slot
+BACKBOARD_MAX_PENDING = int(os.getenv("BACKBOARD_MAX_PENDING", "64"))
+# Longest a message may wait for the rate limit and a free global slot before it is rejected instead
+BACKBOARD_MAX_WAIT_SECONDS = float(os.getenv("BACKBOARD_MAX_WAIT_SECONDS", "10"))
+
+
+class BackboardOverloaded(UpstreamUnavailable):
+    """Raised instead of queueing when Backboard capacity is exhausted."""
+
+    status_code = 429
+
+
+class _ThreadQueue:
+    def __init__(self):
+        self.lock = asyncio.Lock()  # waiters are woken in FIFO order
+        self.size = 0
+
+
+class BackboardScheduler:
+    """
+    Orders and limits the messages sent to Backboard.
+
+    - Messages on the same thread run one at a time, in arrival order, so
+      concurrent tabs cannot interleave writes to the thread's memory.
+    - A token bucket caps the request rate and a semaphore caps how many
+      messages are in flight across all threads.
+    - Work that would wait too long is rejected right away with a retry
+      hint, so overload shows up as fast 429s rather than slow timeouts.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = BACKBOARD_MAX_CONCURRENCY,
+        rate_per_second: float = BACKBOARD_RATE_PER_SECOND,
+        burst: int = BACKBOARD_BURST,
+        max_queue_per_thread: int = BACKBOARD_MAX_QUEUE_PER_THREAD,
+        max_pending: int = BACKBOARD_MAX_PENDING,
+        max_wait_seconds: float = BACKBOARD_MAX_WAIT_SECONDS
+    ):
+        self.max_concurrency = max_concurrency
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.max_queue_per_thread = max_queue_per_thread
+        self.max_pending = max_pending
+        self.max_wait_seconds = max_wait_seconds
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._threads: Dict[str, _ThreadQueue] = {}
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self.active = 0
+        self.pending = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.avg_call_seconds = 1.0  # moving average, used for Retry-After estimates
+
+    def _reserve_token(self) -> float:
+        """Take a token, possibly on credit; returns how long to wait until it is actually available."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate_per_second)
+        self._refilled_at = now
+        wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate_per_second
+        if wait > self.max_wait_seconds:
+            raise BackboardOverloaded("Backboard rate limit reached, try again shortly", wait)
+        self._tokens -= 1
+        return wait
+
+    def check_admission(self, thread_id: str):
+        """Raise BackboardOverloaded if a message on thread_id would be rejected right now."""
+        queue = self._threads.get(thread_id)
+        if queue and queue.size >= self.max_queue_per_thread:
+            self.rejected += 1
+            raise BackboardOverloaded(
+                "Too many messages queued for this session",
+                queue.size * self.avg_call_seconds
+            )
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise BackboardOverloaded(
+                "Backboard is busy, try again shortly",
+                (self.pending / self.max_concurrency + 1) * self.avg_call_seconds
+            )
+
+    async def _acquire(self, timeout: float):
+        """Take a global slot, or raise BackboardOverloaded if none frees up within timeout."""
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            return
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), max(timeout, 0))
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise BackboardOverloaded(
+                "Backboard is busy, try again shortly",
+                (self.pending / self.max_concurrency + 1) * self.avg_call_seconds
+            )
+
+    @asynccontextmanager
+    async def slot(self, thread_id: str):
+        """Hold the thread and a global slot for the duration of the block (e.g. a streamed reply)."""
+        self.check_admission(thread_id)
+        queue = self._threads.setdefault(thread_id, _ThreadQueue())
+        queue.size += 1
+        try:
+            async with queue.lock:
+                try:
+                    wait = self._reserve_token()
+                except BackboardOverloaded:
+                    self.rejected += 1
+                    raise
+                self.pending += 1
+                try:
+                    if wait:
+                        await asyncio.sleep(wait)
+                    await self._acquire(self.max_wait_seconds - wait)
+                finally:
+                    self.pending -= 1
+                self.admitted += 1
+                self.active += 1
+                started = time.monotonic()
+                try:
+                    yield
+                finally:
+                    self.active -= 1
+                    self._semaphore.release()
+                    self.avg_call_seconds = 0.9 * self.avg_call_seconds + 0.1 * (time.monotonic() - started)
+        finally:
+            queue.size -= 1
+            if queue.size == 0 and self._threads.get(thread_id) is queue:
+                del self._threads[thread_id]
+
+    async def run(self, thread_id: str, fn: Callable[[], Awaitable[T]]) -> T:
+        async with self.slot(thread_id):
+            return await fn()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "rate_per_second": self.rate_per_second,
+            "active": self.active,
+            "pending": self.pending,
+            "queued_threads": len(self._threads),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_call_seconds": self.avg_call_seconds,
+        }
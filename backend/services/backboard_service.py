@@ -3,8 +3,19 @@ import os
 from backboard import BackboardClient
 from dotenv import load_dotenv
 
+from services.metrics import timed
+from services.resilience import Upstream
+
 load_dotenv()
 
+# Per-operation deadlines in seconds
+BACKBOARD_TIMEOUT_SECONDS = float(os.getenv("BACKBOARD_TIMEOUT_SECONDS", "30"))
+BACKBOARD_LLM_TIMEOUT_SECONDS = float(os.getenv("BACKBOARD_LLM_TIMEOUT_SECONDS", "120"))
+BACKBOARD_UPLOAD_TIMEOUT_SECONDS = float(os.getenv("BACKBOARD_UPLOAD_TIMEOUT_SECONDS", "300"))
+BACKBOARD_STATUS_TIMEOUT_SECONDS = float(os.getenv("BACKBOARD_STATUS_TIMEOUT_SECONDS", "10"))
+# Longest pause between two chunks of a streamed reply
+BACKBOARD_STREAM_IDLE_SECONDS = float(os.getenv("BACKBOARD_STREAM_IDLE_SECONDS", "30"))
+
 # Initialize the Backboard client
 
 api_key=os.getenv("BACKBOARD_API_KEY")
@@ -13,31 +24,52 @@ if not api_key:
         "BACKBOARD_API_KEY not found in environment variables. "
     )
 
-client = BackboardClient(api_key=api_key)
+# The SDK's own HTTP timeout only backstops the per-operation deadlines above
+client = BackboardClient(api_key=api_key, timeout=max(BACKBOARD_LLM_TIMEOUT_SECONDS, BACKBOARD_UPLOAD_TIMEOUT_SECONDS))
+
+# Retries, deadlines and the circuit breaker shared by every Backboard call
+backboard_upstream = Upstream("backboard")
 
+@timed("backboard_create_assistant")
 async def create_assistant(name: str, description: str = None):
     """
     Create an assistant - from quickstart first-message.py
     Returns an assistant object with assistant_id
     """
-    assistant = await client.create_assistant(
+    assistant = await backboard_upstream.call("create_assistant", lambda: client.create_assistant(
         name=name,
         description=description or "A helpful assistant"
-    )
+    ), timeout=BACKBOARD_TIMEOUT_SECONDS)
     return assistant
 
+@timed("backboard_create_thread")
 async def create_thread(assistant_id: str):
     """
     Create a thread - from quickstart first-message.py
     Returns a thread object with thread_id
     """
-    thread = await client.create_thread(assistant_id)
+    thread = await backboard_upstream.call(
+        "create_thread", lambda: client.create_thread(assistant_id), timeout=BACKBOARD_TIMEOUT_SECONDS
+    )
     return thread
 
+@timed("backboard_get_assistant")
 async def get_assistant(assistant_id: str):
     """Get an existing assistant by ID."""
-    return await client.get_assistant(assistant_id)
+    return await backboard_upstream.call(
+        "get_assistant", lambda: client.get_assistant(assistant_id), timeout=BACKBOARD_TIMEOUT_SECONDS, idempotent=True
+    )
 
 # Delete Thread
+@timed("backboard_delete_thread")
 async def delete_thread(thread_id: str):
-    return await client.delete_thread(thread_id)
\ No newline at end of file
+    return await backboard_upstream.call(
+        "delete_thread", lambda: client.delete_thread(thread_id), timeout=BACKBOARD_TIMEOUT_SECONDS, idempotent=True
+    )
+
+# Delete Assistant
+@timed("backboard_delete_assistant")
+async def delete_assistant(assistant_id: str):
+    return await backboard_upstream.call(
+        "delete_assistant", lambda: client.delete_assistant(assistant_id), timeout=BACKBOARD_TIMEOUT_SECONDS, idempotent=True
+    )
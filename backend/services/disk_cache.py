@@ -0,0 +1,195 @@
+# Content-addressed LRU disk cache; one instance holds synthesized audio (session_cache), another parsed documents
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+
+# Cached files are named "<sha256>.<ext>", anything else in the directory is left alone
+_CACHE_FILE_RE = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]+$")
+
+
+class DiskLRUCache:
+    """
+    Byte-budgeted LRU cache of content-addressed files ("<sha256>.<ext>") in one directory.
+
+    The in-memory index maps cache keys to file sizes in least-recently-used
+    order. It is rebuilt from the directory on startup (ordered by mtime, which
+    is bumped on every hit) so the LRU order survives restarts. Files other
+    worker processes write into the same directory are adopted on first get().
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._index = OrderedDict()  # {filename: size}
+        self._used_at = {}  # {filename: last access time}, for age-based expiry
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and _CACHE_FILE_RE.match(entry.name):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for used_at, name, size in sorted(entries):
+            self._index[name] = size
+            self._used_at[name] = used_at
+            self._total_bytes += size
+        self._evict()
+
+    def path_for(self, key: str, extension: str) -> str:
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    def get(self, key: str, extension: str) -> Optional[str]:
+        """Return the cached file path for key, or None on a miss."""
+        name = f"{key}.{extension}"
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            if name in self._index and os.path.exists(path):
+                self._index.move_to_end(name)
+                self._used_at[name] = time.time()
+                self.hits += 1
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                return path
+            if name in self._index:
+                # File was removed behind our back
+                self._total_bytes -= self._index.pop(name)
+                self._used_at.pop(name, None)
+            elif os.path.isfile(path):
+                # Written by another worker process since our index was loaded
+                size = os.path.getsize(path)
+                self._index[name] = size
+                self._used_at[name] = time.time()
+                self._total_bytes += size
+                self.hits += 1
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                self._evict(keep=name)
+                return path
+            self.misses += 1
+            return None
+
+    def put(self, key: str, extension: str, chunks: Iterable[bytes]) -> str:
+        """
+        Write chunks of bytes into the cache and return the final file path.
+
+        Chunks are written to a temporary file first and renamed into place, so
+        readers never see a partially written file.
+        """
+        name = f"{key}.{extension}"
+        path = os.path.join(self.directory, name)
+        temp_path = os.path.join(self.directory, f".{name}.{uuid.uuid4().hex}.part")
+        try:
+            with open(temp_path, "wb") as f:  # wb = write binary
+                for chunk in chunks:
+                    f.write(chunk)
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        with self._lock:
+            if name in self._index:
+                self._total_bytes -= self._index.pop(name)
+            self._index[name] = size
+            self._used_at[name] = time.time()
+            self._total_bytes += size
+            self._evict(keep=name)
+        return path
+
+    def put_file(self, key: str, extension: str, source_path: str) -> str:
+        """Move an already written file (on the same filesystem) into the cache and return its path."""
+        name = f"{key}.{extension}"
+        path = os.path.join(self.directory, name)
+        size = os.path.getsize(source_path)
+        os.replace(source_path, path)
+
+        with self._lock:
+            if name in self._index:
+                self._total_bytes -= self._index.pop(name)
+            self._index[name] = size
+            self._used_at[name] = time.time()
+            self._total_bytes += size
+            self._evict(keep=name)
+        return path
+
+    def _evict(self, keep: Optional[str] = None):
+        # Caller holds the lock (or we are still in __init__)
+        while self._total_bytes > self.max_bytes and self._index:
+            name = next(iter(self._index))
+            if name == keep:
+                break
+            self._remove(name)
+            self.evictions += 1
+
+    def _remove(self, name: str):
+        # Caller holds the lock
+        self._total_bytes -= self._index.pop(name)
+        self._used_at.pop(name, None)
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return name in self._index
+
+    def lookup(self, name: str) -> Optional[str]:
+        """get() by file name ("<key>.<ext>"), None for names that are not cache files."""
+        if not _CACHE_FILE_RE.match(name):
+            return None
+        key, extension = name.split(".", 1)
+        return self.get(key, extension)
+
+    def discard(self, names: Iterable[str]) -> int:
+        """Remove the named files from the cache; returns how many were present."""
+        removed = 0
+        with self._lock:
+            for name in names:
+                if name in self._index:
+                    self._remove(name)
+                    removed += 1
+        return removed
+
+    def expire(self, max_age_seconds: float) -> List[str]:
+        """Remove files not used for max_age_seconds, oldest first; returns their names."""
+        cutoff = time.time() - max_age_seconds
+        expired = []
+        with self._lock:
+            # The index is in LRU order, so the scan stops at the first recently used file
+            while self._index:
+                name = next(iter(self._index))
+                if self._used_at.get(name, 0) >= cutoff:
+                    break
+                self._remove(name)
+                expired.append(name)
+        return expired
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,359 @@
+# Per-session on-disk chunk index, so prompts carry only the passages relevant to a question
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Iterable, List, Optional
+
+from services.disk_cache import DiskLRUCache
+from services.document_parser import CHUNK_OVERLAP, CHUNK_SIZE, PARSER_VERSION, is_supported, parse_to_file, read_chunks
+from services.metrics import timed
+from services.worker_pool import BoundedWorkerPool
+
+logger = logging.getLogger(__name__)
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+DOCUMENT_INDEX_DIR = os.getenv("DOCUMENT_INDEX_DIR", os.path.abspath(os.path.join(current_dir, "..", "document_index")))
+DOCUMENT_INDEX_BACKEND = os.getenv("DOCUMENT_INDEX_BACKEND", "bm25")  # "bm25" or "faiss"
+# SQLite reads the index through a shared memory map of this size instead of private page cache
+DOCUMENT_INDEX_MMAP_BYTES = int(os.getenv("DOCUMENT_INDEX_MMAP_BYTES", str(256 * 1024 * 1024)))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+# Backboard still adds its own document retrieval and memory to every message, so the passages put
+# into a prompt are capped by this estimate (about 4 characters per token) to keep prompts short
+RETRIEVAL_MAX_TOKENS = int(os.getenv("RETRIEVAL_MAX_TOKENS", "1200"))
+CHARS_PER_TOKEN = 4
+EMBEDDING_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION", "1024"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+
+# Parsing is CPU-bound, it runs in a process pool with one worker per core by default
+PARSER_PROCESSES = int(os.getenv("PARSER_PROCESSES", str(os.cpu_count() or 1)))
+PARSE_CACHE_DIR = os.getenv("PARSE_CACHE_DIR", os.path.abspath(os.path.join(current_dir, "..", "parse_cache")))
+PARSE_CACHE_MAX_BYTES = int(os.getenv("PARSE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+
+def tokenize(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+def fit_to_budget(passages: List[dict], max_tokens: int = RETRIEVAL_MAX_TOKENS) -> List[dict]:
+    """Keep passages, best first, while they fit in max_tokens; the best one is cut to fit if it alone is too long."""
+    budget = max_tokens * CHARS_PER_TOKEN
+    kept = []
+    for passage in passages:
+        if len(passage["text"]) > budget:
+            if not kept:
+                kept.append(dict(passage, text=passage["text"][:budget]))
+            break
+        kept.append(passage)
+        budget -= len(passage["text"])
+    return kept
+
+
+def parse_cache_key(content_hash: str, extension: str) -> str:
+    """Parsed output depends on the file bytes, how its type is read and the chunking settings."""
+    digest = hashlib.sha256()
+    for part in (content_hash, extension.lower(), PARSER_VERSION, str(CHUNK_SIZE), str(CHUNK_OVERLAP)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class Embedder(ABC):
+    """Turns texts into L2-normalized float32 vectors, a numpy array of shape (len(texts), dimension)."""
+
+    dimension: int
+
+    @abstractmethod
+    def embed(self, texts: List[str]):
+        raise NotImplementedError
+
+
+class HashingEmbedder(Embedder):
+    """
+    Offline embedder: signed feature hashing of words and word bigrams.
+
+    Needs no model download or API key; swap in a real embedding model by
+    passing another Embedder to DocumentIndex.
+    """
+
+    def __init__(self, dimension: int = EMBEDDING_DIMENSION):
+        self.dimension = dimension
+
+    def embed(self, texts: List[str]):
+        import numpy as np
+
+        vectors = np.zeros((len(texts), self.dimension), dtype="float32")
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+                h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                vectors[row, h % self.dimension] += -1.0 if h >> 63 else 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class DocumentIndex:
+    """
+    Chunk store and retrieval index, one directory per session.
+
+    Chunks live in a SQLite database with an FTS5 table, which ranks them
+    with BM25. With the "faiss" backend the chunks are also embedded into a
+    FAISS index next to it and ranked by cosine similarity instead. Both are
+    read through mmap, so pages are shared between worker processes rather
+    than copied into each one.
+    """
+
+    def __init__(self, root: str = DOCUMENT_INDEX_DIR, backend: str = DOCUMENT_INDEX_BACKEND, embedder: Optional[Embedder] = None):
+        if backend not in ("bm25", "faiss"):
+            raise ValueError(f"Unknown document index backend {backend!r}")
+        self.root = root
+        self.backend = backend
+        self.embedder = embedder or (HashingEmbedder() if backend == "faiss" else None)
+        self._locks = defaultdict(threading.Lock)  # {session_id: lock serializing writes}
+        self.parse_pool = BoundedWorkerPool("parser", PARSER_PROCESSES, processes=True)
+        self.parse_cache = DiskLRUCache(PARSE_CACHE_DIR, PARSE_CACHE_MAX_BYTES)
+        self.documents_indexed = 0
+        self.chunks_indexed = 0
+        self.documents_skipped = 0
+        self.searches = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _session_dir(self, session_id: str) -> str:
+        # Session ids come from the client, hash them into a safe directory name
+        return os.path.join(self.root, hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:32])
+
+    def _connect(self, session_dir: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(os.path.join(session_dir, "chunks.db"), timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA mmap_size={DOCUMENT_INDEX_MMAP_BYTES}")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id INTEGER PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                text TEXT NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS chunks_document ON chunks (content_hash)")
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(text, content='chunks', content_rowid='chunk_id')")
+        return conn
+
+    def _vectors_path(self, session_dir: str) -> str:
+        return os.path.join(session_dir, "vectors.faiss")
+
+    def add_document(self, session_id: str, content_hash: str, filename: str, chunks: Iterable[str]) -> int:
+        """
+        Store a document's chunks in the session index; returns the number of chunks added.
+
+        chunks may be a lazy iterator, it is consumed once and embedded in
+        batches, so a large document is never held in memory as a whole.
+        """
+        session_dir = self._session_dir(session_id)
+        with self._locks[session_id]:
+            os.makedirs(session_dir, exist_ok=True)
+            conn = self._connect(session_dir)
+            try:
+                if conn.execute("SELECT 1 FROM chunks WHERE content_hash = ? LIMIT 1", (content_hash,)).fetchone():
+                    return 0
+                vectors = self._load_vectors(session_dir) if self.backend == "faiss" else None
+                count = 0
+                with conn:
+                    batch_ids, batch_texts = [], []
+                    for position, text in enumerate(chunks):
+                        cursor = conn.execute(
+                            "INSERT INTO chunks (content_hash, filename, position, text) VALUES (?, ?, ?, ?)",
+                            (content_hash, filename, position, text)
+                        )
+                        conn.execute("INSERT INTO chunks_fts (rowid, text) VALUES (?, ?)", (cursor.lastrowid, text))
+                        count += 1
+                        if vectors is not None:
+                            batch_ids.append(cursor.lastrowid)
+                            batch_texts.append(text)
+                            if len(batch_ids) >= EMBEDDING_BATCH_SIZE:
+                                self._add_vectors(vectors, batch_ids, batch_texts)
+                                batch_ids, batch_texts = [], []
+                    if vectors is not None:
+                        self._add_vectors(vectors, batch_ids, batch_texts)
+                        self._save_vectors(session_dir, vectors)
+            finally:
+                conn.close()
+        if count:
+            self.documents_indexed += 1
+            self.chunks_indexed += count
+        return count
+
+    def _load_vectors(self, session_dir: str):
+        import faiss
+
+        path = self._vectors_path(session_dir)
+        if os.path.exists(path):
+            return faiss.read_index(path)
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(self.embedder.dimension))
+
+    def _add_vectors(self, index, chunk_ids: List[int], chunks: List[str]):
+        import numpy as np
+
+        if chunk_ids:
+            index.add_with_ids(self.embedder.embed(chunks), np.asarray(chunk_ids, dtype="int64"))
+
+    def _save_vectors(self, session_dir: str, index):
+        import faiss
+
+        # Readers mmap the file, so write a new one and swap it in
+        path = self._vectors_path(session_dir)
+        faiss.write_index(index, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    def _remove_vectors(self, session_dir: str, chunk_ids: List[int]):
+        import faiss
+        import numpy as np
+
+        path = self._vectors_path(session_dir)
+        if not os.path.exists(path):
+            return
+        index = faiss.read_index(path)
+        index.remove_ids(np.asarray(chunk_ids, dtype="int64"))
+        self._save_vectors(session_dir, index)
+
+    def _rank_bm25(self, conn: sqlite3.Connection, query: str, k: int) -> List[int]:
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        match = " OR ".join(f'"{term}"' for term in sorted(terms))
+        rows = conn.execute(
+            "SELECT rowid FROM chunks_fts WHERE chunks_fts MATCH ? ORDER BY bm25(chunks_fts) LIMIT ?",
+            (match, k)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _rank_faiss(self, session_dir: str, query: str, k: int) -> List[int]:
+        import faiss
+
+        path = self._vectors_path(session_dir)
+        if not os.path.exists(path):
+            return []
+        index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        scores, ids = index.search(self.embedder.embed([query]), k)
+        # A flat index returns k results even when they share nothing with the query
+        return [int(chunk_id) for score, chunk_id in zip(scores[0], ids[0]) if chunk_id >= 0 and score > 0]
+
+    def search(self, session_id: str, query: str, k: int = RETRIEVAL_TOP_K) -> List[dict]:
+        """
+        Return the k chunks of the session most relevant to query, best first,
+        fewer if they do not fit in RETRIEVAL_MAX_TOKENS.
+
+        Each hit is {"content_hash", "filename", "position", "text"}.
+        """
+        session_dir = self._session_dir(session_id)
+        if not os.path.exists(os.path.join(session_dir, "chunks.db")):
+            return []
+        self.searches += 1
+        conn = self._connect(session_dir)
+        try:
+            if self.backend == "faiss":
+                chunk_ids = self._rank_faiss(session_dir, query, k)
+            else:
+                chunk_ids = self._rank_bm25(conn, query, k)
+            if not chunk_ids:
+                return []
+            placeholders = ",".join("?" * len(chunk_ids))
+            rows = conn.execute(
+                f"SELECT chunk_id, content_hash, filename, position, text FROM chunks WHERE chunk_id IN ({placeholders})",
+                chunk_ids
+            ).fetchall()
+        finally:
+            conn.close()
+        by_id = {row["chunk_id"]: row for row in rows}
+        return fit_to_budget([
+            {
+                "content_hash": by_id[chunk_id]["content_hash"],
+                "filename": by_id[chunk_id]["filename"],
+                "position": by_id[chunk_id]["position"],
+                "text": by_id[chunk_id]["text"],
+            }
+            for chunk_id in chunk_ids if chunk_id in by_id
+        ])
+
+    def remove_document(self, session_id: str, content_hash: str):
+        session_dir = self._session_dir(session_id)
+        with self._locks[session_id]:
+            if not os.path.exists(os.path.join(session_dir, "chunks.db")):
+                return
+            conn = self._connect(session_dir)
+            try:
+                with conn:
+                    rows = conn.execute("SELECT chunk_id, text FROM chunks WHERE content_hash = ?", (content_hash,)).fetchall()
+                    for row in rows:
+                        # External-content FTS tables are told which text they indexed for a row
+                        conn.execute("INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', ?, ?)", (row["chunk_id"], row["text"]))
+                    conn.execute("DELETE FROM chunks WHERE content_hash = ?", (content_hash,))
+                    if rows and self.backend == "faiss":
+                        self._remove_vectors(session_dir, [row["chunk_id"] for row in rows])
+            finally:
+                conn.close()
+
+    def delete_session(self, session_id: str):
+        with self._locks[session_id]:
+            shutil.rmtree(self._session_dir(session_id), ignore_errors=True)
+        self._locks.pop(session_id, None)
+
+    @timed("document_parse")
+    async def parse(self, path: str, content_hash: str) -> str:
+        """
+        Extract, clean and chunk a file in the parser process pool; returns the path of the chunk file.
+
+        Output is cached by content hash, so the same file uploaded again (by
+        any session) is not parsed twice.
+        """
+        key = parse_cache_key(content_hash, os.path.splitext(path)[1])
+        cached = self.parse_cache.get(key, "jsonl")
+        if cached:
+            return cached
+
+        # Written next to the cache entries so the final rename stays on one filesystem
+        temp_path = os.path.join(self.parse_cache.directory, f".{key}.{uuid.uuid4().hex}.part")
+        try:
+            await self.parse_pool.run(parse_to_file, path, temp_path)
+            return self.parse_cache.put_file(key, "jsonl", temp_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @timed("local_index")
+    async def index_file_async(self, session_id: str, content_hash: str, filename: str, path: str) -> int:
+        """Parse and index a file; file types that cannot be read locally are skipped."""
+        if not is_supported(path):
+            self.documents_skipped += 1
+            logger.info("Not indexing %s locally: unsupported file type", filename)
+            return 0
+        chunks_path = await self.parse(path, content_hash)
+        return await asyncio.to_thread(self.add_document, session_id, content_hash, filename, read_chunks(chunks_path))
+
+    @timed("retrieval")
+    async def search_async(self, session_id: str, query: str, k: int = RETRIEVAL_TOP_K) -> List[dict]:
+        """search() off the event loop; retrieval problems degrade to no context instead of failing the request."""
+        try:
+            return await asyncio.to_thread(self.search, session_id, query, k)
+        except Exception as e:
+            logger.warning("Retrieval failed for session %s: %s", session_id, e)
+            return []
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "documents_indexed": self.documents_indexed,
+            "chunks_indexed": self.chunks_indexed,
+            "documents_skipped": self.documents_skipped,
+            "searches": self.searches,
+        }
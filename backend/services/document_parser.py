@@ -0,0 +1,152 @@
+# Turns uploaded files into plain-text chunks for the local retrieval index
+# Runs inside the parser worker processes, so keep imports here light and free of app state
+import json
+import os
+import re
+from typing import Iterable, Iterator, List
+
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1200"))  # characters
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+# PDF pages converted per pymupdf4llm call, bounds memory for very long documents
+PDF_PAGE_BATCH = int(os.getenv("PDF_PAGE_BATCH", "16"))
+# Bump when extraction or chunking changes so cached parses are not reused
+PARSER_VERSION = "2"
+
+TEXT_EXTENSIONS = {".txt", ".md", ".markdown", ".csv", ".json", ".html", ".htm", ".xml", ".yaml", ".yml", ".rst", ".log"}
+SUPPORTED_EXTENSIONS = TEXT_EXTENSIONS | {".pdf", ".docx"}
+
+
+class UnsupportedDocument(Exception):
+    """Raised for file types that cannot be turned into text locally."""
+
+
+def is_supported(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in SUPPORTED_EXTENSIONS
+
+
+def _iter_pdf(path: str) -> Iterator[str]:
+    import pymupdf
+    import pymupdf4llm
+
+    with pymupdf.open(path) as document:
+        for start in range(0, document.page_count, PDF_PAGE_BATCH):
+            pages = list(range(start, min(start + PDF_PAGE_BATCH, document.page_count)))
+            # Markdown output keeps headings and tables intact for chunking
+            yield pymupdf4llm.to_markdown(document, pages=pages, show_progress=False)
+
+
+def _iter_docx(path: str) -> Iterator[str]:
+    import docx
+
+    for paragraph in docx.Document(path).paragraphs:
+        yield paragraph.text + "\n\n"
+
+
+def _iter_text(path: str) -> Iterator[str]:
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        while block := f.read(256 * 1024):
+            yield block
+
+
+def iter_text(path: str) -> Iterator[str]:
+    """Yield the text of a PDF, DOCX or plain-text file in page-sized blocks."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".pdf":
+        return _iter_pdf(path)
+    if extension == ".docx":
+        return _iter_docx(path)
+    if extension in TEXT_EXTENSIONS:
+        return _iter_text(path)
+    raise UnsupportedDocument(f"Cannot extract text from {extension or 'extensionless'} files")
+
+
+def extract_text(path: str) -> str:
+    return "".join(iter_text(path))
+
+
+def clean_text(text: str) -> str:
+    """Undo line-break hyphenation and drop control characters left over from PDF extraction."""
+    text = re.sub(r"(\w)-\n(\w)", r"\1\2", text)
+    text = re.sub(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]", "", text)
+    return text
+
+
+def _split_long(paragraph: str, chunk_size: int) -> List[str]:
+    # Sentences first, then hard word windows for sentences that are still too long
+    pieces = []
+    for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+        while len(sentence) > chunk_size:
+            cut = sentence.rfind(" ", 0, chunk_size)
+            cut = cut if cut > 0 else chunk_size
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            pieces.append(sentence)
+    return pieces
+
+
+def _iter_pieces(blocks: Iterable[str], chunk_size: int) -> Iterator[str]:
+    pending = ""
+    for block in blocks:
+        paragraphs = re.split(r"\n\s*\n", pending + clean_text(block))
+        # The last paragraph may continue in the next block
+        pending = paragraphs.pop()
+        if len(pending) > 8 * chunk_size:
+            # No paragraph break in sight, flush all but the last (possibly cut) word
+            cut = max(pending.rfind(" "), pending.rfind("\n"))
+            if cut > 0:
+                paragraphs.append(pending[:cut])
+                pending = pending[cut:]
+        for paragraph in paragraphs:
+            paragraph = " ".join(paragraph.split())
+            if paragraph:
+                yield from _split_long(paragraph, chunk_size) if len(paragraph) > chunk_size else [paragraph]
+    pending = " ".join(pending.split())
+    if pending:
+        yield from _split_long(pending, chunk_size) if len(pending) > chunk_size else [pending]
+
+
+def iter_chunks(blocks: Iterable[str], chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> Iterator[str]:
+    """
+    Split streamed text into chunks of at most ~chunk_size characters on paragraph and sentence boundaries.
+
+    Consecutive chunks share up to overlap characters so a passage cut at a
+    boundary is still retrievable as a whole.
+    """
+    current = ""
+    for piece in _iter_pieces(blocks, chunk_size):
+        if current and len(current) + len(piece) + 1 > chunk_size:
+            yield current
+            tail = current[-overlap:] if overlap else ""
+            # Start the overlap on a word boundary
+            current = tail[tail.find(" ") + 1:] if " " in tail else ""
+        current = f"{current} {piece}" if current else piece
+    if current:
+        yield current
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    return list(iter_chunks([text], chunk_size, overlap))
+
+
+def parse_to_file(path: str, output_path: str) -> int:
+    """
+    Extract, clean and chunk a document, writing one JSON string per line to output_path.
+
+    Pages are streamed through the chunker, so memory stays bounded by the
+    page batch size rather than the document size. Returns the chunk count.
+    """
+    count = 0
+    with open(output_path, "w", encoding="utf-8") as f:
+        for chunk in iter_chunks(iter_text(path)):
+            f.write(json.dumps(chunk))
+            f.write("\n")
+            count += 1
+    return count
+
+
+def read_chunks(path: str) -> Iterator[str]:
+    """Stream the chunks written by parse_to_file."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
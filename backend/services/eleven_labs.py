@@ -1,9 +1,16 @@
 import os
-import uuid
 from io import BytesIO
 from dotenv import load_dotenv
 from elevenlabs.client import ElevenLabs
 
+from services.audio_cache import audio_cache_key, extension_for_format
+from services.disk_cache import DiskLRUCache
+from services.worker_pool import BoundedWorkerPool
+from services.metrics import timed
+from services.single_flight import SingleFlight
+from services.resilience import Upstream
+from services.audio_janitor import AudioJanitor
+
 load_dotenv()
 
 client = ElevenLabs(
@@ -12,37 +19,142 @@ client = ElevenLabs(
 
 # Get the current directory
 current_dir = os.path.dirname(os.path.abspath(__file__))
-audio_cache = os.path.abspath(os.path.join(current_dir, "..", "session_cache"))
+audio_cache = os.getenv("AUDIO_CACHE_DIR", os.path.abspath(os.path.join(current_dir, "..", "session_cache")))
 os.makedirs(audio_cache, exist_ok=True)
 
-def text_to_speech(session_id, text):
-    # .convert returns a generator of bytes
-    response = client.text_to_speech.convert(
-        voice_id='JBFqnCBsd6RMkjVDRZzb',
-        output_format="mp3_44100_128",
-        text=text,
-        model_id="eleven_multilingual_v2"
-    )
-    # Save to file
-    unique_id = uuid.uuid4()
-    file_path = os.path.join(audio_cache, f"{session_id}_{unique_id}.mp3")
-    
-    with open(file_path, "wb") as f:    # wb = write binary
-        for chunk in response:
-            f.write(chunk)
-                
-    return file_path
+# Per-request deadlines, enforced by the SDK's HTTP client (it runs on worker threads)
+ELEVENLABS_TTS_TIMEOUT_SECONDS = int(os.getenv("ELEVENLABS_TTS_TIMEOUT_SECONDS", "120"))
+ELEVENLABS_STT_TIMEOUT_SECONDS = int(os.getenv("ELEVENLABS_STT_TIMEOUT_SECONDS", "120"))
+
+# Retries and circuit breaker for ElevenLabs; the SDK's own retries are turned off so they do not stack
+elevenlabs_upstream = Upstream("elevenlabs")
+
+VOICE_ID = "JBFqnCBsd6RMkjVDRZzb"
+TTS_MODEL_ID = "eleven_multilingual_v2"
+
+# Named presets clients can ask for; speech stays intelligible far below music bitrates
+AUDIO_FORMATS = {
+    "high": "mp3_44100_128",
+    "standard": "mp3_44100_64",
+    "low": "mp3_22050_32",
+    "opus": "opus_48000_32",
+}
+# ElevenLabs formats that may also be requested by name
+SUPPORTED_OUTPUT_FORMATS = {
+    "mp3_22050_32", "mp3_24000_48", "mp3_44100_32", "mp3_44100_64", "mp3_44100_96", "mp3_44100_128", "mp3_44100_192",
+    "opus_48000_32", "opus_48000_64", "opus_48000_96", "opus_48000_128", "opus_48000_192",
+}
+# Used for clients that send "Save-Data: on"
+SAVE_DATA_FORMAT = AUDIO_FORMATS["low"]
+# Audio that is built by appending files (progressive streams) has to stay MP3, Ogg files do not concatenate
+STREAM_FALLBACK_FORMAT = AUDIO_FORMATS["low"]
+
+
+class UnsupportedAudioFormat(ValueError):
+    """Raised for an audio format that is neither a preset nor a supported ElevenLabs format."""
+
+
+def resolve_output_format(requested=None, save_data=False):
+    """
+    Pick the ElevenLabs output format for a request.
+
+    Args:
+        requested: Preset name ("high", "standard", "low", "opus") or ElevenLabs format, None for the default
+        save_data: Whether the client asked to save data (Save-Data header)
+
+    Returns:
+        ElevenLabs output format, e.g. "mp3_22050_32"
+    """
+    if not requested:
+        return SAVE_DATA_FORMAT if save_data else OUTPUT_FORMAT
+    output_format = AUDIO_FORMATS.get(requested.lower(), requested.lower())
+    if output_format not in SUPPORTED_OUTPUT_FORMATS:
+        raise UnsupportedAudioFormat(
+            f"Unsupported audio format {requested!r}, use one of {', '.join(AUDIO_FORMATS)} or an ElevenLabs mp3/opus format"
+        )
+    return output_format
+
+
+# Checked at startup: an unknown format would fail every TTS call and end up in every cache key
+OUTPUT_FORMAT = resolve_output_format(os.getenv("AUDIO_DEFAULT_FORMAT") or "high")
+
+
+def is_concatenable(output_format):
+    """MP3 frames can be appended to each other, Ogg Opus files cannot."""
+    return extension_for_format(output_format) == "mp3"
+
+# Synthesized audio is content-addressed, identical text never hits the API twice
+tts_cache = DiskLRUCache(
+    directory=audio_cache,
+    max_bytes=int(os.getenv("AUDIO_CACHE_MAX_BYTES", str(512 * 1024 * 1024))),
+)
+
+# Removes the audio of deleted sessions and files that have not been played for a while
+audio_janitor = AudioJanitor(tts_cache)
+
+# The ElevenLabs SDK is synchronous, so every call runs on this pool instead of the event loop
+audio_pool = BoundedWorkerPool(
+    name="elevenlabs",
+    max_workers=int(os.getenv("ELEVENLABS_MAX_CONCURRENCY", "4")),
+)
+
+# Concurrent requests for the same text wait for one synthesis, then all read the cached file
+tts_flights = SingleFlight("tts")
+
+@timed("tts")
+def text_to_speech(session_id, text, output_format=OUTPUT_FORMAT):
+    key = audio_cache_key(text, VOICE_ID, TTS_MODEL_ID, output_format)
+    extension = extension_for_format(output_format)
+
+    cached_path = tts_cache.get(key, extension)
+    if cached_path:
+        return cached_path
+
+    def synthesize():
+        # .convert returns a generator of bytes
+        response = client.text_to_speech.convert(
+            voice_id=VOICE_ID,
+            output_format=output_format,
+            text=text,
+            model_id=TTS_MODEL_ID,
+            request_options={"timeout_in_seconds": ELEVENLABS_TTS_TIMEOUT_SECONDS, "max_retries": 0}
+        )
+        # Save to file; a failure mid-stream leaves no partial file, so the whole call can be retried
+        return tts_cache.put(key, extension, response)
+
+    return elevenlabs_upstream.call_sync("text_to_speech", synthesize, idempotent=True)
 
 # Speech to text using ElevenLabs API
-def speech_to_text(audio_bytes):
-    
-    response = client.speech_to_text.convert(
-        file=BytesIO(audio_bytes),
-        model_id="scribe_v2"
-    )
+# audio is raw bytes or an already open file / (filename, file, content_type) tuple
+@timed("stt")
+def speech_to_text(audio):
+    if isinstance(audio, (bytes, bytearray)):
+        audio = BytesIO(audio)
+    stream = audio[1] if isinstance(audio, tuple) else audio
+
+    def transcribe():
+        # A retry has to send the recording from the start again
+        stream.seek(0)
+        return client.speech_to_text.convert(
+            file=audio,
+            model_id="scribe_v2",
+            request_options={"timeout_in_seconds": ELEVENLABS_STT_TIMEOUT_SECONDS, "max_retries": 0}
+        )
+
+    response = elevenlabs_upstream.call_sync("speech_to_text", transcribe, idempotent=True)
     transcript_text = response.text
     
     return transcript_text
+
+# Async wrappers used by the FastAPI handlers
+async def text_to_speech_async(session_id, text, output_format=OUTPUT_FORMAT):
+    key = audio_cache_key(text, VOICE_ID, TTS_MODEL_ID, output_format)
+    path = await tts_flights.do(key, lambda: audio_pool.run(text_to_speech, session_id, text, output_format))
+    audio_janitor.claim(session_id, path)
+    return path
+
+async def speech_to_text_async(audio):
+    return await audio_pool.run(speech_to_text, audio)
     
 # if __name__ == "__main__":
 #     # Simulate a session and some text
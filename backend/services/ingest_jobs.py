@@ -0,0 +1,196 @@
+# Background queue for document ingest so HTTP requests do not wait on indexing
+import asyncio
+import os
+import shutil
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+INGEST_JOB_CONCURRENCY = int(os.getenv("INGEST_JOB_CONCURRENCY", "4"))
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "1000"))
+
+
+class IngestJob:
+    """A single uploaded file waiting to be (or being) uploaded and indexed."""
+
+    def __init__(
+        self,
+        session_id: str,
+        filename: str,
+        content_type: str,
+        temp_path: str,
+        size: int,
+        temp_dir: Optional[str] = None,
+        content_hash: Optional[str] = None
+    ):
+        self.job_id = str(uuid.uuid4())
+        self.session_id = session_id
+        self.filename = filename
+        self.content_type = content_type
+        self.temp_path = temp_path
+        self.temp_dir = temp_dir
+        self.size = size
+        self.content_hash = content_hash
+        self.deduplicated = False  # set when an already indexed document was reused
+        self.status = "queued"  # queued -> running -> indexed | failed
+        self.document_id = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("indexed", "failed")
+
+    def to_dict(self) -> dict:
+        now = time.time()
+        queued_until = self.started_at or self.finished_at or now
+        return {
+            "job_id": self.job_id,
+            "session_id": self.session_id,
+            "filename": self.filename,
+            "status": self.status,
+            "document_id": self.document_id,
+            "error": self.error,
+            "size": self.size,
+            "content_hash": self.content_hash,
+            "deduplicated": self.deduplicated,
+            "created_at": datetime.fromtimestamp(self.created_at).isoformat(),
+            "queued_seconds": round(queued_until - self.created_at, 3),
+            "run_seconds": round((self.finished_at or now) - self.started_at, 3) if self.started_at else None,
+        }
+
+
+class IngestJobQueue:
+    """
+    Runs ingest jobs as background tasks with bounded concurrency.
+
+    Jobs are kept in memory; finished jobs beyond max_history are forgotten,
+    oldest first.
+    """
+
+    def __init__(self, max_concurrency: int = INGEST_JOB_CONCURRENCY, max_history: int = INGEST_JOB_HISTORY):
+        self.max_concurrency = max_concurrency
+        self.max_history = max_history
+        self.jobs = OrderedDict()  # {job_id: IngestJob}
+        self.session_jobs = defaultdict(list)  # {session_id: [job_id, ...]}
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.deduplicated = 0
+        self.total_run_seconds = 0.0
+        self.total_queued_seconds = 0.0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks = set()
+
+    def submit(
+        self,
+        session_id: str,
+        filename: str,
+        content_type: str,
+        temp_path: str,
+        size: int,
+        runner: Callable[[IngestJob], Awaitable[str]],
+        temp_dir: Optional[str] = None,
+        content_hash: Optional[str] = None
+    ) -> IngestJob:
+        """
+        Queue a job and return immediately.
+
+        runner(job) does the actual upload and returns the document id. The
+        queue owns temp_path (and temp_dir, if given) from here on and removes
+        them when the job ends.
+        """
+        job = IngestJob(session_id, filename, content_type, temp_path, size, temp_dir, content_hash)
+        self.jobs[job.job_id] = job
+        self.queued += 1
+        self.session_jobs[session_id].append(job.job_id)
+
+        task = asyncio.create_task(self._run(job, runner))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job: IngestJob, runner):
+        try:
+            async with self._semaphore:
+                self.queued -= 1
+                job.status = "running"
+                job.started_at = time.time()
+                self.running += 1
+                try:
+                    job.document_id = str(await runner(job))
+                    job.status = "indexed"
+                    self.completed += 1
+                    if job.deduplicated:
+                        self.deduplicated += 1
+                except Exception as e:
+                    job.status = "failed"
+                    job.error = str(e)
+                    self.failed += 1
+                finally:
+                    self.running -= 1
+                    job.finished_at = time.time()
+                    self.total_queued_seconds += job.started_at - job.created_at
+                    self.total_run_seconds += job.finished_at - job.started_at
+        finally:
+            if not job.finished:
+                # Cancelled (e.g. during shutdown) before the runner finished
+                if job.status == "queued":
+                    self.queued -= 1
+                job.status = "failed"
+                job.error = job.error or "Cancelled"
+                job.finished_at = time.time()
+            if os.path.exists(job.temp_path):
+                os.remove(job.temp_path)
+            if job.temp_dir:
+                shutil.rmtree(job.temp_dir, ignore_errors=True)
+            job.done.set()
+            self._trim_history()
+
+    def _trim_history(self):
+        excess = len(self.jobs) - self.max_history
+        if excess <= 0:
+            return
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished][:excess]:
+            job = self.jobs.pop(job_id)
+            session_job_ids = self.session_jobs.get(job.session_id)
+            if session_job_ids and job_id in session_job_ids:
+                session_job_ids.remove(job_id)
+                if not session_job_ids:
+                    del self.session_jobs[job.session_id]
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self.jobs.get(job_id)
+
+    def for_session(self, session_id: str) -> list:
+        return [self.jobs[job_id] for job_id in self.session_jobs.get(session_id, []) if job_id in self.jobs]
+
+    def forget_session(self, session_id: str):
+        """Drop the job history of a session (running jobs keep running)."""
+        for job_id in self.session_jobs.pop(session_id, []):
+            job = self.jobs.get(job_id)
+            if job and job.finished:
+                del self.jobs[job_id]
+
+    async def wait(self, job: IngestJob) -> IngestJob:
+        await job.done.wait()
+        return job
+
+    def stats(self) -> dict:
+        finished = self.completed + self.failed
+        return {
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "deduplicated": self.deduplicated,
+            "avg_queued_seconds": self.total_queued_seconds / finished if finished else 0.0,
+            "avg_run_seconds": self.total_run_seconds / finished if finished else 0.0,
+        }
@@ -0,0 +1,420 @@
+# Long lecture scripts are synthesized as paragraph-sized chunks in parallel, then stitched into one MP3
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from services.audio_cache import audio_cache_key, extension_for_format
+from services.eleven_labs import text_to_speech_async, tts_cache, audio_pool, audio_janitor, is_concatenable, VOICE_ID, TTS_MODEL_ID, OUTPUT_FORMAT
+from services.metrics import timed
+from services.single_flight import SingleFlight, flight_key
+from services.speech_pipeline import split_sentences
+
+logger = logging.getLogger(__name__)
+
+# Upper bound for one TTS request; paragraphs longer than this are split between sentences
+LECTURE_AUDIO_CHUNK_CHARS = int(os.getenv("LECTURE_AUDIO_CHUNK_CHARS", "1500"))
+# Paragraphs shorter than this (headings, one-liners) are spoken together with the next one
+LECTURE_AUDIO_MIN_CHUNK_CHARS = int(os.getenv("LECTURE_AUDIO_MIN_CHUNK_CHARS", "80"))
+# Chunks of one lecture synthesized at the same time, on top of the global ElevenLabs pool limit
+LECTURE_AUDIO_PARALLEL = int(os.getenv("LECTURE_AUDIO_PARALLEL", "4"))
+
+# Render the audio of every generated lecture in the background, before it is requested
+LECTURE_AUDIO_PREFETCH = os.getenv("LECTURE_AUDIO_PREFETCH", "0") == "1"
+LECTURE_AUDIO_PREFETCH_QUEUE = int(os.getenv("LECTURE_AUDIO_PREFETCH_QUEUE", "8"))
+# Prefetched audio not requested within this long counts as a wasted render
+LECTURE_AUDIO_PREFETCH_TTL_SECONDS = float(os.getenv("LECTURE_AUDIO_PREFETCH_TTL_SECONDS", "1800"))
+# How often a background render checks whether interactive TTS calls are still waiting
+LECTURE_AUDIO_PREFETCH_POLL_SECONDS = 0.1
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+
+# MPEG audio frame header tables (Layer III only, which is what ElevenLabs returns)
+_BITRATES_KBPS = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),  # MPEG-1
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),  # MPEG-2 and 2.5
+}
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def split_script(text: str, max_chars: int = LECTURE_AUDIO_CHUNK_CHARS, min_chars: int = LECTURE_AUDIO_MIN_CHUNK_CHARS) -> List[str]:
+    """
+    Split a lecture script into chunks for separate TTS requests.
+
+    Chunk boundaries follow the paragraphs so that editing one paragraph
+    changes only its own chunk (and cache key); the chunks around it keep
+    their text and are served from the cache.
+    """
+    chunks = []
+    pending = ""
+    for paragraph in _PARAGRAPH_RE.split(text):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        paragraph = f"{pending} {paragraph}" if pending else paragraph
+        if len(paragraph) < min_chars:
+            pending = paragraph
+            continue
+        pending = ""
+        if len(paragraph) <= max_chars:
+            chunks.append(paragraph)
+            continue
+        # Pack the sentences of a long paragraph into chunks of at most max_chars
+        current = ""
+        for sentence in split_sentences(paragraph, min_chars=0):
+            if current and len(current) + len(sentence) + 1 > max_chars:
+                chunks.append(current)
+                current = ""
+            current = f"{current} {sentence}" if current else sentence
+        if current:
+            chunks.append(current)
+    if pending:
+        if chunks:
+            chunks[-1] = f"{chunks[-1]} {pending}"
+        else:
+            chunks.append(pending)
+    return chunks
+
+
+def _frame_length(header: bytes) -> int:
+    """Length in bytes of the MPEG Layer III frame starting with header, 0 if it is not a valid header."""
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return 0
+    version = (header[1] >> 3) & 0x03  # 3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5
+    layer = (header[1] >> 1) & 0x03
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x03
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return 0
+    bitrate = _BITRATES_KBPS[1 if version == 3 else 2][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    padding = (header[2] >> 1) & 0x01
+    return (144 if version == 3 else 72) * bitrate // sample_rate + padding
+
+
+def mp3_frames(data: bytes) -> bytes:
+    """
+    Strip what would break a concatenated MP3: ID3v2/ID3v1 tags and a leading
+    Xing/Info frame, whose duration and seek table only describe this one chunk.
+    """
+    start, end = 0, len(data)
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        footer = 10 if data[5] & 0x10 else 0
+        start = 10 + size + footer
+    if end - start >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+    length = _frame_length(data[start:start + 4])
+    # The tag sits right after the side information, whose size depends on version and channels
+    if length and any(data[start + offset:start + offset + 4] in (b"Xing", b"Info") for offset in (13, 21, 36)):
+        start += length
+    return data[start:end]
+
+
+def _stitch(paths: List[str]) -> Iterator[bytes]:
+    for path in paths:
+        with open(path, "rb") as f:
+            yield mp3_frames(f.read())
+
+
+@timed("lecture_audio_stitch")
+def _stitch_to_cache(key: str, extension: str, paths: List[str]) -> str:
+    return tts_cache.put(key, extension, _stitch(paths))
+
+
+class PrefetchCancelled(Exception):
+    """A background render was cancelled before anyone asked for its audio."""
+
+
+class _RenderJob:
+    """State of one in-flight render, shared by every caller waiting on it."""
+
+    def __init__(self, background: bool):
+        self.background = background  # a prefetch nobody has asked for yet
+        self.cancelled = False
+
+
+class LectureAudioRenderer:
+    """
+    Renders a lecture script to a single audio file.
+
+    Each chunk goes through text_to_speech_async, so it is cached on its own
+    and shared with identical in-flight requests. The stitched file is cached
+    under a key derived from the chunk keys, so a repeated render is one lookup.
+
+    Background renders (prefetches) synthesize one chunk at a time and only
+    while no interactive TTS call is waiting for the pool. A foreground call
+    for the same script attaches to the running render and switches it to
+    full speed.
+    """
+
+    def __init__(self, parallel: int = LECTURE_AUDIO_PARALLEL):
+        self.parallel = parallel
+        self.renders = 0
+        self.chunks = 0
+        self.chunks_reused = 0
+        self.stitched = 0
+        self._flights = SingleFlight("lecture_audio")
+        self._jobs: Dict[str, _RenderJob] = {}
+
+    def plan(self, text: str, output_format: str = OUTPUT_FORMAT) -> Tuple[List[str], List[str], str]:
+        """Return the chunks of text, their cache keys and the cache key of the finished file."""
+        # Ogg Opus files cannot be stitched by appending, those lectures are rendered in one request
+        chunks = (split_script(text) if is_concatenable(output_format) else None) or [text]
+        keys = [audio_cache_key(chunk, VOICE_ID, TTS_MODEL_ID, output_format) for chunk in chunks]
+        key = keys[0] if len(keys) == 1 else flight_key("stitched", *keys)
+        return chunks, keys, key
+
+    def is_rendered(self, key: str, output_format: str) -> bool:
+        return f"{key}.{extension_for_format(output_format)}" in tts_cache
+
+    async def render(self, session_id: str, text: str, output_format: str = OUTPUT_FORMAT, background: bool = False) -> str:
+        """
+        Synthesize text and return the path of the finished audio file.
+
+        Args:
+            session_id: Session the audio is generated for
+            text: Full lecture script
+            output_format: ElevenLabs output format
+            background: Render at low priority (prefetch), see cancel()
+
+        Returns:
+            Path of the audio file in the TTS cache
+        """
+        chunks, keys, key = self.plan(text, output_format)
+        path = tts_cache.get(key, extension_for_format(output_format))
+        if path is None:
+            job = self._jobs.get(key)
+            if job is None:
+                job = self._jobs[key] = _RenderJob(background)
+            elif not background:
+                job.background = False
+            path = await self._flights.do(key, lambda: self._render(session_id, chunks, keys, key, output_format, job))
+        audio_janitor.claim(session_id, path)
+        return path
+
+    def cancel(self, key: str) -> bool:
+        """Stop a background render at the next chunk boundary, unless a foreground call attached to it."""
+        job = self._jobs.get(key)
+        if job is None or not job.background:
+            return False
+        job.cancelled = True
+        return True
+
+    async def _wait_for_turn(self, job: _RenderJob):
+        while job.background:
+            if job.cancelled:
+                raise PrefetchCancelled("Lecture audio prefetch cancelled")
+            if audio_pool.queued == 0:
+                return
+            await asyncio.sleep(LECTURE_AUDIO_PREFETCH_POLL_SECONDS)
+
+    async def _render(self, session_id: str, chunks: List[str], keys: List[str], key: str, output_format: str, job: _RenderJob) -> str:
+        extension = extension_for_format(output_format)
+        semaphore = asyncio.Semaphore(self.parallel)
+
+        async def synthesize(index: int) -> str:
+            cached_path = tts_cache.get(keys[index], extension)
+            if cached_path:
+                self.chunks_reused += 1
+                return cached_path
+            async with semaphore:
+                return await text_to_speech_async(session_id, chunks[index], output_format)
+
+        try:
+            self.renders += 1
+            self.chunks += len(chunks)
+            results: List[object] = [None] * len(chunks)
+            remaining = list(range(len(chunks)))
+            # Background: one chunk at a time, until a foreground caller attaches
+            while remaining and job.background:
+                await self._wait_for_turn(job)
+                index = remaining.pop(0)
+                try:
+                    results[index] = await synthesize(index)
+                except Exception as e:
+                    results[index] = e
+            # Let every chunk finish even if one fails: the others stay cached for the retry
+            for index, result in zip(remaining, await asyncio.gather(*(synthesize(index) for index in remaining), return_exceptions=True)):
+                results[index] = result
+
+            failed = [(index, result) for index, result in enumerate(results) if isinstance(result, BaseException)]
+            if failed:
+                index, error = failed[0]
+                logger.warning("%s of %s lecture audio chunks failed, first was chunk %s: %s", len(failed), len(chunks), index, error)
+                raise error
+            if len(chunks) == 1:
+                return results[0]
+
+            path = await asyncio.to_thread(_stitch_to_cache, key, extension, results)
+            self.stitched += 1
+            return path
+        finally:
+            if self._jobs.get(key) is job:
+                del self._jobs[key]
+
+    def stats(self) -> dict:
+        return {
+            "renders": self.renders,
+            "chunks": self.chunks,
+            "chunks_reused": self.chunks_reused,
+            "stitched": self.stitched,
+            "inflight": len(self._jobs),
+            "background": sum(1 for job in self._jobs.values() if job.background),
+        }
+
+
+class _Prefetch:
+    def __init__(self, session_id: str, text: str, output_format: str, key: str):
+        self.session_id = session_id
+        self.text = text
+        self.output_format = output_format
+        self.key = key
+        self.state = "queued"  # -> rendering -> done | failed | cancelled
+        self.finished_at = None
+
+
+class LectureAudioPrefetcher:
+    """
+    Speculatively renders lecture audio right after a lecture is generated.
+
+    Prefetches wait in a bounded queue (the oldest is dropped when it is
+    full) and are rendered one at a time in the background. A newer lecture
+    for the same session, or deleting the session, cancels the older one.
+    /generateLectureAudio goes through render(), which attaches to a running
+    prefetch or returns its finished file and counts the hit. Prefetched
+    audio nobody asked for within ttl_seconds is counted as wasted.
+    """
+
+    def __init__(
+        self,
+        renderer: LectureAudioRenderer,
+        enabled: bool = LECTURE_AUDIO_PREFETCH,
+        max_queued: int = LECTURE_AUDIO_PREFETCH_QUEUE,
+        ttl_seconds: float = LECTURE_AUDIO_PREFETCH_TTL_SECONDS
+    ):
+        self.renderer = renderer
+        self.enabled = enabled
+        self.max_queued = max_queued
+        self.ttl_seconds = ttl_seconds
+        self.enqueued = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.hits = 0
+        self.hits_inflight = 0
+        self.wasted = 0
+        self._queue: Deque[_Prefetch] = deque()
+        self._tracked: "OrderedDict[str, _Prefetch]" = OrderedDict()  # {key: prefetch}, until used or expired
+        self._latest: Dict[str, _Prefetch] = {}  # {session_id: newest prefetch}
+        self._worker: Optional[asyncio.Task] = None
+
+    def enqueue(self, session_id: str, text: str, output_format: str = OUTPUT_FORMAT) -> bool:
+        """Queue a background render of text; returns whether anything was queued."""
+        if not self.enabled or not text:
+            return False
+        self._expire()
+        _, _, key = self.renderer.plan(text, output_format)
+        if key in self._tracked or self.renderer.is_rendered(key, output_format):
+            self.skipped += 1
+            return False
+
+        previous = self._latest.get(session_id)
+        if previous is not None:
+            self._cancel(previous)
+        prefetch = _Prefetch(session_id, text, output_format, key)
+        self._latest[session_id] = prefetch
+        self._tracked[key] = prefetch
+        self._queue.append(prefetch)
+        self.enqueued += 1
+        while len(self._queue) > self.max_queued:
+            self._cancel(self._queue.popleft())
+            self.dropped += 1
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+        return True
+
+    def cancel_session(self, session_id: str):
+        prefetch = self._latest.pop(session_id, None)
+        if prefetch is not None:
+            self._cancel(prefetch)
+
+    def _cancel(self, prefetch: _Prefetch):
+        if prefetch.state == "queued":
+            prefetch.state = "cancelled"
+            self.cancelled += 1
+        elif prefetch.state == "rendering":
+            self.renderer.cancel(prefetch.key)
+        if self._tracked.get(prefetch.key) is prefetch and prefetch.state == "cancelled":
+            del self._tracked[prefetch.key]
+
+    async def _run(self):
+        try:
+            while self._queue:
+                prefetch = self._queue.popleft()
+                if prefetch.state != "queued":
+                    continue
+                prefetch.state = "rendering"
+                try:
+                    await self.renderer.render(prefetch.session_id, prefetch.text, prefetch.output_format, background=True)
+                    prefetch.state = "done"
+                    self.completed += 1
+                except PrefetchCancelled:
+                    prefetch.state = "cancelled"
+                    self.cancelled += 1
+                except Exception as e:
+                    prefetch.state = "failed"
+                    self.failed += 1
+                    logger.info("Lecture audio prefetch for session %s failed: %s", prefetch.session_id, e)
+                prefetch.finished_at = time.monotonic()
+                if prefetch.state != "done" and self._tracked.get(prefetch.key) is prefetch:
+                    del self._tracked[prefetch.key]
+                if self._latest.get(prefetch.session_id) is prefetch:
+                    del self._latest[prefetch.session_id]
+        finally:
+            self._worker = None
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        for key in [key for key, prefetch in self._tracked.items() if prefetch.finished_at is not None and prefetch.finished_at < cutoff]:
+            del self._tracked[key]
+            self.wasted += 1
+
+    async def render(self, session_id: str, text: str, output_format: str = OUTPUT_FORMAT) -> str:
+        """Foreground render, served by a running or finished prefetch when there is one."""
+        _, _, key = self.renderer.plan(text, output_format)
+        prefetch = self._tracked.pop(key, None)
+        if prefetch is not None:
+            if prefetch.state == "done":
+                self.hits += 1
+            elif prefetch.state == "rendering":
+                self.hits += 1
+                self.hits_inflight += 1
+            else:
+                # Still queued, rendering it in the foreground now makes the prefetch pointless
+                prefetch.state = "cancelled"
+                self.cancelled += 1
+        return await self.renderer.render(session_id, text, output_format)
+
+    def stats(self) -> dict:
+        self._expire()
+        settled = self.hits + self.wasted
+        return {
+            "enabled": int(self.enabled),
+            "queued": sum(1 for prefetch in self._queue if prefetch.state == "queued"),
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "skipped": self.skipped,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "hits": self.hits,
+            "hits_inflight": self.hits_inflight,
+            "wasted": self.wasted,
+            "hit_rate": self.hits / settled if settled else 0.0,
+        }
@@ -0,0 +1,97 @@
+# Cache of generated lectures keyed by topic and the set of documents they were generated from
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+LECTURE_CACHE_SIZE = int(os.getenv("LECTURE_CACHE_SIZE", "1000"))
+LECTURE_CACHE_TTL_SECONDS = float(os.getenv("LECTURE_CACHE_TTL_SECONDS", str(24 * 3600)))
+# Share lectures between sessions whose uploaded documents have identical content
+LECTURE_CACHE_SHARED = os.getenv("LECTURE_CACHE_SHARED", "false").lower() in ("1", "true", "yes")
+
+
+def normalize_topic(topic: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace so trivial rewordings share an entry."""
+    topic = re.sub(r"[^\w\s]", " ", topic.lower())
+    return " ".join(topic.split())
+
+
+def document_fingerprint(documents: List[dict], by_content: bool = False) -> str:
+    """
+    Fingerprint a session's document set (order does not matter).
+
+    by_content uses each document's content_hash, which is the same across
+    sessions that uploaded the same files; otherwise the Backboard document_id.
+    """
+    field = "content_hash" if by_content else "document_id"
+    digest = hashlib.sha256()
+    for value in sorted(str(document[field]) for document in documents):
+        digest.update(value.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class LectureCache:
+    """
+    TTL + LRU cache of GeneratedLectureResponse payloads.
+
+    Because the document fingerprint is part of the key, ingesting a new
+    document changes the key and old lectures are never served for the new
+    document set; invalidate_session() additionally frees their memory.
+    """
+
+    def __init__(self, max_entries: int = LECTURE_CACHE_SIZE, ttl_seconds: float = LECTURE_CACHE_TTL_SECONDS, shared: bool = LECTURE_CACHE_SHARED):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()  # {key: (expires_at, lecture)}
+        self._session_keys = {}        # {session_id: set of session-scoped keys}
+
+    def key_for(self, session_id: str, topic: str, documents: List[dict]) -> str:
+        if self.shared and documents and all(document.get("content_hash") for document in documents):
+            scope = "shared:" + document_fingerprint(documents, by_content=True)
+        else:
+            scope = f"session:{session_id}:" + document_fingerprint(documents)
+        return f"{scope}:{normalize_topic(topic)}"
+
+    def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+        if entry:
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: str, session_id: str, lecture: dict):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, dict(lecture))
+        self._entries.move_to_end(key)
+        if key.startswith("session:"):
+            self._session_keys.setdefault(session_id, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate_session(self, session_id: str):
+        """Drop the session-scoped lectures of a session (shared entries stay valid for other sessions)."""
+        for key in self._session_keys.pop(session_id, set()):
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "shared": self.shared,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
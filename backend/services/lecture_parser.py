@@ -0,0 +1,141 @@
+# Parsing of the lecture JSON returned by the LLM, both complete and streamed
+import json
+import re
+from typing import List, Tuple
+
+from services.metrics import timed
+
+# Placeholder slide used when the LLM output could not be parsed
+LECTURE_PARSE_FAILED = "Failed to parse AI structure"
+
+
+@timed("json_extraction")
+def extract_lecture_json(raw_content: str) -> dict:
+    """
+    Pull the lecture JSON object out of a raw LLM response.
+
+    Raises json.JSONDecodeError if no valid object can be found.
+    """
+    raw_content = raw_content.strip()
+
+    # 1. Try to find JSON block using Regex (extracts anything between the first { and last })
+    json_match = re.search(r"(\{.*\})", raw_content, re.DOTALL)
+
+    if json_match:
+        clean_content = json_match.group(1)
+    else:
+        # 2. Fallback: Manual markdown cleanup if regex fails
+        clean_content = raw_content.replace("```json", "").replace("```", "").strip()
+
+    return json.loads(clean_content)
+
+
+_SIMPLE_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class LectureStreamParser:
+    """
+    Incremental parser for the {"slide_content": [...], "lecture_script": "..."} object.
+
+    Feed it chunks of streamed text; it returns events as soon as they can be
+    known: ("slide", text) once a slide bullet string is closed and
+    ("script", delta) for each piece of the lecture script. Text before the
+    first "{" (e.g. a ```json fence) is ignored. The whole response is kept in
+    self.raw for a final extract_lecture_json() pass.
+    """
+
+    def __init__(self):
+        self.raw = ""
+        self.slides: List[str] = []
+        self._started = False
+        self._stack = []          # open containers: "{" or "["
+        self._container_keys = []  # key under which each open container lives
+        self._expect_key = False
+        self._last_key = None
+        self._in_string = False
+        self._string_is_key = False
+        self._string = []
+        self._escape = False
+        self._unicode = None       # hex digits collected after \\u
+        self._script_emitted = 0
+
+    def _string_target(self) -> str:
+        # What the string currently being read belongs to
+        if self._string_is_key or not self._stack:
+            return ""
+        if self._stack[-1] == "[" and self._container_keys[-1] == "slide_content" and len(self._stack) == 2:
+            return "slide"
+        if self._stack[-1] == "{" and len(self._stack) == 1 and self._last_key == "lecture_script":
+            return "script"
+        return ""
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        self.raw += chunk
+        events = []
+
+        for char in chunk:
+            if not self._started:
+                if char == "{":
+                    self._started = True
+                    self._stack.append("{")
+                    self._container_keys.append(None)
+                    self._expect_key = True
+                continue
+
+            if self._in_string:
+                if self._unicode is not None:
+                    self._unicode += char
+                    if len(self._unicode) == 4:
+                        try:
+                            self._string.append(chr(int(self._unicode, 16)))
+                        except ValueError:
+                            pass
+                        self._unicode = None
+                elif self._escape:
+                    self._escape = False
+                    if char == "u":
+                        self._unicode = ""
+                    else:
+                        self._string.append(_SIMPLE_ESCAPES.get(char, char))
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    value = "".join(self._string)
+                    target = self._string_target()
+                    if self._string_is_key:
+                        self._last_key = value
+                        self._expect_key = False
+                    elif target == "slide":
+                        self.slides.append(value)
+                        events.append(("slide", value))
+                    elif target == "script":
+                        self._flush_script(events)
+                else:
+                    self._string.append(char)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_is_key = self._stack[-1] == "{" and self._expect_key if self._stack else False
+                self._string = []
+                self._script_emitted = 0
+            elif char in "{[":
+                self._container_keys.append(self._last_key if self._stack and self._stack[-1] == "{" else None)
+                self._stack.append(char)
+                self._expect_key = char == "{"
+            elif char in "}]":
+                if self._stack:
+                    self._stack.pop()
+                    self._container_keys.pop()
+            elif char == ",":
+                self._expect_key = bool(self._stack) and self._stack[-1] == "{"
+
+        if self._in_string and self._string_target() == "script":
+            self._flush_script(events)
+        return events
+
+    def _flush_script(self, events):
+        if len(self._string) > self._script_emitted:
+            events.append(("script", "".join(self._string[self._script_emitted:])))
+            self._script_emitted = len(self._string)
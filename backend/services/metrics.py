@@ -0,0 +1,316 @@
+# Low-overhead latency instrumentation exposed in Prometheus text format at /metrics
+import asyncio
+import bisect
+import contextvars
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+# Upper bounds (seconds) of the histogram buckets, spanning fast cache hits to multi-minute indexing
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Scope of the HTTP request being handled; the router fills in scope["route"] once it matched
+_request_scope = contextvars.ContextVar("request_scope", default=None)
+
+
+def current_endpoint() -> str:
+    scope = _request_scope.get()
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values."""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._series = {}  # {label values: [bucket counts..., +Inf count, sum]}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            labels = tuple(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                bucket_labels = _format_labels(labels, 'le="%s"' % bound)
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            cumulative += values[len(self.buckets)]
+            bucket_labels = _format_labels(labels, 'le="+Inf"')
+            yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {values[-1]}"
+            yield f"{self.name}_count{_format_labels(labels)} {cumulative}"
+
+
+class CounterMetric:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(tuple(zip(self.label_names, label_values)))} {value}"
+
+
+class MetricsRegistry:
+    """Holds the metrics plus collectors that turn existing stats() dicts into gauges."""
+
+    def __init__(self):
+        self.stage_duration = Histogram(
+            "kt_stage_duration_seconds",
+            "Duration of each service stage (upload, indexing, LLM, TTS, ...)",
+            ("endpoint", "stage")
+        )
+        self.stage_errors = CounterMetric(
+            "kt_stage_errors_total",
+            "Service stages that raised an exception",
+            ("endpoint", "stage")
+        )
+        self.request_duration = Histogram(
+            "kt_http_request_duration_seconds",
+            "End-to-end HTTP request duration, including streamed bodies",
+            ("endpoint", "method", "status")
+        )
+        self._metrics = [self.request_duration, self.stage_duration, self.stage_errors]
+        self._collectors: Dict[str, Callable[[], dict]] = {}
+
+    def add_metric(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, name: str, collect: Callable[[], dict]):
+        """collect() returns a flat dict of numbers, exported as kt_<name>_<key> gauges."""
+        self._collectors[name] = collect
+
+    def observe_stage(self, stage: str, seconds: float, failed: bool = False):
+        endpoint = current_endpoint()
+        self.stage_duration.observe(seconds, endpoint, stage)
+        if failed:
+            self.stage_errors.inc(endpoint, stage)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, collect in self._collectors.items():
+            try:
+                values = collect()
+            except Exception:
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)):
+                    metric_name = f"kt_{name}_{key}"
+                    lines.append(f"# TYPE {metric_name} gauge")
+                    lines.append(f"{metric_name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Time a block of code as a stage of the current request."""
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        registry.observe_stage(stage, time.perf_counter() - started, failed)
+
+
+def timed(stage: str):
+    """
+    Decorator recording the duration of a function as a stage.
+
+    Works for plain functions, coroutines and async generators; for async
+    generators the time to the first item is also recorded as <stage>_first_chunk.
+    """
+    def decorator(fn):
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def async_gen_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                first = True
+                failed = False
+                try:
+                    async for item in fn(*args, **kwargs):
+                        if first:
+                            registry.observe_stage(f"{stage}_first_chunk", time.perf_counter() - started)
+                            first = False
+                        yield item
+                except BaseException:
+                    failed = True
+                    raise
+                finally:
+                    registry.observe_stage(stage, time.perf_counter() - started, failed)
+            return async_gen_wrapper
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with stage_timer(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by route template, method and status."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        token = _request_scope.set(scope)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            registry.request_duration.observe(
+                time.perf_counter() - started, current_endpoint(), scope["method"], str(status)
+            )
+            _request_scope.reset(token)
+
+
+# Bounds of the sampling interval in seconds
+PROFILER_MIN_INTERVAL = 0.0005
+PROFILER_MAX_INTERVAL = 1.0
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler that can be switched on and off at runtime.
+
+    A background thread samples the stacks of all threads every interval and
+    counts them in collapsed-stack format ("frame;frame;frame count"), which
+    flamegraph tools read directly. The cost is zero while it is stopped.
+    """
+
+    def __init__(self):
+        self.interval = 0.005
+        self.samples = 0
+        self.started_at = None
+        self._stacks = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = 0.005):
+        if not PROFILER_MIN_INTERVAL < interval <= PROFILER_MAX_INTERVAL:
+            # A zero or negative interval would turn the sampler into a busy loop
+            raise ValueError(f"Profiler interval must be in ({PROFILER_MIN_INTERVAL}, {PROFILER_MAX_INTERVAL}] seconds")
+        if self.running:
+            return
+        self.interval = interval
+        self.samples = 0
+        self.started_at = time.time()
+        self._stacks.clear()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self._stacks.most_common()) + "\n"
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "interval_seconds": self.interval,
+            "samples": self.samples,
+            "distinct_stacks": len(self._stacks),
+        }
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,181 @@
+# Picks the LLM per request class from rolling latency and error rates, failing over to the next model
+import os
+import re
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from services.metrics import CounterMetric, Histogram, registry
+from services.resilience import UpstreamUnavailable, is_retryable
+
+T = TypeVar("T")
+
+# Comma-separated "provider/model" lists, preferred model first
+LLM_ROUTE_QA = os.getenv("LLM_ROUTE_QA", "openai/gpt-4o-mini,openai/gpt-4o")
+LLM_ROUTE_LECTURE = os.getenv("LLM_ROUTE_LECTURE", "openai/gpt-4o,openai/gpt-4o-mini")
+# A model whose p95 exceeds the budget of a request class is skipped for it while a healthier one exists
+LLM_QA_P95_BUDGET_SECONDS = float(os.getenv("LLM_QA_P95_BUDGET_SECONDS", "10"))
+LLM_LECTURE_P95_BUDGET_SECONDS = float(os.getenv("LLM_LECTURE_P95_BUDGET_SECONDS", "60"))
+LLM_MAX_ERROR_RATE = float(os.getenv("LLM_MAX_ERROR_RATE", "0.25"))
+# Only the calls of the last window count; a degraded model gets traffic again once its bad samples age out
+LLM_HEALTH_WINDOW_SECONDS = float(os.getenv("LLM_HEALTH_WINDOW_SECONDS", "300"))
+LLM_HEALTH_MIN_SAMPLES = int(os.getenv("LLM_HEALTH_MIN_SAMPLES", "5"))
+LLM_HEALTH_MAX_SAMPLES = 500
+
+llm_routed = registry.add_metric(CounterMetric(
+    "kt_llm_routed_total", "LLM calls by request class, chosen model and why it was chosen", ("request_class", "model", "reason")
+))
+llm_model_duration = registry.add_metric(Histogram(
+    "kt_llm_model_duration_seconds", "Duration of LLM calls per request class and model", ("request_class", "model")
+))
+llm_model_errors = registry.add_metric(CounterMetric(
+    "kt_llm_model_errors_total", "Failed LLM calls per request class and model", ("request_class", "model")
+))
+
+
+def parse_route(spec: str) -> List[Tuple[str, str]]:
+    """Parse "openai/gpt-4o-mini,openai/gpt-4o" into [(provider, model), ...]."""
+    models = []
+    for item in spec.split(","):
+        provider, _, model = item.strip().partition("/")
+        if provider and model:
+            models.append((provider, model))
+    return models
+
+
+class ModelHealth:
+    """Rolling window of one model's call durations and outcomes for one request class."""
+
+    def __init__(self, window_seconds: float = LLM_HEALTH_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self._samples = deque(maxlen=LLM_HEALTH_MAX_SAMPLES)  # (finished_at, seconds, ok)
+
+    def record(self, seconds: float, ok: bool):
+        self._samples.append((time.monotonic(), seconds, ok))
+
+    def _recent(self):
+        cutoff = time.monotonic() - self.window_seconds
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        return self._samples
+
+    @property
+    def samples(self) -> int:
+        return len(self._recent())
+
+    def error_rate(self) -> float:
+        samples = self._recent()
+        return sum(1 for _, _, ok in samples if not ok) / len(samples) if samples else 0.0
+
+    def p95(self) -> float:
+        durations = sorted(seconds for _, seconds, ok in self._recent() if ok)
+        return durations[min(len(durations) - 1, int(len(durations) * 0.95))] if durations else 0.0
+
+    def healthy(self, p95_budget: float) -> bool:
+        if self.samples < LLM_HEALTH_MIN_SAMPLES:
+            return True
+        return self.error_rate() <= LLM_MAX_ERROR_RATE and self.p95() <= p95_budget
+
+    def score(self) -> float:
+        # Lower is better; used to order models when none is healthy
+        return self.p95() * (1 + 4 * self.error_rate())
+
+
+class ModelRouter:
+    """
+    Routes each request class (e.g. "qa", "lecture") to a model.
+
+    Every class has an ordered list of models and a p95 budget. The first
+    healthy model in the list is used; when all are degraded the one with
+    the best recent latency and error rate is. A call that fails in a way
+    that is safe to repeat moves on to the next model of the list; for
+    messages (writes) that is only a refusal such as 429 or 503, a timed out
+    message may already be on the thread and only counts against the model.
+    """
+
+    def __init__(self, routes: Dict[str, Tuple[List[Tuple[str, str]], float]]):
+        self.routes = routes  # {request_class: ([(provider, model), ...], p95 budget)}
+        self.downgrades = 0
+        self.failovers = 0
+        self._health: Dict[Tuple[str, str, str], ModelHealth] = {}
+
+    def health(self, request_class: str, provider: str, model: str) -> ModelHealth:
+        key = (request_class, provider, model)
+        if key not in self._health:
+            self._health[key] = ModelHealth()
+        return self._health[key]
+
+    def candidates(self, request_class: str) -> List[Tuple[str, str]]:
+        """The models to try for request_class, in order."""
+        models, budget = self.routes[request_class]
+        healthy = [m for m in models if self.health(request_class, *m).healthy(budget)]
+        degraded = sorted((m for m in models if m not in healthy), key=lambda m: self.health(request_class, *m).score())
+        return healthy + degraded
+
+    def record(self, request_class: str, provider: str, model: str, seconds: float, ok: bool):
+        self.health(request_class, provider, model).record(seconds, ok)
+        llm_model_duration.observe(seconds, request_class, f"{provider}/{model}")
+        if not ok:
+            llm_model_errors.inc(request_class, f"{provider}/{model}")
+
+    def routed(self, request_class: str, provider: str, model: str, attempt: int):
+        """Count a routing decision; reason is primary, downgrade (preferred model degraded) or failover."""
+        if attempt:
+            reason = "failover"
+            self.failovers += 1
+        elif (provider, model) != self.routes[request_class][0][0]:
+            reason = "downgrade"
+            self.downgrades += 1
+        else:
+            reason = "primary"
+        llm_routed.inc(request_class, f"{provider}/{model}", reason)
+
+    async def call(
+        self,
+        request_class: str,
+        fn: Callable[[str, str], Awaitable[T]],
+        provider: Optional[str] = None,
+        model: Optional[str] = None,
+        idempotent: bool = False
+    ) -> T:
+        """
+        Await fn(provider, model) on the routed model, failing over to the next one when that is safe.
+
+        Args:
+            request_class: Key of the route to use
+            fn: Makes the call for a given provider and model
+            provider, model: Pin the call to this model (no routing or failover)
+            idempotent: Whether repeating the call on another model is harmless
+        """
+        models = [(provider, model)] if provider and model else self.candidates(request_class)
+        for attempt, (provider, model) in enumerate(models):
+            self.routed(request_class, provider, model, attempt)
+            started = time.perf_counter()
+            try:
+                result = await fn(provider, model)
+            except UpstreamUnavailable:
+                # Backboard itself is overloaded or down, another model will not help
+                raise
+            except Exception as e:
+                self.record(request_class, provider, model, time.perf_counter() - started, ok=False)
+                if not is_retryable(e, idempotent) or attempt == len(models) - 1:
+                    raise
+                continue
+            self.record(request_class, provider, model, time.perf_counter() - started, ok=True)
+            return result
+
+    def stats(self) -> dict:
+        stats = {"downgrades": self.downgrades, "failovers": self.failovers}
+        for (request_class, provider, model), health in self._health.items():
+            prefix = re.sub(r"[^A-Za-z0-9_]", "_", f"{request_class}_{provider}_{model}")
+            stats[f"{prefix}_p95_seconds"] = health.p95()
+            stats[f"{prefix}_error_rate"] = health.error_rate()
+            stats[f"{prefix}_samples"] = health.samples
+        return stats
+
+
+def default_routes() -> Dict[str, Tuple[List[Tuple[str, str]], float]]:
+    return {
+        "qa": (parse_route(LLM_ROUTE_QA), LLM_QA_P95_BUDGET_SECONDS),
+        "lecture": (parse_route(LLM_ROUTE_LECTURE), LLM_LECTURE_P95_BUDGET_SECONDS),
+    }
@@ -0,0 +1,345 @@
+# Deadlines, retries, hedged reads and circuit breakers for the upstream APIs (Backboard, ElevenLabs)
+import asyncio
+import math
+import os
+import random
+import re
+import threading
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+import httpx
+
+from services.metrics import CounterMetric, registry
+
+T = TypeVar("T")
+
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "8"))
+# Consecutive transient failures that open a breaker, and how long it stays open before a probe
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+# Status codes that say the request was refused before any work was done, safe to retry even for writes
+_NOT_PROCESSED_STATUSES = {429, 503}
+_TRANSIENT_STATUSES = {408, 429, 500, 502, 503, 504}
+# The Backboard SDK wraps transport errors in a status-less BackboardAPIError
+_TRANSIENT_MESSAGE = re.compile(r"timed out|connection error", re.IGNORECASE)
+
+upstream_attempts = registry.add_metric(CounterMetric(
+    "kt_upstream_attempts_total", "Calls made to an upstream API, retries and hedges included", ("upstream", "operation")
+))
+upstream_retries = registry.add_metric(CounterMetric(
+    "kt_upstream_retries_total", "Upstream calls retried after a transient failure", ("upstream", "operation")
+))
+upstream_failures = registry.add_metric(CounterMetric(
+    "kt_upstream_failures_total", "Failed upstream attempts, by failure kind", ("upstream", "operation", "kind")
+))
+
+
+class UpstreamUnavailable(Exception):
+    """Base for errors that should reach the client as status_code with a Retry-After header."""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class CircuitOpen(UpstreamUnavailable):
+    """Raised without calling the upstream while its circuit breaker is open."""
+
+
+class UpstreamTimeout(TimeoutError):
+    """An upstream call exceeded its deadline."""
+
+
+def status_code_of(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Whether the failure says something about upstream health (as opposed to a bad request)."""
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError, ConnectionError, httpx.TransportError)):
+        return True
+    status = status_code_of(exc)
+    if status is not None:
+        return status in _TRANSIENT_STATUSES
+    return bool(_TRANSIENT_MESSAGE.search(str(exc)))
+
+
+def is_retryable(exc: BaseException, idempotent: bool) -> bool:
+    """
+    Writes (idempotent=False) are only retried when the upstream provably did not process them,
+    a timed out or dropped write may already have happened.
+    """
+    if status_code_of(exc) in _NOT_PROCESSED_STATUSES:
+        return True
+    return idempotent and is_transient(exc)
+
+
+def backoff_delay(attempt: int, exc: BaseException) -> float:
+    """Full-jitter exponential backoff, stretched to the upstream's Retry-After if it sent one."""
+    delay = random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** (attempt - 1)))
+    headers = getattr(exc, "headers", None) or getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        retry_after = float(headers.get("retry-after") or headers.get("Retry-After") or 0)
+    except (TypeError, ValueError, AttributeError):
+        retry_after = 0
+    return min(max(delay, retry_after), UPSTREAM_BACKOFF_MAX)
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after failure_threshold consecutive transient failures.
+
+    While open every call fails fast with CircuitOpen. After reset_seconds a
+    single probe call is let through (half-open): success closes the
+    breaker, failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_seconds: float = CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probe_started_at = None
+        self._lock = threading.Lock()  # also used from the ElevenLabs worker threads
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "closed":
+                return
+            now = time.monotonic()
+            if self.state == "open" and now - self._opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._probe_started_at = None
+            # One probe at a time; a probe that never reported back is replaced after reset_seconds
+            if self.state == "half_open" and (self._probe_started_at is None or now - self._probe_started_at >= self.reset_seconds):
+                self._probe_started_at = now
+                return
+            self.rejected += 1
+            retry_after = max(0.0, self.reset_seconds - (now - self._opened_at))
+        raise CircuitOpen(f"{self.name} is unavailable, try again shortly", retry_after)
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._probe_started_at = None
+
+    def record_failure(self, exc: BaseException):
+        if not is_transient(exc):
+            # The upstream answered, the request was the problem
+            self.record_success()
+            return
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.consecutive_failures >= self.failure_threshold):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probe_started_at = None
+                self.opened += 1
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "open": int(self.state != "closed"),
+            "consecutive_failures": self.consecutive_failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class Upstream:
+    """
+    Resilience policy for one upstream API.
+
+    call() runs an operation with a deadline, retries transient failures
+    with jittered backoff (writes only when it is safe), optionally hedges
+    slow idempotent reads, and reports to a shared circuit breaker.
+    """
+
+    def __init__(self, name: str, retries: int = UPSTREAM_RETRIES):
+        self.name = name
+        self.retries = retries
+        self.breaker = CircuitBreaker(name)
+        self.calls = 0
+        self.retried = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _failure(self, operation: str, exc: BaseException):
+        kind = "timeout" if isinstance(exc, (TimeoutError, asyncio.TimeoutError)) else "transient" if is_transient(exc) else "error"
+        if kind == "timeout":
+            self.timeouts += 1
+        upstream_failures.inc(self.name, operation, kind)
+        self.breaker.record_failure(exc)
+
+    def _should_retry(self, operation: str, exc: BaseException, attempt: int, retries: int, idempotent: bool) -> bool:
+        if attempt >= retries or not is_retryable(exc, idempotent) or self.breaker.state == "open":
+            return False
+        self.retried += 1
+        upstream_retries.inc(self.name, operation)
+        return True
+
+    async def _hedged(self, operation: str, fn: Callable[[], Awaitable[T]], hedge_after: float) -> T:
+        first = asyncio.ensure_future(fn())
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if done:
+                return first.result()
+            # Slow response, race a second identical read against it
+            self.hedges += 1
+            upstream_attempts.inc(self.name, operation)
+            second = asyncio.ensure_future(fn())
+            tasks.add(second)
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in (first, *tasks):
+                task.cancel()
+
+    async def call(
+        self,
+        operation: str,
+        fn: Callable[[], Awaitable[T]],
+        timeout: float,
+        idempotent: bool = False,
+        retries: Optional[int] = None,
+        hedge_after: Optional[float] = None
+    ) -> T:
+        """
+        Await fn() under this upstream's policy.
+
+        Args:
+            operation: Name used in metrics and errors
+            fn: Zero-argument callable returning a fresh awaitable per attempt
+            timeout: Deadline per attempt in seconds
+            idempotent: Whether repeating the call is harmless (reads, deletes)
+            retries: Override the number of retries
+            hedge_after: For idempotent reads, start a second attempt if the first is this slow
+        """
+        retries = self.retries if retries is None else retries
+        self.calls += 1
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            upstream_attempts.inc(self.name, operation)
+            try:
+                if hedge_after and idempotent:
+                    result = await asyncio.wait_for(self._hedged(operation, fn, hedge_after), timeout)
+                else:
+                    result = await asyncio.wait_for(fn(), timeout)
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    e = UpstreamTimeout(f"{self.name} {operation} timed out after {timeout:g}s")
+                self._failure(operation, e)
+                attempt += 1
+                if not self._should_retry(operation, e, attempt - 1, retries, idempotent):
+                    self.failed += 1
+                    raise e
+                await asyncio.sleep(backoff_delay(attempt, e))
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def stream(self, operation: str, open_stream: Callable[[], Awaitable[AsyncIterator[T]]], first_timeout: float, idle_timeout: float) -> AsyncIterator[T]:
+        """
+        Iterate a streamed response with a deadline for the first item and for each gap after it.
+
+        Streams are not retried: items may already have been passed on. A
+        stream that ended, or that the consumer closed after an item, counts
+        as a success.
+        """
+        self.breaker.before_call()
+        self.calls += 1
+        upstream_attempts.inc(self.name, operation)
+        timeout = first_timeout
+        iterator = None
+        ok = False
+        try:
+            iterator = (await asyncio.wait_for(open_stream(), first_timeout)).__aiter__()
+            while True:
+                try:
+                    item = await asyncio.wait_for(iterator.__anext__(), timeout)
+                except StopAsyncIteration:
+                    ok = True
+                    break
+                except asyncio.TimeoutError:
+                    raise UpstreamTimeout(f"{self.name} {operation} stalled for {timeout:g}s")
+                timeout = idle_timeout
+                yield item
+        except Exception as e:
+            self.failed += 1
+            self._failure(operation, e)
+            raise
+        except GeneratorExit:
+            # The consumer stopped reading (e.g. break) after taking an item
+            ok = True
+            raise
+        finally:
+            if iterator is not None and hasattr(iterator, "aclose"):
+                await iterator.aclose()
+            if ok:
+                self.breaker.record_success()
+
+    def call_sync(self, operation: str, fn: Callable[[], T], idempotent: bool = False, retries: Optional[int] = None) -> T:
+        """
+        call() for blocking SDKs, run from a worker thread.
+
+        The deadline has to be enforced by the SDK itself (e.g. a request timeout option).
+        """
+        retries = self.retries if retries is None else retries
+        self.calls += 1
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            upstream_attempts.inc(self.name, operation)
+            try:
+                result = fn()
+            except Exception as e:
+                self._failure(operation, e)
+                attempt += 1
+                if not self._should_retry(operation, e, attempt - 1, retries, idempotent):
+                    self.failed += 1
+                    raise
+                time.sleep(backoff_delay(attempt, e))
+                continue
+            self.breaker.record_success()
+            return result
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "retries": self.retried,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            **{f"breaker_{key}": value for key, value in self.breaker.stats().items()},
+        }
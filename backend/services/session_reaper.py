@@ -0,0 +1,192 @@
+# Expires idle sessions: local state, stored session, Backboard thread and assistant, cached audio
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+
+from services.backboard_service import delete_assistant, delete_thread
+from services.resilience import status_code_of
+from services.session_store import SessionRepository
+
+logger = logging.getLogger(__name__)
+
+# Sessions not used for this long are deleted; 0 keeps sessions forever
+SESSION_IDLE_TTL_SECONDS = float(os.getenv("SESSION_IDLE_TTL_SECONDS", str(7 * 24 * 3600)))
+SESSION_REAPER_INTERVAL_SECONDS = float(os.getenv("SESSION_REAPER_INTERVAL_SECONDS", "300"))
+SESSION_REAPER_BATCH_SIZE = int(os.getenv("SESSION_REAPER_BATCH_SIZE", "50"))
+# Remote deletions run this many at a time and start at most this often, next to live traffic
+SESSION_REAPER_CONCURRENCY = int(os.getenv("SESSION_REAPER_CONCURRENCY", "4"))
+SESSION_REAPER_RATE_PER_SECOND = float(os.getenv("SESSION_REAPER_RATE_PER_SECOND", "5"))
+# Remote deletions still pending this long after the local delete are retried by the reaper
+SESSION_REMOTE_RETRY_AFTER_SECONDS = float(os.getenv("SESSION_REMOTE_RETRY_AFTER_SECONDS", "60"))
+
+
+async def delete_remote_session(session: dict):
+    """Delete a session's Backboard thread, then its assistant. Already deleted resources count as deleted."""
+    for delete, resource_id in ((delete_thread, session.get("thread_id")), (delete_assistant, session.get("assistant_id"))):
+        if not resource_id:
+            continue
+        try:
+            await delete(resource_id)
+        except Exception as e:
+            if status_code_of(e) != 404:
+                raise
+
+
+class SessionReaper:
+    """
+    Deletes sessions that have not been used for idle_seconds, in batches.
+
+    The store keeps each session's last access time. A sweep first writes
+    the access times this worker buffered, then repeatedly takes the least
+    recently used idle sessions and deletes their rows; a row deleted by
+    another worker first, or used again in the meantime, is skipped. For the
+    sessions it deleted, forget() drops the in-process state and purges the
+    audio right away, and the Backboard threads and assistants are deleted
+    concurrently under a rate limit. The store keeps every deleted session
+    as pending remote deletion until that succeeds, so remote deletions that
+    failed here or in /deleteSession, on any worker and across restarts, are
+    retried at the start of the next sweep. A session that cannot be deleted
+    is logged and skipped without stopping the sweep.
+    """
+
+    def __init__(
+        self,
+        store: SessionRepository,
+        forget: Callable[[str], Awaitable[None]],
+        idle_seconds: float = SESSION_IDLE_TTL_SECONDS,
+        interval_seconds: float = SESSION_REAPER_INTERVAL_SECONDS,
+        batch_size: int = SESSION_REAPER_BATCH_SIZE,
+        concurrency: int = SESSION_REAPER_CONCURRENCY,
+        rate_per_second: float = SESSION_REAPER_RATE_PER_SECOND,
+        delete_remote: Callable[[dict], Awaitable[None]] = delete_remote_session
+    ):
+        self.store = store
+        self.forget = forget
+        self.idle_seconds = idle_seconds
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rate_per_second = rate_per_second
+        self.delete_remote = delete_remote
+        self.sweeps = 0
+        self.sessions_evicted = 0
+        self.remote_deleted = 0
+        self.remote_failed = 0
+        self.remote_pending = 0  # remote deletions that failed in the last sweep
+        self.evict_errors = 0
+        self._next_start = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.idle_seconds > 0
+
+    def start(self):
+        if self._task is None and self.enabled:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Session reaper sweep failed")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def sweep(self) -> int:
+        """Evict every session idle for longer than idle_seconds; return how many were evicted."""
+        await self.store.flush_access()
+        self.remote_pending = 0
+        await self._retry_remote()
+
+        idle_before = time.time() - self.idle_seconds
+        evicted = 0
+        seen: Set[str] = set()
+        while True:
+            batch = [
+                session for session in await self.store.list_idle_sessions(idle_before, self.batch_size)
+                if session["session_id"] not in seen
+            ]
+            if not batch:
+                break
+            seen.update(session["session_id"] for session in batch)
+            claimed = []
+            for session in batch:
+                try:
+                    if await self.store.delete_session(session["session_id"], idle_before=idle_before):
+                        claimed.append(session)
+                        await self.forget(session["session_id"])
+                except Exception:
+                    self.evict_errors += 1
+                    logger.exception("Could not evict session %s", session["session_id"])
+            await self._delete_remote(claimed)
+            evicted += len(claimed)
+        self.sessions_evicted += evicted
+        self.sweeps += 1
+        return evicted
+
+    async def _retry_remote(self):
+        """Delete the remote resources of sessions deleted earlier whose remote deletion is still pending."""
+        deleted_before = time.time() - SESSION_REMOTE_RETRY_AFTER_SECONDS
+        seen: Set[Tuple[str, Optional[str]]] = set()
+        while True:
+            batch = [
+                session for session in await self.store.pending_remote_deletions(deleted_before, self.batch_size)
+                if (session["session_id"], session["thread_id"]) not in seen
+            ]
+            if not batch:
+                break
+            seen.update((session["session_id"], session["thread_id"]) for session in batch)
+            await self._delete_remote(batch)
+
+    async def _paced(self):
+        """Wait for this deletion's turn under the rate limit."""
+        now = time.monotonic()
+        start = max(now, self._next_start)
+        self._next_start = start + 1 / self.rate_per_second
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def _delete_remote(self, sessions: List[dict]):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def delete(session: dict) -> Tuple[dict, bool]:
+            async with semaphore:
+                await self._paced()
+                try:
+                    await self.delete_remote(session)
+                    await self.store.remote_deleted(session)
+                    return session, True
+                except Exception as e:
+                    logger.warning("Could not delete Backboard resources of session %s: %s", session["session_id"], e)
+                    return session, False
+
+        for session, deleted in await asyncio.gather(*(delete(session) for session in sessions)):
+            if deleted:
+                self.remote_deleted += 1
+            else:
+                self.remote_failed += 1
+                self.remote_pending += 1
+
+    def stats(self) -> dict:
+        return {
+            "running": int(self._task is not None),
+            "idle_seconds": self.idle_seconds,
+            "sweeps": self.sweeps,
+            "sessions_evicted": self.sessions_evicted,
+            "remote_deleted": self.remote_deleted,
+            "remote_failed": self.remote_failed,
+            "remote_pending": self.remote_pending,
+            "evict_errors": self.evict_errors,
+        }
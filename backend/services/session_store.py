@@ -0,0 +1,569 @@
+# Session persistence: which assistant/thread belongs to a session and which documents it uploaded
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+SESSION_STORE = os.getenv("SESSION_STORE", "sqlite")  # "sqlite" or "memory"
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.abspath(os.path.join(current_dir, "..", "sessions.db")))
+SESSION_DB_POOL_SIZE = int(os.getenv("SESSION_DB_POOL_SIZE", "8"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+# Cached entries are re-read after this long so changes made by other workers show up
+# (documents added elsewhere can take this long to appear)
+SESSION_CACHE_TTL_SECONDS = float(os.getenv("SESSION_CACHE_TTL_SECONDS", "30"))
+# Deletions made by other workers are picked up this often, a deleted session is not served for longer
+SESSION_DELETE_SYNC_SECONDS = float(os.getenv("SESSION_DELETE_SYNC_SECONDS", "1"))
+# How long deletions are remembered for workers that have not picked them up yet
+SESSION_TOMBSTONE_TTL_SECONDS = 3600
+
+
+class SessionRepository(ABC):
+    """
+    Storage interface for session state.
+
+    A session is {"session_id", "assistant_id", "thread_id", "created_at"};
+    documents are the dicts returned by /getDocuments. Each session also has a
+    last access time (epoch seconds) used to expire idle sessions.
+    """
+
+    @abstractmethod
+    async def get_session(self, session_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def create_session(self, session_id: str, assistant_id: str, thread_id: str) -> dict:
+        """Store a new session unless one already exists; return the stored session either way."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_session(self, session_id: str, idle_before: Optional[float] = None) -> bool:
+        """
+        Delete a session and its documents; return whether it existed.
+
+        With idle_before, only delete it if it was last accessed before that time,
+        so a session used again since it was found idle is kept. The session's
+        Backboard thread and assistant are recorded as pending deletion in the
+        same step, until remote_deleted() is called for it.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def pending_remote_deletions(self, deleted_before: float, limit: int) -> List[dict]:
+        """Deleted sessions {"session_id", "assistant_id", "thread_id"} whose remote resources may still exist."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def remote_deleted(self, session: dict):
+        """Record that the Backboard thread and assistant of a deleted session are gone."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def record_access(self, accessed: Dict[str, float]):
+        """Store the last access times {session_id: epoch seconds} of sessions."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def list_idle_sessions(self, idle_before: float, limit: int) -> List[dict]:
+        """Return up to limit sessions last accessed before idle_before, least recently used first."""
+        raise NotImplementedError
+
+    async def flush_access(self):
+        """Write access times buffered by this instance, if any."""
+
+    async def deleted_since(self, cursor: Optional[int]) -> Tuple[List[str], Optional[int]]:
+        """
+        Sessions deleted (by any worker) after cursor, and the cursor to pass next time.
+
+        A cursor of None starts at the present. Stores that are not shared
+        between processes have nothing to report.
+        """
+        return [], cursor
+
+    @abstractmethod
+    async def list_documents(self, session_id: str) -> List[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def add_document(self, session_id: str, document: dict):
+        raise NotImplementedError
+
+    async def find_document(self, session_id: str, content_hash: str) -> Optional[dict]:
+        """Return the session's document with this content hash, if it was uploaded before."""
+        for document in await self.list_documents(session_id):
+            if content_hash and document.get("content_hash") == content_hash:
+                return document
+        return None
+
+    def stats(self) -> dict:
+        return {}
+
+
+class InMemorySessionRepository(SessionRepository):
+    """Process-local storage, only suitable for a single worker and for tests."""
+
+    def __init__(self):
+        self.sessions = {}   # {session_id: session}
+        self.documents = {}  # {session_id: [document info]}
+        self.accessed = {}   # {session_id: last access, epoch seconds}
+        self.pending_remote = {}  # {(session_id, thread_id): (deleted_at, session)}
+
+    async def get_session(self, session_id):
+        return self.sessions.get(session_id)
+
+    async def create_session(self, session_id, assistant_id, thread_id):
+        if session_id not in self.sessions:
+            self.accessed[session_id] = time.time()
+        return self.sessions.setdefault(session_id, {
+            "session_id": session_id,
+            "assistant_id": assistant_id,
+            "thread_id": thread_id,
+            "created_at": datetime.now().isoformat()
+        })
+
+    async def delete_session(self, session_id, idle_before=None):
+        if session_id not in self.sessions:
+            return False
+        if idle_before is not None and self.accessed.get(session_id, 0) >= idle_before:
+            return False
+        session = self.sessions.pop(session_id)
+        self.documents.pop(session_id, None)
+        self.accessed.pop(session_id, None)
+        self.pending_remote[(session_id, session["thread_id"])] = (time.time(), session)
+        return True
+
+    async def pending_remote_deletions(self, deleted_before, limit):
+        pending = sorted((at, key) for key, (at, _) in self.pending_remote.items() if at < deleted_before)
+        return [self.pending_remote[key][1] for _, key in pending[:limit]]
+
+    async def remote_deleted(self, session):
+        self.pending_remote.pop((session["session_id"], session["thread_id"]), None)
+
+    async def record_access(self, accessed):
+        for session_id, at in accessed.items():
+            if session_id in self.sessions:
+                self.accessed[session_id] = max(self.accessed.get(session_id, 0), at)
+
+    async def list_idle_sessions(self, idle_before, limit):
+        idle = sorted((at, session_id) for session_id, at in self.accessed.items() if at < idle_before)
+        return [self.sessions[session_id] for _, session_id in idle[:limit]]
+
+    async def list_documents(self, session_id):
+        return list(self.documents.get(session_id, []))
+
+    async def add_document(self, session_id, document):
+        self.documents.setdefault(session_id, []).append(dict(document))
+
+
+class _ConnectionPool:
+    """A small pool of SQLite connections shared by worker threads."""
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            conn = self._connect() if create else self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+
+class SQLiteSessionRepository(SessionRepository):
+    """
+    Session storage in sessions.db, shared by every worker process on the host.
+
+    WAL mode lets readers in other processes proceed while one writes. Queries
+    run on worker threads so the event loop never waits on disk.
+    """
+
+    def __init__(self, path: str = SESSION_DB_PATH, pool_size: int = SESSION_DB_POOL_SIZE):
+        self.path = path
+        self._pool = _ConnectionPool(path, pool_size)
+        with self._pool.connection() as conn:
+            self._migrate(conn)
+
+    def _migrate(self, conn: sqlite3.Connection):
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    assistant_id TEXT,
+                    thread_id TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )""")
+            if self._ensure_column(conn, "sessions", "last_accessed_at", "REAL"):
+                # Sessions from before access tracking count as last used when they were created
+                conn.execute("UPDATE sessions SET last_accessed_at = CAST(strftime('%s', created_at) AS REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_accessed_at ON sessions(last_accessed_at)")
+            # Recent deletions, read by the other workers to drop their cached copies
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS deleted_sessions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    deleted_at REAL NOT NULL
+                )""")
+            # The Backboard thread and assistant of a deleted session, kept until they are deleted too
+            self._ensure_column(conn, "deleted_sessions", "assistant_id", "TEXT")
+            self._ensure_column(conn, "deleted_sessions", "thread_id", "TEXT")
+            self._ensure_column(conn, "deleted_sessions", "remote_pending", "INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_deleted_sessions_deleted_at ON deleted_sessions(deleted_at)")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_deleted_sessions_pending ON deleted_sessions(deleted_at) WHERE remote_pending = 1"
+            )
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    document_id TEXT NOT NULL,
+                    size INTEGER,
+                    content_type TEXT,
+                    uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+                )""")
+            self._ensure_column(conn, "documents", "job_id", "TEXT")
+            self._ensure_column(conn, "documents", "content_hash", "TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_session_id ON documents(session_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_session_hash ON documents(session_id, content_hash)")
+
+    @staticmethod
+    def _ensure_column(conn: sqlite3.Connection, table: str, column: str, declaration: str) -> bool:
+        """Add the column if it is missing; return whether it was added."""
+        columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+            return True
+        return False
+
+    async def _run(self, fn, *args):
+        def call():
+            with self._pool.connection() as conn:
+                return fn(conn, *args)
+        return await asyncio.to_thread(call)
+
+    @staticmethod
+    def _session_row(row) -> Optional[dict]:
+        if row is None:
+            return None
+        return {
+            "session_id": row["session_id"],
+            "assistant_id": row["assistant_id"],
+            "thread_id": row["thread_id"],
+            "created_at": row["created_at"]
+        }
+
+    async def get_session(self, session_id):
+        def query(conn, session_id):
+            row = conn.execute(
+                "SELECT session_id, assistant_id, thread_id, created_at FROM sessions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+            return self._session_row(row)
+        return await self._run(query, session_id)
+
+    async def create_session(self, session_id, assistant_id, thread_id):
+        def insert(conn, session_id, assistant_id, thread_id):
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO sessions (session_id, assistant_id, thread_id, last_accessed_at) VALUES (?, ?, ?, ?)",
+                    (session_id, assistant_id, thread_id, time.time())
+                )
+            row = conn.execute(
+                "SELECT session_id, assistant_id, thread_id, created_at FROM sessions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+            return self._session_row(row)
+        return await self._run(insert, session_id, assistant_id, thread_id)
+
+    async def delete_session(self, session_id, idle_before=None):
+        def delete(conn, session_id, idle_before):
+            with conn:
+                # Take the write lock up front, so a worker recording a fresh access cannot slip in
+                # between the idle check on the documents and the one on the session row
+                conn.execute("BEGIN IMMEDIATE")
+                session = conn.execute(
+                    "SELECT assistant_id, thread_id FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                # Documents reference the session row, they have to go first
+                if idle_before is None:
+                    conn.execute("DELETE FROM documents WHERE session_id = ?", (session_id,))
+                    deleted = conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount
+                else:
+                    conn.execute(
+                        "DELETE FROM documents WHERE session_id = ? AND EXISTS "
+                        "(SELECT 1 FROM sessions WHERE session_id = ? AND last_accessed_at < ?)",
+                        (session_id, session_id, idle_before)
+                    )
+                    deleted = conn.execute(
+                        "DELETE FROM sessions WHERE session_id = ? AND last_accessed_at < ?", (session_id, idle_before)
+                    ).rowcount
+                if deleted:
+                    now = time.time()
+                    conn.execute(
+                        "INSERT INTO deleted_sessions (session_id, deleted_at, assistant_id, thread_id, remote_pending) "
+                        "VALUES (?, ?, ?, ?, 1)",
+                        (session_id, now, session["assistant_id"], session["thread_id"])
+                    )
+                    conn.execute(
+                        "DELETE FROM deleted_sessions WHERE deleted_at < ? AND remote_pending = 0",
+                        (now - SESSION_TOMBSTONE_TTL_SECONDS,)
+                    )
+            return bool(deleted)
+        return await self._run(delete, session_id, idle_before)
+
+    async def pending_remote_deletions(self, deleted_before, limit):
+        def query(conn, deleted_before, limit):
+            rows = conn.execute(
+                "SELECT session_id, assistant_id, thread_id FROM deleted_sessions "
+                "WHERE remote_pending = 1 AND deleted_at < ? ORDER BY deleted_at LIMIT ?",
+                (deleted_before, limit)
+            ).fetchall()
+            return [dict(row) for row in rows]
+        return await self._run(query, deleted_before, limit)
+
+    async def remote_deleted(self, session):
+        def update(conn, session):
+            with conn:
+                conn.execute(
+                    "UPDATE deleted_sessions SET remote_pending = 0 WHERE session_id = ? AND thread_id IS ?",
+                    (session["session_id"], session.get("thread_id"))
+                )
+        await self._run(update, session)
+
+    async def deleted_since(self, cursor):
+        def query(conn, cursor):
+            if cursor is None:
+                return [], conn.execute("SELECT COALESCE(MAX(id), 0) FROM deleted_sessions").fetchone()[0]
+            rows = conn.execute(
+                "SELECT id, session_id FROM deleted_sessions WHERE id > ? ORDER BY id", (cursor,)
+            ).fetchall()
+            return [row["session_id"] for row in rows], (rows[-1]["id"] if rows else cursor)
+        return await self._run(query, cursor)
+
+    async def record_access(self, accessed):
+        def update(conn, accessed):
+            with conn:
+                conn.executemany(
+                    "UPDATE sessions SET last_accessed_at = MAX(COALESCE(last_accessed_at, 0), ?) WHERE session_id = ?",
+                    [(at, session_id) for session_id, at in accessed.items()]
+                )
+        await self._run(update, accessed)
+
+    async def list_idle_sessions(self, idle_before, limit):
+        def query(conn, idle_before, limit):
+            rows = conn.execute(
+                "SELECT session_id, assistant_id, thread_id, created_at FROM sessions "
+                "WHERE last_accessed_at < ? ORDER BY last_accessed_at LIMIT ?",
+                (idle_before, limit)
+            ).fetchall()
+            return [self._session_row(row) for row in rows]
+        return await self._run(query, idle_before, limit)
+
+    async def list_documents(self, session_id):
+        def query(conn, session_id):
+            rows = conn.execute(
+                "SELECT filename, document_id, uploaded_at, size, content_type, job_id, content_hash "
+                "FROM documents WHERE session_id = ? ORDER BY id",
+                (session_id,)
+            ).fetchall()
+            return [dict(row) for row in rows]
+        return await self._run(query, session_id)
+
+    async def find_document(self, session_id, content_hash):
+        def query(conn, session_id, content_hash):
+            row = conn.execute(
+                "SELECT filename, document_id, uploaded_at, size, content_type, job_id, content_hash "
+                "FROM documents WHERE session_id = ? AND content_hash = ? LIMIT 1",
+                (session_id, content_hash)
+            ).fetchone()
+            return dict(row) if row else None
+        return await self._run(query, session_id, content_hash)
+
+    async def add_document(self, session_id, document):
+        def insert(conn, session_id, document):
+            with conn:
+                conn.execute(
+                    "INSERT INTO documents (session_id, filename, document_id, uploaded_at, size, content_type, job_id, content_hash) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        session_id,
+                        document["filename"],
+                        document["document_id"],
+                        document["uploaded_at"],
+                        document["size"],
+                        document["content_type"],
+                        document.get("job_id"),
+                        document.get("content_hash")
+                    )
+                )
+        await self._run(insert, session_id, document)
+
+
+class CachedSessionRepository(SessionRepository):
+    """
+    Read-through LRU cache in front of another repository.
+
+    Entries expire after ttl_seconds so state written by other workers is
+    picked up; writes made through this instance update the cache directly.
+    Session deletions made by other workers are read from the backend at
+    most every SESSION_DELETE_SYNC_SECONDS and drop the cached copies, so a
+    deleted session is not served for the whole TTL. Session accesses are
+    buffered here and written in one batch by flush_access(), so a request
+    never waits on an access-time update.
+    """
+
+    def __init__(self, backend: SessionRepository, max_entries: int = SESSION_CACHE_SIZE, ttl_seconds: float = SESSION_CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._sessions = OrderedDict()   # {session_id: (expires_at, session)}
+        self._documents = OrderedDict()  # {session_id: (expires_at, [document info])}
+        self._accessed: Dict[str, float] = {}  # {session_id: last access} not written yet
+        self.remote_deletions = 0
+        self._deletions_cursor: Optional[int] = None
+        self._deletions_synced_at = 0.0
+
+    def _get(self, cache: OrderedDict, session_id: str):
+        entry = cache.get(session_id)
+        if entry and entry[0] > time.monotonic():
+            cache.move_to_end(session_id)
+            self.hits += 1
+            return True, entry[1]
+        cache.pop(session_id, None)
+        self.misses += 1
+        return False, None
+
+    def _put(self, cache: OrderedDict, session_id: str, value):
+        cache[session_id] = (time.monotonic() + self.ttl_seconds, value)
+        cache.move_to_end(session_id)
+        while len(cache) > self.max_entries:
+            cache.popitem(last=False)
+
+    async def _sync_deletions(self):
+        now = time.monotonic()
+        if now - self._deletions_synced_at < SESSION_DELETE_SYNC_SECONDS:
+            return
+        self._deletions_synced_at = now
+        deleted, self._deletions_cursor = await self.backend.deleted_since(self._deletions_cursor)
+        for session_id in deleted:
+            if session_id in self._sessions or session_id in self._documents:
+                self.remote_deletions += 1
+            self.invalidate(session_id)
+
+    async def get_session(self, session_id):
+        await self._sync_deletions()
+        found, session = self._get(self._sessions, session_id)
+        if not found:
+            session = await self.backend.get_session(session_id)
+            # Unknown sessions are not cached, they usually get created right after
+            if session is not None:
+                self._put(self._sessions, session_id, session)
+        if session is not None:
+            self._accessed[session_id] = time.time()
+        return session
+
+    async def create_session(self, session_id, assistant_id, thread_id):
+        session = await self.backend.create_session(session_id, assistant_id, thread_id)
+        self._put(self._sessions, session_id, session)
+        return session
+
+    async def delete_session(self, session_id, idle_before=None):
+        deleted = await self.backend.delete_session(session_id, idle_before)
+        if deleted or idle_before is None:
+            self.invalidate(session_id)
+        return deleted
+
+    async def record_access(self, accessed):
+        await self.backend.record_access(accessed)
+
+    async def list_idle_sessions(self, idle_before, limit):
+        return await self.backend.list_idle_sessions(idle_before, limit)
+
+    async def pending_remote_deletions(self, deleted_before, limit):
+        return await self.backend.pending_remote_deletions(deleted_before, limit)
+
+    async def remote_deleted(self, session):
+        await self.backend.remote_deleted(session)
+
+    async def flush_access(self):
+        accessed, self._accessed = self._accessed, {}
+        if not accessed:
+            return
+        try:
+            await self.backend.record_access(accessed)
+        except Exception:
+            for session_id, at in accessed.items():
+                self._accessed[session_id] = max(at, self._accessed.get(session_id, 0))
+            raise
+
+    async def list_documents(self, session_id):
+        await self._sync_deletions()
+        found, documents = self._get(self._documents, session_id)
+        if not found:
+            documents = await self.backend.list_documents(session_id)
+            self._put(self._documents, session_id, documents)
+        return list(documents)
+
+    async def add_document(self, session_id, document):
+        await self.backend.add_document(session_id, document)
+        self._documents.pop(session_id, None)
+
+    def invalidate(self, session_id: str):
+        self._sessions.pop(session_id, None)
+        self._documents.pop(session_id, None)
+        self._accessed.pop(session_id, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "cached_sessions": len(self._sessions),
+            "pending_accesses": len(self._accessed),
+            "remote_deletions": self.remote_deletions,
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "cache_hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def create_session_repository() -> SessionRepository:
+    """Build the repository selected by SESSION_STORE, wrapped in the read-through cache."""
+    if SESSION_STORE == "memory":
+        backend = InMemorySessionRepository()
+    elif SESSION_STORE == "sqlite":
+        backend = SQLiteSessionRepository()
+    else:
+        raise ValueError(f"Unknown SESSION_STORE: {SESSION_STORE}")
+    return CachedSessionRepository(backend)
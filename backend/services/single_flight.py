@@ -0,0 +1,60 @@
+# Request coalescing: concurrent identical calls share one upstream call and its result
+import asyncio
+import hashlib
+from typing import Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+def flight_key(*parts) -> str:
+    """Hash the parts that make two calls identical into a single key."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """
+    Deduplicates in-flight work by key.
+
+    The first caller for a key (the leader) starts the call as a task; callers
+    arriving while it runs await the same task instead of starting their own.
+    Nothing is kept once the call finishes, caching results is left to the
+    caches behind it. A caller that is cancelled (e.g. the client went away)
+    does not cancel the shared call for the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved, every waiter may have been cancelled already
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "upstream_calls": self.calls - self.coalesced,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+            "coalesced_rate": self.coalesced / self.calls if self.calls else 0.0,
+        }
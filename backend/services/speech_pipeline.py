@@ -0,0 +1,173 @@
+# Sentence-level TTS pipeline: audio for an answer starts before the whole answer is synthesized
+import asyncio
+import logging
+import os
+import re
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Sentences shorter than this are merged with the next one to avoid tiny TTS calls
+SPEECH_SEGMENT_MIN_CHARS = int(os.getenv("SPEECH_SEGMENT_MIN_CHARS", "40"))
+# How long a finished stream stays available for replay
+SPEECH_STREAM_TTL_SECONDS = float(os.getenv("SPEECH_STREAM_TTL_SECONDS", "3600"))
+
+# End of sentence: ., ! or ? (optionally followed by a closing quote/bracket) and whitespace
+_SENTENCE_END_RE = re.compile(r"[.!?]+[\"')\]]*\s+|\n{2,}")
+
+
+class SentenceSegmenter:
+    """Splits incrementally arriving text into sentence-sized segments."""
+
+    def __init__(self, min_chars: int = SPEECH_SEGMENT_MIN_CHARS):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """Add text and return the segments that are now complete."""
+        self._buffer += text
+        segments = []
+        start = 0
+        for match in _SENTENCE_END_RE.finditer(self._buffer):
+            if match.end() - start < self.min_chars:
+                continue
+            segment = self._buffer[start:match.end()].strip()
+            if segment:
+                segments.append(segment)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return segments
+
+    def flush(self) -> List[str]:
+        """Return whatever is left once the text is complete."""
+        remainder = self._buffer.strip()
+        self._buffer = ""
+        return [remainder] if remainder else []
+
+
+def split_sentences(text: str, min_chars: int = SPEECH_SEGMENT_MIN_CHARS) -> List[str]:
+    segmenter = SentenceSegmenter(min_chars)
+    return segmenter.feed(text) + segmenter.flush()
+
+
+class SpeechStream:
+    """
+    Ordered audio segments for one piece of spoken text.
+
+    Text is added as it arrives, each complete sentence is synthesized right
+    away (concurrently with the others) and iter_audio() yields the audio of
+    the segments in order as soon as each one is ready.
+    """
+
+    def __init__(self, session_id: str, synthesize: Callable[[str, str], Awaitable[str]], media_type: str = "audio/mpeg"):
+        self.stream_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.media_type = media_type
+        self.created_at = time.time()
+        self.closed = False
+        self.failed_segments = 0
+        self._synthesize = synthesize
+        self._segmenter = SentenceSegmenter()
+        self._segments: List[asyncio.Task] = []
+        self._updated = asyncio.Event()
+
+    def _notify(self):
+        # Wake every waiting reader, new waiters get a fresh event
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    def _schedule(self, segments: List[str]):
+        for text in segments:
+            task = asyncio.create_task(self._synthesize(self.session_id, text))
+            task.add_done_callback(_retrieve_exception)
+            self._segments.append(task)
+        if segments:
+            self._notify()
+
+    def add_text(self, text: str):
+        self._schedule(self._segmenter.feed(text))
+
+    def close(self):
+        """Mark the text as complete, synthesizing any trailing partial sentence."""
+        if self.closed:
+            return
+        self._schedule(self._segmenter.flush())
+        self.closed = True
+        self._notify()
+
+    def cancel(self):
+        for task in self._segments:
+            task.cancel()
+        self.closed = True
+        self._notify()
+
+    @property
+    def done(self) -> bool:
+        return self.closed and all(task.done() for task in self._segments)
+
+    async def segment_paths(self) -> AsyncIterator[str]:
+        """Yield the audio file of each segment, in order, as it becomes ready."""
+        index = 0
+        while True:
+            if index < len(self._segments):
+                try:
+                    yield await self._segments[index]
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # Skip a failed sentence rather than cutting the whole answer short
+                    self.failed_segments += 1
+                    logger.warning("Speech segment %s of stream %s failed: %s", index, self.stream_id, e)
+                index += 1
+            elif self.closed:
+                return
+            else:
+                await self._updated.wait()
+
+    async def iter_audio(self) -> AsyncIterator[bytes]:
+        async for path in self.segment_paths():
+            yield await asyncio.to_thread(_read_file, path)
+
+
+def _retrieve_exception(task: asyncio.Task):
+    # Failures are reported by segment_paths(), this only silences "never retrieved" warnings
+    if not task.cancelled():
+        task.exception()
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class SpeechStreamRegistry:
+    """In-memory lookup of speech streams by id, finished streams expire after a TTL."""
+
+    def __init__(self, ttl_seconds: float = SPEECH_STREAM_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.streams = {}  # {stream_id: SpeechStream}
+        self.started = 0
+
+    def create(self, session_id: str, synthesize: Callable[[str, str], Awaitable[str]], media_type: str = "audio/mpeg") -> SpeechStream:
+        self.prune()
+        stream = SpeechStream(session_id, synthesize, media_type)
+        self.streams[stream.stream_id] = stream
+        self.started += 1
+        return stream
+
+    def get(self, stream_id: str) -> Optional[SpeechStream]:
+        return self.streams.get(stream_id)
+
+    def prune(self):
+        cutoff = time.time() - self.ttl_seconds
+        for stream_id in [sid for sid, stream in self.streams.items() if stream.created_at < cutoff and stream.done]:
+            del self.streams[stream_id]
+
+    def stats(self) -> dict:
+        return {
+            "active": sum(1 for stream in self.streams.values() if not stream.done),
+            "retained": len(self.streams),
+            "started": self.started,
+        }
@@ -0,0 +1,96 @@
+# Bounded-memory handling of uploaded files
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+
+from fastapi import UploadFile
+
+from services.metrics import timed
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+MAX_AUDIO_UPLOAD_BYTES = int(os.getenv("MAX_AUDIO_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds its size limit (mapped to HTTP 413)."""
+
+
+class SpooledUpload:
+    """An upload copied to its own temp directory under its original filename."""
+
+    def __init__(self, temp_dir: str, path: str, size: int, content_hash: str):
+        self.temp_dir = temp_dir
+        self.path = path
+        self.size = size
+        self.content_hash = content_hash
+
+    def cleanup(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+def upload_size(file: UploadFile) -> int:
+    """Size of an upload without reading it (Starlette already spooled the body)."""
+    if getattr(file, "size", None) is not None:
+        return file.size
+    position = file.file.tell()
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(position)
+    return size
+
+
+def check_upload_size(file: UploadFile, max_bytes: int):
+    size = upload_size(file)
+    if size > max_bytes:
+        raise UploadTooLarge(f"{file.filename} is {size} bytes, the limit is {max_bytes} bytes")
+
+
+def _copy_and_hash(source, destination_path: str, max_bytes: int):
+    digest = hashlib.sha256()
+    size = 0
+    with open(destination_path, "wb") as buffer:
+        # Fixed-size chunks keep memory flat no matter how large the file is
+        while chunk := source.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(f"Upload exceeds the limit of {max_bytes} bytes")
+            digest.update(chunk)
+            buffer.write(chunk)
+    return size, digest.hexdigest()
+
+
+@timed("upload_copy")
+async def spool_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> SpooledUpload:
+    """
+    Copy an upload into a private temp directory, keeping the original filename for Backboard.
+
+    The copy and the sha256 run on a worker thread in one pass, so the event
+    loop is not blocked and each request holds at most one chunk in memory.
+    """
+    check_upload_size(file, max_bytes)
+
+    # temp_path = f"/tmp/{file.filename}" # For AWS Lambda
+    temp_dir = tempfile.mkdtemp(prefix="ingest_")
+    temp_path = os.path.join(temp_dir, os.path.basename(file.filename or "upload"))
+    try:
+        file.file.seek(0)
+        size, content_hash = await asyncio.to_thread(_copy_and_hash, file.file, temp_path, max_bytes)
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    return SpooledUpload(temp_dir, temp_path, size, content_hash)
+
+
+def upload_stream(file: UploadFile, max_bytes: int):
+    """
+    Return the upload as a (filename, file object, content type) tuple for SDK calls.
+
+    The already spooled body is handed over as-is instead of being read into
+    a bytes object and copied again.
+    """
+    check_upload_size(file, max_bytes)
+    file.file.seek(0)
+    return (file.filename or "upload", file.file, file.content_type or "application/octet-stream")
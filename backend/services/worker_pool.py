@@ -0,0 +1,92 @@
+# Bounded thread pool for running blocking SDK calls without freezing the event loop
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from services.metrics import registry
+
+
+class BoundedWorkerPool:
+    """
+    Runs synchronous callables on a dedicated thread pool.
+
+    At most max_workers calls run at once, the rest wait on an asyncio
+    semaphore so the number of waiting jobs (queue depth) can be reported.
+    With processes=True the calls run in worker processes instead, for
+    CPU-bound work; fn and its arguments must then be picklable.
+    """
+
+    def __init__(self, name: str, max_workers: int, processes: bool = False):
+        self.name = name
+        self.max_workers = max_workers
+        self.processes = processes
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self._semaphore = asyncio.Semaphore(max_workers)
+        self._executor = self._create_executor()
+
+    def _create_executor(self):
+        if self.processes:
+            # spawn: forking a process that already runs threads is unsafe
+            return ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix=self.name
+        )
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the pool and await its result."""
+        loop = asyncio.get_running_loop()
+        self.queued += 1
+        waiting = True
+        enqueued_at = time.perf_counter()
+        try:
+            async with self._semaphore:
+                self.queued -= 1
+                waiting = False
+                self.active += 1
+                registry.observe_stage(f"{self.name}_queue_wait", time.perf_counter() - enqueued_at)
+                if self.processes:
+                    call = functools.partial(fn, *args, **kwargs)
+                else:
+                    # Copy the context so stage timings inside fn are attributed to the calling request
+                    call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+                try:
+                    result = await loop.run_in_executor(self._executor, call)
+                except BrokenProcessPool:
+                    # A worker died (e.g. killed for memory), later calls get a fresh pool
+                    self.failed += 1
+                    self._executor = self._create_executor()
+                    raise
+                except Exception:
+                    self.failed += 1
+                    raise
+                finally:
+                    self.active -= 1
+                self.completed += 1
+                return result
+        finally:
+            if waiting:
+                # Cancelled while still queued
+                self.queued -= 1
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "queue_depth": self.queued,
+            "active": self.active,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
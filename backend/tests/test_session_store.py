@@ -0,0 +1,71 @@
+# SQLite session store: deleting sessions that have documents, explicitly and when idle
+import asyncio
+import os
+import time
+
+from services.session_store import SQLiteSessionRepository
+
+
+def document(name: str) -> dict:
+    return {"filename": name, "document_id": f"doc-{name}", "uploaded_at": "2025-01-01T00:00:00", "size": 1, "content_type": "text/plain"}
+
+
+def make_store(tmp_path) -> SQLiteSessionRepository:
+    return SQLiteSessionRepository(os.path.join(tmp_path, "sessions.db"))
+
+
+def test_delete_session_with_documents(tmp_path):
+    async def run():
+        store = make_store(tmp_path)
+        await store.create_session("s1", "assistant-1", "thread-1")
+        await store.add_document("s1", document("a.txt"))
+
+        assert await store.delete_session("s1") is True
+        assert await store.get_session("s1") is None
+        assert await store.list_documents("s1") == []
+        assert await store.delete_session("s1") is False
+
+    asyncio.run(run())
+
+
+def test_idle_delete_only_removes_idle_sessions(tmp_path):
+    async def run():
+        store = make_store(tmp_path)
+        for session_id in ("idle", "active"):
+            await store.create_session(session_id, f"assistant-{session_id}", f"thread-{session_id}")
+            await store.add_document(session_id, document(f"{session_id}.txt"))
+        now = time.time()
+        # record_access never moves an access back, age the session directly
+        with store._pool.connection() as conn, conn:
+            conn.execute("UPDATE sessions SET last_accessed_at = ? WHERE session_id = 'idle'", (now - 3600,))
+
+        idle_before = now - 60
+        assert [s["session_id"] for s in await store.list_idle_sessions(idle_before, 10)] == ["idle"]
+        assert await store.delete_session("active", idle_before=idle_before) is False
+        assert await store.delete_session("idle", idle_before=idle_before) is True
+
+        assert await store.get_session("idle") is None
+        assert await store.list_documents("idle") == []
+        assert await store.get_session("active") is not None
+        assert len(await store.list_documents("active")) == 1
+
+    asyncio.run(run())
+
+
+def test_deleted_session_stays_pending_until_remote_deleted(tmp_path):
+    async def run():
+        store = make_store(tmp_path)
+        await store.create_session("s1", "assistant-1", "thread-1")
+        assert await store.delete_session("s1") is True
+
+        pending = await store.pending_remote_deletions(time.time() + 1, 10)
+        assert pending == [{"session_id": "s1", "assistant_id": "assistant-1", "thread_id": "thread-1"}]
+        assert await store.pending_remote_deletions(time.time() - 60, 10) == []
+
+        # A new store on the same file (a restart, another worker) still sees it
+        assert await make_store(tmp_path).pending_remote_deletions(time.time() + 1, 10) == pending
+
+        await store.remote_deleted(pending[0])
+        assert await store.pending_remote_deletions(time.time() + 1, 10) == []
+
+    asyncio.run(run())